@@ -0,0 +1,176 @@
+"""
+ANN Index - Approximate nearest-neighbour search over article embeddings.
+
+An IVF-flat index: the unit-length embedding rows are clustered with
+spherical k-means into ``nlist`` cells. A query scores the cell centroids,
+then scores exactly only the rows of its ``nprobe`` most similar cells.
+``nprobe`` trades recall for latency: nprobe == nlist is an exhaustive
+(exact) search.
+
+The index stores only centroids and cell membership. Row vectors stay in
+the memory-mapped embedding matrix the index was built from.
+
+File format (``.npz``): centroids (nlist, dim) float32, list_offsets
+(nlist + 1) int64, list_ids (rows) int32 — cell c holds the rows
+list_ids[list_offsets[c]:list_offsets[c + 1]], in ascending order.
+"""
+
+import os
+from typing import Optional
+
+import numpy as np
+
+from agents.embeddings import remove_stale_versions, top_k
+
+# Codes with fewer rows than this are searched exactly by default: below
+# it a brute-force matrix product takes only a few milliseconds
+# (see `run_agents.py bench ann`)
+ANN_MIN_ROWS = 50000
+DEFAULT_NPROBE = 16
+KMEANS_ITERATIONS = 12
+# k-means trains on at most this many rows per cell
+TRAIN_ROWS_PER_LIST = 64
+_ASSIGN_CHUNK = 8192
+
+
+def default_nlist(rows: int) -> int:
+    """About 4·sqrt(rows) cells: a few hundred rows per cell at 10^5 rows."""
+    return max(1, min(rows, int(4 * np.sqrt(rows))))
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Index of the most similar centroid for every row (chunked)."""
+    out = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), _ASSIGN_CHUNK):
+        chunk = np.asarray(vectors[start:start + _ASSIGN_CHUNK])
+        out[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return out
+
+
+class IVFFlatIndex:
+    """Inverted-file index with exact re-scoring inside the probed cells."""
+
+    def __init__(
+        self,
+        centroids: np.ndarray,
+        list_offsets: np.ndarray,
+        list_ids: np.ndarray,
+        vectors: np.ndarray,
+    ):
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_ids = list_ids
+        self.vectors = vectors
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def build(
+        cls,
+        vectors: np.ndarray,
+        nlist: Optional[int] = None,
+        iterations: int = KMEANS_ITERATIONS,
+        seed: int = 0,
+    ) -> "IVFFlatIndex":
+        """Cluster the unit rows of ``vectors`` with spherical k-means."""
+        rows = len(vectors)
+        nlist = min(nlist or default_nlist(rows), rows) if rows else 0
+        rng = np.random.default_rng(seed)
+        if nlist == 0:
+            dim = vectors.shape[1] if vectors.ndim == 2 else 0
+            return cls(
+                np.zeros((0, dim), np.float32), np.zeros(1, np.int64),
+                np.zeros(0, np.int32), vectors,
+            )
+
+        sample = np.sort(rng.choice(rows, min(rows, nlist * TRAIN_ROWS_PER_LIST), replace=False))
+        train = np.asarray(vectors[sample], dtype=np.float32)
+        centroids = train[rng.choice(len(train), nlist, replace=False)].copy()
+
+        for _ in range(iterations):
+            assign = _assign(train, centroids)
+            order = np.argsort(assign, kind="stable")
+            counts = np.bincount(assign, minlength=nlist)
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+            filled = counts > 0
+            sums = np.zeros_like(centroids)
+            sums[filled] = np.add.reduceat(train[order], starts[filled], axis=0)
+            # Re-seed empty cells with random training rows
+            empty = np.flatnonzero(~filled)
+            if len(empty):
+                sums[empty] = train[rng.choice(len(train), len(empty), replace=False)]
+            centroids = _normalize(sums).astype(np.float32)
+
+        assign = _assign(vectors, centroids)
+        list_ids = np.argsort(assign, kind="stable").astype(np.int32)
+        list_offsets = np.concatenate(([0], np.cumsum(np.bincount(assign, minlength=nlist))))
+        return cls(centroids, list_offsets.astype(np.int64), list_ids, vectors)
+
+    def search(
+        self, queries: np.ndarray, k: int, nprobe: int = DEFAULT_NPROBE
+    ) -> list[tuple[np.ndarray, np.ndarray]]:
+        """
+        Approximate top-``k`` rows for each unit query vector. Returns one
+        (row ids, similarities) pair per query, best first, ties by row id.
+        """
+        if not self.nlist:
+            return [(np.zeros(0, np.intp), np.zeros(0, np.float32)) for _ in queries]
+        nprobe = max(1, min(nprobe, self.nlist))
+        probes = top_k(queries @ self.centroids.T, nprobe)
+        offsets, list_ids = self.list_offsets, self.list_ids
+
+        results = []
+        for query, cells in zip(queries, probes):
+            ids = np.concatenate([list_ids[offsets[c]:offsets[c + 1]] for c in cells])
+            # Ascending ids: sequential reads of the mmap, ties by corpus order
+            ids.sort()
+            scores = np.asarray(self.vectors[ids]) @ query
+            best = top_k(scores[None, :], k)[0]
+            results.append((ids[best].astype(np.intp), scores[best]))
+        return results
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+
+    def save(self, path: str):
+        """Write the index atomically next to its embedding matrix."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                centroids=self.centroids,
+                list_offsets=self.list_offsets,
+                list_ids=self.list_ids,
+            )
+        os.replace(tmp_path, path)
+        remove_stale_versions(path)
+
+    @classmethod
+    def load(cls, path: str, vectors: np.ndarray) -> Optional["IVFFlatIndex"]:
+        """Load an index for ``vectors``; None if missing or inconsistent."""
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                index = cls(data["centroids"], data["list_offsets"], data["list_ids"], vectors)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠️  Ignoring ANN index {path}: {e}")
+            return None
+        if len(index.list_ids) != len(vectors) or index.centroids.shape[1:] != vectors.shape[1:]:
+            return None
+        return index
+
+
+def index_path(matrix_path: str) -> str:
+    """Where the IVF index of an embedding matrix is stored."""
+    return matrix_path[:-len(".npy")] + ".ivf.npz"
@@ -0,0 +1,562 @@
+"""
+Benchmarks for the Python agents' knowledge base.
+
+Usage:
+    python run_agents.py bench            # run every benchmark
+    python run_agents.py bench load       # run one benchmark
+"""
+
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from agents.legal_knowledge_base import Article, LegalKnowledgeBase
+
+
+def _quiet_load(**kwargs) -> LegalKnowledgeBase:
+    """Load a fresh knowledge base without the per-code progress output."""
+    return LegalKnowledgeBase(verbose=False, **kwargs).load()
+
+
+def _timed(fn, repeats: int) -> list[float]:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def _report(label: str, timings: list[float]):
+    print(
+        f"   {label:<28} min {min(timings):8.1f} ms   "
+        f"median {statistics.median(timings):8.1f} ms   (n={len(timings)})"
+    )
+
+
+def bench_load(repeats: int = 5):
+    """Knowledge base load time: JSON rebuild vs. binary snapshot."""
+    print("⏱️  Knowledge base load time")
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot_path = os.path.join(tmp, "kb.snapshot")
+
+        json_times = _timed(lambda: _quiet_load(use_snapshot=False), repeats)
+        _quiet_load(snapshot_path=snapshot_path)  # write the snapshot once
+        snapshot_times = _timed(lambda: _quiet_load(snapshot_path=snapshot_path), repeats)
+
+        _report("JSON parse + index build", json_times)
+        _report("snapshot (mmap)", snapshot_times)
+        print(
+            f"   speed-up: {statistics.median(json_times) / statistics.median(snapshot_times):.1f}x"
+            f"   snapshot size: {os.path.getsize(snapshot_path) / 1e6:.1f} MB"
+        )
+
+
+def bench_lazy(repeats: int = 5):
+    """Time to the first single-code answer: eager vs. lazy loading."""
+    print("⏱️  First exact lookup (Art. 29, Código de Trabajo)")
+
+    def first_answer(**kwargs):
+        kb = LegalKnowledgeBase(verbose=False, **kwargs).load()
+        assert kb.find_article("codigo-trabajo", 29)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot_path = os.path.join(tmp, "kb.snapshot")
+        _quiet_load(snapshot_path=snapshot_path)
+        for label, kwargs in (
+            ("JSON", {"use_snapshot": False}),
+            ("snapshot", {"snapshot_path": snapshot_path}),
+        ):
+            eager = _timed(lambda: first_answer(lazy=False, **kwargs), repeats)
+            lazy = _timed(lambda: first_answer(lazy=True, **kwargs), repeats)
+            _report(f"{label}, eager", eager)
+            _report(f"{label}, lazy", lazy)
+
+
+@dataclass
+class _DataclassArticle:
+    """The previous Article layout (a plain dataclass), kept for comparison."""
+    code_id: str
+    code_name: str
+    law_number: str
+    article_number: int
+    title: str
+    content: str
+
+
+def _allocated(build) -> tuple[int, object]:
+    """Bytes newly allocated (and still alive) by ``build()``."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before, result
+
+
+def bench_memory():
+    """Per-article object overhead: dataclass vs. slotted Article."""
+    print("🧠 Article memory overhead (excluding the shared title/content strings)")
+    kb = _quiet_load()
+    articles = [art for code in kb.codes.values() for art in code.articles]
+    n = len(articles)
+
+    # Rebuild the articles with both layouts over the *same* string objects,
+    # so only the per-object overhead is measured. The list itself is
+    # counted in both and subtracted.
+    list_bytes, _ = _allocated(lambda: [None] * n)
+    old_bytes, old = _allocated(lambda: [
+        _DataclassArticle(a.code_id, a.code_name, a.law_number, a.article_number, a.title, a.content)
+        for a in articles
+    ])
+    new_bytes, new = _allocated(lambda: [
+        Article(a.code, a.article_id, a.article_number, a.title, a.content)
+        for a in articles
+    ])
+    old_per = (old_bytes - list_bytes) / n
+    new_per = (new_bytes - list_bytes) / n
+    print(f"   articles                     {n}")
+    print(f"   dataclass + __dict__         {old_per:8.1f} B/article   {old_per * n / 1e6:6.2f} MB total")
+    print(f"   slotted Article              {new_per:8.1f} B/article   {new_per * n / 1e6:6.2f} MB total")
+    print(f"   saved per worker: {(old_per - new_per) * n / 1e6:.2f} MB")
+    del old, new
+
+    total_bytes, kb = _allocated(lambda: _quiet_load())
+    print(f"   whole knowledge base (snapshot load): {total_bytes / 1e6:.1f} MB Python heap"
+          f" + mapped index")
+
+
+SEMANTIC_QUERIES = [
+    "despido sin justa causa", "contrato de arrendamiento", "robo con violencia",
+    "herencia y testamento", "sociedad anónima acciones", "pensión alimentaria",
+    "prescripción de la acción penal", "jornada laboral extraordinaria",
+]
+
+
+def bench_semantic(repeats: int = 20):
+    """Semantic search latency over the memory-mapped embedding matrices."""
+    print("⏱️  Semantic search (offline hashing provider)")
+    with tempfile.TemporaryDirectory() as tmp:
+        kb = _quiet_load()
+        # Keep the benchmark's matrices out of data/processed/embeddings/
+        kb.data_dir = tmp
+        build = _timed(lambda: (kb._embeddings.clear(), kb.build_embeddings("hashing")), 1)
+        _report("embed corpus + save", build)
+        kb._embeddings.clear()
+        _report("first query (mmap load)", _timed(lambda: kb.search_semantic("despido", provider="hashing"), 1))
+        single = _timed(
+            lambda: [kb.search_semantic(q, provider="hashing") for q in SEMANTIC_QUERIES], repeats
+        )
+        batch = _timed(lambda: kb.search_semantic_batch(SEMANTIC_QUERIES, provider="hashing"), repeats)
+        _report(f"{len(SEMANTIC_QUERIES)} queries, one by one", single)
+        _report(f"{len(SEMANTIC_QUERIES)} queries, batched", batch)
+
+
+def _synthetic_corpus(base, rows: int, rng):
+    """
+    Grow the real article matrix to ``rows`` rows with noisy copies of its
+    rows, standing in for the extra laws we plan to ingest.
+    """
+    import numpy as np
+
+    if rows <= len(base):
+        return np.ascontiguousarray(base[:rows])
+    extra = base[rng.integers(0, len(base), rows - len(base))]
+    extra = extra + rng.normal(0, 0.6 / np.sqrt(base.shape[1]), extra.shape).astype(np.float32)
+    extra /= np.linalg.norm(extra, axis=1, keepdims=True)
+    return np.concatenate([base, extra.astype(np.float32)])
+
+
+def bench_ann(k: int = 10, sizes=(None, 25000, 100000), nprobes=(1, 4, 8, 16, 32)):
+    """IVF-flat recall@k vs. exact search, and latency, across corpus sizes."""
+    import numpy as np
+    from agents.ann_index import IVFFlatIndex
+    from agents.embeddings import article_text, get_embedding_provider, top_k
+
+    print(f"🧭 ANN (IVF-flat) vs. exact cosine search, recall@{k}, hashing embeddings")
+    provider = get_embedding_provider("hashing")
+    kb = _quiet_load()
+    articles = [art for code in kb.codes.values() for art in code.articles]
+    base = provider.embed([article_text(art) for art in articles])
+    rng = np.random.default_rng(0)
+    # Real queries plus the opening words of random articles
+    texts = SEMANTIC_QUERIES + [
+        " ".join(articles[i].content.split()[:8]) for i in rng.integers(0, len(articles), 56)
+    ]
+    queries = provider.embed(texts)
+
+    for rows in sizes:
+        matrix = _synthetic_corpus(base, rows or len(base), rng)
+        start = time.perf_counter()
+        index = IVFFlatIndex.build(matrix)
+        build_s = time.perf_counter() - start
+
+        exact = top_k(queries @ matrix.T, k)
+        # Time exact search one query at a time, as the agents issue them
+        start = time.perf_counter()
+        for query in queries:
+            top_k(query[None, :] @ matrix.T, k)
+        exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        print(f"   {len(matrix):>7} rows  nlist {index.nlist:<5} build {build_s:5.1f} s"
+              f"   exact {exact_ms:6.2f} ms/query")
+        for nprobe in nprobes:
+            start = time.perf_counter()
+            hits = index.search(queries, k, nprobe)
+            ann_ms = (time.perf_counter() - start) * 1000 / len(queries)
+            recall = np.mean([
+                len(set(ids.tolist()) & set(truth.tolist())) / len(truth)
+                for (ids, _), truth in zip(hits, exact)
+            ])
+            print(f"      nprobe {nprobe:<4} recall@{k} {recall:5.3f}   {ann_ms:6.2f} ms/query")
+
+
+# The per-detector regexes that legal_matcher replaced (reference for
+# `bench matcher` and run_agents.py test)
+_LEGACY_SEARCH_TOPICS = [
+    (r'\bcontrat', 'contrato'),
+    (r'\bdespi', 'despido'),
+    (r'\bvacacion', 'vacaciones'),
+    (r'\b(?:aguinaldo|décimo.?tercer)\b', 'aguinaldo'),
+    (r'\b(?:salario|sueldo|remunerac)', 'salario'),
+    (r'\b(?:matrimonio|casar)', 'matrimonio'),
+    (r'\bdivorci', 'divorcio'),
+    (r'\b(?:herencia|hered)', 'herencia'),
+    (r'\b(?:propiedad|inmueble|terreno|finca)\b', 'propiedad'),
+    (r'\b(?:arrendamiento|alquiler|inquilin)', 'arrendamiento'),
+    (r'\b(?:sociedad|empresa|compañía)\b', 'sociedad'),
+    (r'\b(?:prescripci|prescrib)', 'prescripción'),
+    (r'\b(?:obligaci|deuda)', 'obligación'),
+    (r'\b(?:delito|crimen|criminal)\b', 'delito'),
+    (r'\b(?:homicidio|asesinat|matar)\b', 'homicidio'),
+    (r'\b(?:robo|hurto|robar)\b', 'robo'),
+    (r'\b(?:estafa|fraude|engaño)\b', 'estafa'),
+    (r'\b(?:daños|perjuicios|indemnizaci)', 'daños'),
+    (r'\b(?:embargo|embargar)\b', 'embargo'),
+    (r'\b(?:alimento|pensión.?alimentaria|manutenci)', 'alimentos'),
+    (r'\b(?:jornada|horas.?extra|horario)\b', 'jornada laboral'),
+    (r'\bpreaviso\b', 'preaviso'),
+    (r'\bcesant[ií]a\b', 'cesantía'),
+    (r'\b(?:garantía|fianza)\b', 'garantía'),
+    (r'\bhipoteca', 'hipoteca'),
+    (r'\b(?:testamento|sucesi)', 'testamento'),
+    (r'\busufruct', 'usufructo'),
+    (r'\bservidumbre', 'servidumbre'),
+    (r'\b(?:posesi[oó]n|poseedor)\b', 'posesión'),
+    (r'\b(?:compraventa|compra|venta)\b', 'compraventa'),
+    (r'\b(?:donaci[oó]n|donar)\b', 'donación'),
+    (r'\b(?:poder|mandato|poderdante)\b', 'mandato'),
+    (r'\bresponsabilidad\b', 'responsabilidad'),
+    (r'\b(?:capacidad|incapacidad|menor)\b', 'capacidad'),
+    (r'\b(?:persona.?jur[ií]dica|asociaci)', 'persona jurídica'),
+    (r'\b(?:comerciant|actividad.?comercial)\b', 'comerciante'),
+    (r'\b(?:quiebra|insolvencia)\b', 'quiebra'),
+    (r'\b(?:t[ií]tulo.?valor|letra.?de.?cambio|pagar[eé]|cheque)\b', 'títulos valores'),
+    (r'\b(?:trabajador|patrono|empleador|emplead)', 'relación laboral'),
+    (r'\b(?:sindicato|huelga)\b', 'sindicato'),
+    (r'\b(?:seguridad.?social|ccss)\b', 'seguridad social'),
+    (r'\bjusta.?causa\b', 'despido'),
+    (r'\b(?:derecho|derechos)\b.*\b(?:laboral|trabajador)', 'relación laboral'),
+]
+_LEGACY_DOCUMENT_TYPES = [
+    (r'\bcontrato\b', 'Contrato'),
+    (r'\bconvenio\b', 'Convenio'),
+    (r'\bdemanda\b', 'Demanda'),
+    (r'\brecurso.de.amparo\b', 'Recurso de Amparo'),
+    (r'\bapelaci[oó]n\b', 'Apelación'),
+    (r'\btestamento\b', 'Testamento'),
+    (r'\bescritura\b', 'Escritura Pública'),
+    (r'\bpoder\b.*\bespecial\b', 'Poder Especial'),
+    (r'\bpoder\b.*\bgeneral\b', 'Poder General'),
+    (r'\bnotificaci[oó]n\b', 'Notificación'),
+    (r'\bresoluci[oó]n\b', 'Resolución'),
+    (r'\bsentencia\b', 'Sentencia'),
+    (r'\bdenuncia\b', 'Denuncia'),
+    (r'\bquerella\b', 'Querella'),
+    (r'\barrendamiento\b', 'Contrato de Arrendamiento'),
+    (r'\bcompraventa\b', 'Contrato de Compraventa'),
+    (r'\blaboral\b.*\bcontrato\b|\bcontrato\b.*\btrabajo\b', 'Contrato Laboral'),
+    (r'\bsociedad\b.*\ban[oó]nima\b', 'Constitución de Sociedad'),
+    (r'\bfideicomiso\b', 'Fideicomiso'),
+    (r'\bhipoteca\b', 'Hipoteca'),
+    (r'\bpagaré\b', 'Pagaré'),
+    (r'\bletra.de.cambio\b', 'Letra de Cambio'),
+]
+_LEGACY_DOCUMENT_TOPICS = [
+    ("contrato", ["contrato", "cláusula", "obligación", "acuerdo"]),
+    ("arrendamiento", ["arrendamiento", "alquiler", "inquilino", "arrendatario"]),
+    ("compraventa", ["compraventa", "precio", "vendedor", "comprador"]),
+    ("trabajo", ["trabajador", "patrono", "empleador", "salario", "despido", "laboral"]),
+    ("sociedad", ["sociedad", "acciones", "socios", "capital social", "asamblea"]),
+    ("propiedad", ["propiedad", "inmueble", "finca", "terreno", "inscripción"]),
+    ("herencia", ["herencia", "heredero", "testamento", "sucesión", "legado"]),
+    ("matrimonio", ["matrimonio", "cónyuge", "bienes gananciales"]),
+    ("hipoteca", ["hipoteca", "garantía hipotecaria", "acreedor hipotecario"]),
+    ("daños", ["daños", "perjuicios", "indemnización", "responsabilidad"]),
+    ("obligaciones", ["obligación", "acreedor", "deudor", "pago", "mora"]),
+    ("prescripción", ["prescripción", "caducidad", "plazo"]),
+    ("delito", ["delito", "pena", "imputado", "víctima", "denuncia"]),
+    ("familia", ["alimentos", "custodia", "patria potestad", "divorcio"]),
+    ("títulos valores", ["letra de cambio", "pagaré", "cheque", "título valor"]),
+    ("comerciante", ["comerciante", "registro mercantil", "empresa"]),
+]
+_LEGACY_QUERY_CODE_HINTS = {
+    "civil": "codigo-civil", "comercio": "codigo-comercio", "penal": "codigo-penal",
+    "procesal penal": "codigo-procesal-penal", "procesal": "codigo-procesal-penal",
+    "trabajo": "codigo-trabajo", "laboral": "codigo-trabajo",
+}
+_LEGACY_DOC_CODE_MAP = {
+    "civil": "codigo-civil", "comercio": "codigo-comercio", "penal": "codigo-penal",
+    "trabajo": "codigo-trabajo", "laboral": "codigo-trabajo", "procesal": "codigo-procesal-penal",
+}
+
+
+def legacy_detectors(text: str) -> dict:
+    """Every detector's answer for ``text``, computed with one regex pass per rule."""
+    import re
+
+    text_lower = text.lower()
+    search_topics = []
+    for pattern, topic in _LEGACY_SEARCH_TOPICS:
+        if topic not in search_topics and re.search(pattern, text_lower, re.IGNORECASE):
+            search_topics.append(topic)
+    document_type = next(
+        (doc_type for pattern, doc_type in _LEGACY_DOCUMENT_TYPES if re.search(pattern, text_lower)),
+        "Documento Legal (tipo no identificado)",
+    )
+    document_topics = [
+        topic for topic, keywords in _LEGACY_DOCUMENT_TOPICS if any(kw in text_lower for kw in keywords)
+    ]
+
+    ranges = [(int(m.group(1)), int(m.group(2))) for m in re.finditer(
+        r'(?:art[ií]culos?|arts?\.?)\s*(\d+)\s*(?:al|a|hasta)\s*(\d+)', text, re.IGNORECASE
+    )]
+    # Reversed ranges ("15 al 10") keep their first article, as in the original agent
+    range_starts = {start for start, end in ranges if end >= start}
+    query_code = next((code for key, code in _LEGACY_QUERY_CODE_HINTS.items() if key in text_lower), None)
+    query_references = [
+        {"number": int(m.group(1)), "code_hint": query_code}
+        for m in re.finditer(r'(?:art[ií]culos?|arts?\.?)\s*(\d+)', text, re.IGNORECASE)
+        if int(m.group(1)) not in range_starts
+    ] + [{"number": start, "end": end, "code_hint": query_code} for start, end in ranges if end >= start]
+
+    document_references, seen = [], set()
+    for m in re.finditer(
+        r'(?:art[ií]culos?|arts?\.?)\s*(\d+)(?:\s*(?:del|de\s+la?|al)\s*)?'
+        r'(?:(?:c[oó]digo|ley)\s+(?:de\s+)?)?'
+        r'(civil|comercio|penal|trabajo|laboral|procesal)?', text, re.IGNORECASE,
+    ):
+        key = (int(m.group(1)), _LEGACY_DOC_CODE_MAP.get(m.group(2).lower()) if m.group(2) else None)
+        if key not in seen:
+            seen.add(key)
+            document_references.append({"number": key[0], "code_hint": key[1]})
+
+    return {
+        "search_topics": search_topics,
+        "document_type": document_type,
+        "document_topics": document_topics,
+        "query_references": query_references,
+        "document_references": document_references,
+    }
+
+
+def bench_matcher(repeats: int = 5, target_chars: int = 600_000):
+    """All query/document detectors on a long document: one regex per rule vs. one scan."""
+    from agents.legal_matcher import scan_legal_text
+
+    sample_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ejemplo-contrato.txt")
+    with open(sample_path, encoding="utf-8") as f:
+        sample = f.read()
+    # About 200 pages of contract text
+    document = "\n".join([sample] * max(1, target_chars // len(sample)))
+    print(f"🔎 Detectors over a {len(document) / 1000:.0f} kB document")
+
+    def scan():
+        scan_legal_text.cache_clear()
+        return scan_legal_text(document)
+
+    _report("per-detector regexes", _timed(lambda: legacy_detectors(document), repeats))
+    _report("single-pass scan", _timed(scan, repeats))
+    signals = scan()
+    print(f"   {len(signals.search_topics)} topics, {len(signals.document_topics)} document topics,"
+          f" {len(signals.references)} article references, type: {signals.document_type}")
+
+
+def bench_async(conversations=(1, 50, 200), ttft: float = 0.3, token_delay: float = 0.01, tokens: int = 50):
+    """Concurrent async conversations against the local mock OpenAI server."""
+    import asyncio
+    from agents.llm import get_async_client
+    from agents.mock_openai import MockOpenAIServer
+    from agents.repository_search_agent import AsyncRepositorySearchAgent
+
+    print(f"🌐 Async agents vs. mock API (TTFT {ttft * 1000:.0f} ms, {tokens} deltas every {token_delay * 1000:.0f} ms)")
+    with MockOpenAIServer(ttft=ttft, token_delay=token_delay, tokens=tokens) as server:
+        async def run_batch(n: int):
+            agents = [AsyncRepositorySearchAgent(api_key="sk-mock") for _ in range(n)]
+            client = get_async_client("sk-mock", server.base_url)
+            first_token: list[float] = []
+
+            async def converse(agent, query):
+                agent.client = client
+                start = time.perf_counter()
+                stream = agent.search_and_respond_stream(query)
+                await stream.__anext__()
+                first_token.append((time.perf_counter() - start) * 1000)
+                async for _ in stream:
+                    pass
+
+            start = time.perf_counter()
+            await asyncio.gather(*(
+                converse(agent, SEMANTIC_QUERIES[i % len(SEMANTIC_QUERIES)]) for i, agent in enumerate(agents)
+            ))
+            return time.perf_counter() - start, sorted(first_token)
+
+        for n in conversations:
+            elapsed, ttfts = asyncio.run(run_batch(n))
+            p95 = ttfts[min(len(ttfts) - 1, int(len(ttfts) * 0.95))]
+            print(f"   {n:>4} conversations   wall {elapsed:6.2f} s   {n / elapsed:6.1f} answers/s"
+                  f"   first token median {statistics.median(ttfts):7.0f} ms   p95 {p95:7.0f} ms")
+
+
+def bench_cache(ttft: float = 0.3, token_delay: float = 0.01, tokens: int = 50):
+    """Answer latency for a repeated question: model round-trip vs. response cache."""
+    from openai import OpenAI
+    from agents.mock_openai import MockOpenAIServer
+    from agents.repository_search_agent import RepositorySearchAgent
+    from agents.response_cache import ResponseCache
+
+    print(f"🗃️  Response cache vs. mock API (TTFT {ttft * 1000:.0f} ms, {tokens} deltas every {token_delay * 1000:.0f} ms)")
+    with MockOpenAIServer(ttft=ttft, token_delay=token_delay, tokens=tokens) as server:
+        client = OpenAI(api_key="sk-mock", base_url=server.base_url)
+        for label, cache in (("no cache", None), ("cached", ResponseCache())):
+            timings = []
+            for query in SEMANTIC_QUERIES * 2:
+                agent = RepositorySearchAgent(api_key="sk-mock", response_cache=cache)
+                agent.client = client
+                start = time.perf_counter()
+                agent.search_and_respond(query)
+                timings.append((time.perf_counter() - start) * 1000)
+            _report(f"{label} (each asked twice)", timings)
+
+
+def bench_embeddings(chunks: int = 2000, ttft: float = 0.1, serial_chunks: int = 50):
+    """Ingestion embeddings against the mock API: one request per chunk vs. concurrent batches."""
+    from openai import OpenAI
+    from agents.mock_openai import MockOpenAIServer
+
+    scripts_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "python")
+    sys.path.insert(0, scripts_dir)
+    from embedding_batches import BatchEmbedder
+
+    kb = _quiet_load()
+    texts = [art.content for code in kb.codes.values() for art in code.articles][:chunks]
+    print(f"📥 Ingestion embeddings vs. mock API ({ttft * 1000:.0f} ms per request, {len(texts)} article chunks)")
+    runs = (
+        ("one request per chunk", dict(batch_size=1, concurrency=1), texts[:serial_chunks], 0),
+        ("batches of 128", dict(batch_size=128, concurrency=1), texts, 0),
+        ("batches of 128, 4 in flight", dict(batch_size=128, concurrency=4), texts, 0),
+        ("... with a 429 every 4th", dict(batch_size=128, concurrency=4), texts, 4),
+    )
+    for label, options, batch_texts, fail_every in runs:
+        with MockOpenAIServer(ttft=ttft, fail_every=fail_every) as server:
+            embedder = BatchEmbedder(OpenAI(api_key="sk-mock", base_url=server.base_url), verbose=False, **options)
+            start = time.perf_counter()
+            vectors = embedder.embed(batch_texts)
+            elapsed = time.perf_counter() - start
+        embedded = sum(vector is not None for vector in vectors)
+        print(f"   {label:<30} {embedded / elapsed:8.1f} chunks/s   {embedder.requests:>4} requests"
+              f"   {embedder.retries:>3} retries   {len(vectors) - embedded} failed")
+
+
+def bench_pgvector(rows: int = 2000, dim: int = 1536, commit_every: int = 500):
+    """
+    Ingestion writes into Postgres + pgvector (DATABASE_URL, e.g. a local
+    pgvector/pgvector container): per-row INSERT vs. execute_values vs. COPY BINARY.
+    """
+    import random
+
+    scripts_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "python")
+    sys.path.insert(0, scripts_dir)
+    from pgvector_writer import BulkWriter, vector_literal
+
+    print(f"🐘 pgvector ingestion writes ({rows} rows, {dim}-dim vectors, commit every {commit_every})")
+    try:
+        import psycopg2
+    except ImportError:
+        print("   ⚠️  Skipped: psycopg2 is not installed (pip install -r scripts/python/requirements.txt)")
+        return
+    if not os.environ.get("DATABASE_URL"):
+        print("   ⚠️  Skipped: set DATABASE_URL to a Postgres with the vector extension")
+        return
+
+    kb = _quiet_load()
+    articles = [art for code in kb.codes.values() for art in code.articles][:rows]
+    rng = random.Random(0)
+    data = [
+        ("Benchmark", "bench", art.title, art.content, [rng.gauss(0.0, 1.0) for _ in range(dim)])
+        for art in articles
+    ]
+    conn = psycopg2.connect(os.environ["DATABASE_URL"])
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "CREATE TEMP TABLE bench_documents (fuente TEXT, materia TEXT, articulo TEXT,"
+                f" contenido TEXT, embedding vector({dim}))"
+            )
+        conn.commit()
+
+        columns = ("fuente", "materia", "articulo", "contenido", "embedding")
+
+        def per_row():
+            with conn.cursor() as cur:
+                for row in data:
+                    cur.execute(
+                        f"INSERT INTO bench_documents ({', '.join(columns)})"
+                        " VALUES (%s, %s, %s, %s, %s::vector)", (*row[:-1], vector_literal(row[-1])),
+                    )
+            conn.commit()
+
+        for label, method in (("INSERT per row", None), ("execute_values", "values"), ("COPY BINARY", "copy")):
+            start = time.perf_counter()
+            if method is None:
+                per_row()
+            else:
+                BulkWriter(conn, table="bench_documents", columns=columns, method=method,
+                           commit_every=commit_every, verbose=False).write(data)
+            elapsed = time.perf_counter() - start
+            with conn.cursor() as cur:
+                cur.execute("SELECT count(*) FROM bench_documents")
+                written = cur.fetchone()[0]
+                cur.execute("TRUNCATE bench_documents")
+            conn.commit()
+            print(f"   {label:<20} {written / elapsed:8.0f} rows/s   ({written} rows in {elapsed:.2f} s)")
+    finally:
+        conn.close()
+
+
+BENCHMARKS = {
+    "load": bench_load,
+    "lazy": bench_lazy,
+    "memory": bench_memory,
+    "semantic": bench_semantic,
+    "ann": bench_ann,
+    "matcher": bench_matcher,
+    "async": bench_async,
+    "cache": bench_cache,
+    "embeddings": bench_embeddings,
+    "pgvector": bench_pgvector,
+}
+
+
+def run(names: list[str]):
+    """Run the named benchmarks (all of them if ``names`` is empty)."""
+    for name in names or list(BENCHMARKS):
+        if name not in BENCHMARKS:
+            print(f"❌ Unknown benchmark: {name}. Available: {', '.join(BENCHMARKS)}")
+            sys.exit(1)
+        BENCHMARKS[name]()
+        print()
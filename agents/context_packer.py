@@ -0,0 +1,194 @@
+"""
+Context Packer - Fit prompt context into a token budget.
+
+Some articles run to tens of thousands of characters, and the agents used to
+paste the full text of every retrieved article into the prompt. The packer
+counts tokens and fills a budget in priority order:
+
+1. Pinned articles (exact references the user asked for) are kept whole
+   whenever they fit.
+2. Ranked results follow in rank order. Each is capped at
+   ``max_article_tokens``.
+
+An article that is over its cap, or does not fit in what is left, is trimmed
+to the passages that mention the query terms. The excerpt carries an explicit
+marker, so the model knows the text is partial. Articles are only dropped
+when not even a short excerpt fits.
+
+Token counts come from an offline approximation of the OpenAI tokenizers
+(count_tokens). It errs slightly high on Spanish legal text, so a packed
+prompt stays within its budget.
+"""
+
+import os
+import re
+import sys
+from dataclasses import dataclass, field
+from typing import Iterable, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from agents.legal_knowledge_base import STOPWORDS, Article
+from agents.text_normalization import fold_query, normalize_text
+
+# Excerpts shorter than this are not worth including
+MIN_EXCERPT_TOKENS = 40
+# Tokens of formatting around each article (headers, citation, quotes)
+ARTICLE_OVERHEAD_TOKENS = 30
+
+TRIM_MARKER = "[… texto recortado: se muestran los pasajes relevantes ({shown} de {total} tokens) …]"
+GAP_MARKER = " […] "
+
+_TOKEN_PIECES = re.compile(r"[^\W\d_]+|\d+|[^\w\s]", re.UNICODE)
+# Passages: sentences (., ;, :) and lines
+_PASSAGE_SPLIT = re.compile(r"(?<=[.;:])\s+|\s*\n\s*")
+
+
+def count_tokens(text: str) -> int:
+    """
+    Approximate token count of ``text`` (no tokenizer download needed).
+
+    A word costs one token per 4 characters (at least one), a number one per
+    3 digits, and each punctuation mark one.
+    """
+    tokens = 0
+    for piece in _TOKEN_PIECES.findall(text):
+        if piece[0].isdigit():
+            tokens += (len(piece) + 2) // 3
+        elif piece[0].isalpha():
+            tokens += (len(piece) + 3) // 4
+        else:
+            tokens += 1
+    return tokens
+
+
+def query_terms(*texts: str) -> list[str]:
+    """Accent-folded content words of ``texts`` (stopwords and short words removed)."""
+    terms = []
+    for text in texts:
+        terms.extend(t for t in fold_query(text).split() if len(t) >= 4 and t not in STOPWORDS)
+    return list(dict.fromkeys(terms))
+
+
+def _passages(text: str) -> list[tuple[int, int]]:
+    """(start, end) spans of the non-blank passages of ``text``."""
+    spans, start = [], 0
+    for match in _PASSAGE_SPLIT.finditer(text):
+        if text[start:match.start()].strip():
+            spans.append((start, match.start()))
+        start = match.end()
+    if text[start:].strip():
+        spans.append((start, len(text)))
+    return spans
+
+
+def excerpt(text: str, terms: Iterable[str], max_tokens: int, keep_first: int = 0) -> str:
+    """
+    The passages of ``text`` that mention ``terms``, within ``max_tokens``.
+
+    Passages are ranked by how many distinct terms they contain (ties: the
+    earlier passage) and reassembled in their original order, with a gap
+    marker where passages were left out. The first ``keep_first`` passages
+    are always kept (e.g. a contract's parties). Returns ``text`` itself if
+    it already fits.
+    """
+    total = count_tokens(text)
+    if total <= max_tokens:
+        return text
+
+    budget = max_tokens - count_tokens(TRIM_MARKER.format(shown=max_tokens, total=total))
+    spans = _passages(text)
+    costs = [count_tokens(text[start:end]) for start, end in spans]
+    terms = list(terms)
+    scores = [
+        sum(term in folded for term in terms)
+        for folded in (normalize_text(text[start:end]) for start, end in spans)
+    ] if terms else [0] * len(spans)
+
+    head = list(range(min(keep_first, len(spans))))
+    order = head + sorted(range(len(head), len(spans)), key=lambda i: (-scores[i], i))
+    gap_cost = count_tokens(GAP_MARKER)
+    chosen, used = [], 0
+    for i in order:
+        cost = costs[i] + gap_cost
+        if used + cost > budget:
+            if i < keep_first or scores[i]:
+                continue  # a shorter relevant passage may still fit
+            break
+        chosen.append(i)
+        used += cost
+
+    if chosen:
+        # Contiguous passages are copied verbatim (line breaks included)
+        parts, run_start, previous = [], None, None
+        for i in sorted(chosen):
+            if previous is None or i != previous + 1:
+                if run_start is not None:
+                    parts.append(text[spans[run_start][0]:spans[previous][1]])
+                run_start = i
+            previous = i
+        parts.append(text[spans[run_start][0]:spans[previous][1]])
+        shown_text = GAP_MARKER.join(parts)
+    else:
+        # A single passage longer than the whole budget: keep its beginning
+        start, end = spans[order[0]] if spans else (0, len(text))
+        words = text[start:end].split()
+        while words and count_tokens(" ".join(words)) > budget:
+            words = words[: len(words) * 3 // 4]
+        shown_text = " ".join(words)
+    return f"{shown_text}\n{TRIM_MARKER.format(shown=count_tokens(shown_text), total=total)}"
+
+
+@dataclass
+class PackedArticle:
+    article: Article
+    text: str  # full content, or an excerpt ending with the trim marker
+    tokens: int
+    trimmed: bool = False
+
+
+@dataclass
+class PackedContext:
+    articles: list[PackedArticle] = field(default_factory=list)
+    tokens: int = 0
+    dropped: list[Article] = field(default_factory=list)
+
+    @property
+    def trimmed(self) -> int:
+        return sum(packed.trimmed for packed in self.articles)
+
+    def summary(self) -> str:
+        """One search-log line describing the packing."""
+        line = f"🧮 Contexto: {len(self.articles)} artículos, ~{self.tokens:,} tokens"
+        if self.trimmed:
+            line += f", {self.trimmed} recortados a los pasajes relevantes"
+        if self.dropped:
+            line += f", {len(self.dropped)} omitidos por el límite de tokens"
+        return line
+
+
+def pack_articles(
+    articles: list[Article],
+    budget: int,
+    terms: Iterable[str] = (),
+    pinned: int = 0,
+    max_article_tokens: Optional[int] = None,
+) -> PackedContext:
+    """
+    Fit ``articles`` (highest priority first) into ``budget`` tokens.
+
+    The first ``pinned`` articles are only trimmed when they do not fit in
+    what is left; the others are also capped at ``max_article_tokens``.
+    """
+    terms = list(terms)
+    packed = PackedContext()
+    for i, art in enumerate(articles):
+        available = budget - packed.tokens - ARTICLE_OVERHEAD_TOKENS
+        limit = available if i < pinned or max_article_tokens is None else min(available, max_article_tokens)
+        if limit < MIN_EXCERPT_TOKENS:
+            packed.dropped.append(art)
+            continue
+        text = excerpt(art.content, terms, limit)
+        tokens = count_tokens(text) + ARTICLE_OVERHEAD_TOKENS
+        packed.articles.append(PackedArticle(art, text, tokens, trimmed=text is not art.content))
+        packed.tokens += tokens
+    return packed
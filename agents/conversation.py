@@ -0,0 +1,140 @@
+"""
+Conversation - Compact, token-budgeted chat history for the agents.
+
+The agents used to keep every user message verbatim, including its CONTEXT
+block with the full text of every article. After a few turns, each request
+re-sent tens of thousands of tokens of duplicated articles, trimmed only by
+a "last 20 messages" rule.
+
+A Conversation stores each turn as the raw query, the answer, and the ids of
+the articles its context used. Each request is rebuilt from that:
+
+- Past turns are sent as query/answer pairs, without their contexts.
+- Articles of past turns are added once to the current request's context,
+  de-duplicated against the newly retrieved ones (``article_ids``).
+- Once the past turns exceed ``token_budget``, the oldest are folded into a
+  rolling summary (one line per turn, capped at ``summary_budget``).
+
+The summary is extractive (query plus the answer's conclusion), so it costs
+no extra model call.
+"""
+
+import os
+import re
+import sys
+from dataclasses import dataclass, field
+from typing import Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from agents.context_packer import count_tokens
+
+# Tokens of past query/answer pairs kept verbatim
+HISTORY_TOKEN_BUDGET = 4000
+# Tokens of the rolling summary of older turns (0 disables it)
+SUMMARY_TOKEN_BUDGET = 600
+SUMMARY_QUERY_TOKENS = 40
+SUMMARY_ANSWER_TOKENS = 80
+
+SUMMARY_HEADER = "RESUMEN DE LA CONVERSACIÓN ANTERIOR (consultas más antiguas):"
+
+# "4. **Conclusión**:" / "## CONCLUSIÓN" headings of the agents' answer format
+_CONCLUSION = re.compile(r"(?:\*\*|#\s*|\d\.\s*)conclusi[oó]n[^\n:]*[:\n]", re.IGNORECASE)
+_NEXT_SECTION = re.compile(r"\n\s*(?:\d\.|#|\*\*)")
+
+
+def clip_tokens(text: str, max_tokens: int) -> str:
+    """The first words of ``text`` that fit in ``max_tokens`` ("…" when cut)."""
+    text = " ".join(text.split())
+    if count_tokens(text) <= max_tokens:
+        return text
+    words = text.split()
+    low, high = 0, len(words)
+    while low < high:  # longest prefix that fits
+        mid = (low + high + 1) // 2
+        if count_tokens(" ".join(words[:mid])) < max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return " ".join(words[:low]) + " …"
+
+
+@dataclass
+class Turn:
+    query: str
+    answer: str = ""
+    article_ids: tuple[int, ...] = ()
+    # Knowledge base version the article ids refer to
+    fingerprint: str = ""
+    tokens: int = field(init=False, default=0)
+
+    def __post_init__(self):
+        self.tokens = count_tokens(self.query) + count_tokens(self.answer)
+
+    def summary_line(self) -> str:
+        headings = list(_CONCLUSION.finditer(self.answer))
+        gist = self.answer[headings[-1].end():] if headings else self.answer
+        gist = _NEXT_SECTION.split(gist.strip(), maxsplit=1)[0]
+        return (
+            f"- Consulta: {clip_tokens(self.query, SUMMARY_QUERY_TOKENS)}"
+            f" → Respuesta: {clip_tokens(gist.strip('*: '), SUMMARY_ANSWER_TOKENS)}"
+        )
+
+
+class Conversation:
+    """A system prompt, the recent turns and a rolling summary of older ones."""
+
+    def __init__(
+        self,
+        system_prompt: str,
+        token_budget: int = HISTORY_TOKEN_BUDGET,
+        summary_budget: int = SUMMARY_TOKEN_BUDGET,
+    ):
+        self.system_prompt = system_prompt
+        self.token_budget = token_budget
+        self.summary_budget = summary_budget
+        self.turns: list[Turn] = []
+        self.summary: list[str] = []
+
+    @property
+    def history(self) -> list[dict]:
+        """The compact history as chat messages (without the current request)."""
+        messages = [{"role": "system", "content": self.system_prompt}]
+        if self.summary:
+            messages.append({"role": "system", "content": "\n".join([SUMMARY_HEADER, *self.summary])})
+        for turn in self.turns:
+            messages.append({"role": "user", "content": turn.query})
+            messages.append({"role": "assistant", "content": turn.answer})
+        return messages
+
+    def messages(self, user_message: str) -> list[dict]:
+        """The messages of a request: history, then ``user_message``."""
+        return self.history + [{"role": "user", "content": user_message}]
+
+    def article_ids(self, fingerprint: Optional[str] = None) -> list[int]:
+        """
+        Context article ids of the recent turns, most recent first and
+        de-duplicated. With ``fingerprint``, only ids from that knowledge
+        base version (ids may point elsewhere after a reload).
+        """
+        ids: dict[int, None] = {}
+        for turn in reversed(self.turns):
+            if fingerprint is None or turn.fingerprint == fingerprint:
+                ids.update(dict.fromkeys(turn.article_ids))
+        return list(ids)
+
+    def record(self, turn: Turn):
+        """Add a completed turn, then fold the oldest ones over budget into the summary."""
+        self.turns.append(turn)
+        while len(self.turns) > 1 and sum(t.tokens for t in self.turns) > self.token_budget:
+            oldest = self.turns.pop(0)
+            if self.summary_budget > 0:
+                self.summary.append(oldest.summary_line())
+        while self.summary and count_tokens("\n".join(self.summary)) > self.summary_budget:
+            self.summary.pop(0)
+
+    def reset(self):
+        self.turns.clear()
+        self.summary.clear()
+
+    def __len__(self) -> int:
+        return len(self.turns)
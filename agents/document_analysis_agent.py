@@ -26,17 +26,25 @@ Usage:
     python -m agents.document_analysis_agent path/to/document.pdf
 """
 
+import asyncio
 import json
 import os
 import re
 import sys
-from typing import Optional
+from typing import AsyncIterator, Iterator, Optional
 
 from openai import OpenAI
 from dotenv import load_dotenv
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from agents.legal_knowledge_base import get_knowledge_base, Article
+from agents.kb_holder import get_kb_holder
+from agents.context_packer import PackedArticle, count_tokens, excerpt, pack_articles, query_terms
+from agents.conversation import Conversation, Turn
+from agents.legal_knowledge_base import LEGAL_TERM_EXPANSIONS, Article, LegalKnowledgeBase
+from agents.legal_matcher import scan_legal_text
+from agents.llm import astream_reply, get_async_client, print_stream, stream_reply
+from agents.response_cache import CacheSlot, ResponseCache, get_response_cache
+from agents.retrieval import ArticleCollector, resolve_references
 
 # Load environment variables
 load_dotenv()
@@ -47,8 +55,17 @@ load_dotenv()
 
 MODEL = "gpt-4o-mini"
 MAX_CONTEXT_ARTICLES = 20
+MAX_FOLLOWUP_ARTICLES = 5  # Extra articles added to a follow-up question
 MAX_TOKENS_RESPONSE = 3000
-MAX_DOCUMENT_CHARS = 15000  # Max chars to send from document (GPT-4o-mini context limit)
+TEMPERATURE = 0.1
+# Token budgets of the prompt sections (see agents/context_packer.py)
+DOCUMENT_TOKEN_BUDGET = 4000  # Longer documents are trimmed to their relevant passages
+DOCUMENT_HEAD_PASSAGES = 8  # Always kept: title, parties, object
+ARTICLES_TOKEN_BUDGET = 6000
+FOLLOWUP_TOKEN_BUDGET = 4000  # New and earlier articles of a follow-up
+FOLLOWUP_DOCUMENT_TOKENS = 2000  # Document passages re-sent with each follow-up
+MAX_ARTICLE_TOKENS = 600  # Per ranked article (exact references may use more)
+NO_DOCUMENT_MESSAGE = "⚠️ No hay documento cargado. Use 'analyze_document' primero."
 
 # System prompt for document analysis
 SYSTEM_PROMPT = """Eres un ABOGADO EXPERTO especializado en el análisis de documentos legales 
@@ -163,39 +180,8 @@ def _strip_rtf(rtf_text: str) -> str:
 # ---------------------------------------------------------------------------
 
 def detect_document_type(text: str) -> str:
-    """Detect the type of legal document from its content."""
-    text_lower = text.lower()
-    
-    patterns = [
-        (r'\bcontrato\b', 'Contrato'),
-        (r'\bconvenio\b', 'Convenio'),
-        (r'\bdemanda\b', 'Demanda'),
-        (r'\brecurso.de.amparo\b', 'Recurso de Amparo'),
-        (r'\bapelaci[oó]n\b', 'Apelación'),
-        (r'\btestamento\b', 'Testamento'),
-        (r'\bescritura\b', 'Escritura Pública'),
-        (r'\bpoder\b.*\bespecial\b', 'Poder Especial'),
-        (r'\bpoder\b.*\bgeneral\b', 'Poder General'),
-        (r'\bnotificaci[oó]n\b', 'Notificación'),
-        (r'\bresoluci[oó]n\b', 'Resolución'),
-        (r'\bsentencia\b', 'Sentencia'),
-        (r'\bdenuncia\b', 'Denuncia'),
-        (r'\bquerella\b', 'Querella'),
-        (r'\barrendamiento\b', 'Contrato de Arrendamiento'),
-        (r'\bcompraventa\b', 'Contrato de Compraventa'),
-        (r'\blaboral\b.*\bcontrato\b|\bcontrato\b.*\btrabajo\b', 'Contrato Laboral'),
-        (r'\bsociedad\b.*\ban[oó]nima\b', 'Constitución de Sociedad'),
-        (r'\bfideicomiso\b', 'Fideicomiso'),
-        (r'\bhipoteca\b', 'Hipoteca'),
-        (r'\bpagaré\b', 'Pagaré'),
-        (r'\bletra.de.cambio\b', 'Letra de Cambio'),
-    ]
-    
-    for pattern, doc_type in patterns:
-        if re.search(pattern, text_lower):
-            return doc_type
-    
-    return "Documento Legal (tipo no identificado)"
+    """Detect the type of legal document from its content (DOCUMENT_TYPE_RULES)."""
+    return scan_legal_text(text).document_type or "Documento Legal (tipo no identificado)"
 
 
 def extract_legal_references_from_doc(text: str) -> list[dict]:
@@ -206,68 +192,28 @@ def extract_legal_references_from_doc(text: str) -> list[dict]:
     referencing specific Civil Code articles).
     """
     results = []
-    
-    # Find "artículo X" patterns in the document
-    pattern = re.compile(
-        r'(?:art[ií]culos?|arts?\.?)\s*(\d+)(?:\s*(?:del|de\s+la?|al)\s*)?'
-        r'(?:(?:c[oó]digo|ley)\s+(?:de\s+)?)?'
-        r'(civil|comercio|penal|trabajo|laboral|procesal)?',
-        re.IGNORECASE
-    )
-    
-    code_map = {
-        "civil": "codigo-civil",
-        "comercio": "codigo-comercio",
-        "penal": "codigo-penal",
-        "trabajo": "codigo-trabajo",
-        "laboral": "codigo-trabajo",
-        "procesal": "codigo-procesal-penal",
-    }
-    
     seen = set()
-    for match in pattern.finditer(text):
-        num = int(match.group(1))
-        code_hint = None
-        if match.group(2):
-            code_hint = code_map.get(match.group(2).lower())
-        
-        key = (num, code_hint)
+    for ref in scan_legal_text(text).references:
+        key = (ref.number, ref.code_hint)
         if key not in seen:
             seen.add(key)
-            results.append({"number": num, "code_hint": code_hint})
+            results.append({"number": ref.number, "code_hint": ref.code_hint})
     
     return results
 
 
 def detect_document_topics(text: str) -> list[str]:
-    """Detect key legal topics in the document for article search."""
-    text_lower = text.lower()
-    
-    topic_checks = [
-        ("contrato", ["contrato", "cláusula", "obligación", "acuerdo"]),
-        ("arrendamiento", ["arrendamiento", "alquiler", "inquilino", "arrendatario"]),
-        ("compraventa", ["compraventa", "precio", "vendedor", "comprador"]),
-        ("trabajo", ["trabajador", "patrono", "empleador", "salario", "despido", "laboral"]),
-        ("sociedad", ["sociedad", "acciones", "socios", "capital social", "asamblea"]),
-        ("propiedad", ["propiedad", "inmueble", "finca", "terreno", "inscripción"]),
-        ("herencia", ["herencia", "heredero", "testamento", "sucesión", "legado"]),
-        ("matrimonio", ["matrimonio", "cónyuge", "bienes gananciales"]),
-        ("hipoteca", ["hipoteca", "garantía hipotecaria", "acreedor hipotecario"]),
-        ("daños", ["daños", "perjuicios", "indemnización", "responsabilidad"]),
-        ("obligaciones", ["obligación", "acreedor", "deudor", "pago", "mora"]),
-        ("prescripción", ["prescripción", "caducidad", "plazo"]),
-        ("delito", ["delito", "pena", "imputado", "víctima", "denuncia"]),
-        ("familia", ["alimentos", "custodia", "patria potestad", "divorcio"]),
-        ("títulos valores", ["letra de cambio", "pagaré", "cheque", "título valor"]),
-        ("comerciante", ["comerciante", "registro mercantil", "empresa"]),
+    """Detect key legal topics in the document for article search (DOCUMENT_TOPIC_RULES)."""
+    return list(scan_legal_text(text).document_topics)
+
+
+def topic_terms(topics: list[str]) -> list[str]:
+    """Passage-selection terms for ``topics``, with their legal term expansions."""
+    expansions = [
+        next((exp for key, exp in LEGAL_TERM_EXPANSIONS.items() if key in topic.lower()), "")
+        for topic in topics
     ]
-    
-    found_topics = []
-    for topic, keywords in topic_checks:
-        if any(kw in text_lower for kw in keywords):
-            found_topics.append(topic)
-    
-    return found_topics
+    return query_terms(*topics, *expansions)
 
 
 # ---------------------------------------------------------------------------
@@ -288,12 +234,14 @@ class DocumentAnalysisAgent:
     6. Supports follow-up questions about the analyzed document
     """
 
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(self, api_key: Optional[str] = None, response_cache: Optional[ResponseCache] = None):
         """
         Initialize the agent.
         
         Args:
             api_key: OpenAI API key. Defaults to OPENAI_API_KEY env var.
+            response_cache: Cache of complete answers. Defaults to the one
+                configured by LEXAI_RESPONSE_CACHE (off when unset).
         """
         self.api_key = api_key or os.environ.get("OPENAI_API_KEY")
         if not self.api_key:
@@ -301,17 +249,28 @@ class DocumentAnalysisAgent:
                 "❌ OPENAI_API_KEY not set. Set it in .env or pass directly."
             )
         
-        self.client = OpenAI(api_key=self.api_key)
-        self.kb = get_knowledge_base()
-        self.conversation_history: list[dict] = []
+        self.client = self._create_client()
+        self.response_cache = response_cache or get_response_cache()
+        self._kb_holder = get_kb_holder()
+        self._kb_holder.get()  # load (or reuse) the shared knowledge base now
+        # Compact history: questions, answers and context article ids
+        self.conversation = Conversation(SYSTEM_PROMPT)
         self.current_document: Optional[str] = None
         self.current_doc_name: Optional[str] = None
         self.current_doc_type: Optional[str] = None
-        
-        self.conversation_history.append({
-            "role": "system",
-            "content": SYSTEM_PROMPT,
-        })
+
+    def _create_client(self):
+        return OpenAI(api_key=self.api_key)
+
+    @property
+    def kb(self) -> LegalKnowledgeBase:
+        """Current knowledge base (changes after a hot reload)."""
+        return self._kb_holder.get()
+
+    @property
+    def conversation_history(self) -> list[dict]:
+        """The history sent with the next request, as chat messages."""
+        return self.conversation.history
 
     def analyze_document(self, file_path: str) -> str:
         """
@@ -326,22 +285,33 @@ class DocumentAnalysisAgent:
         Returns:
             Comprehensive legal analysis with citations.
         """
+        return "".join(self.analyze_document_stream(file_path))
+
+    def analyze_document_stream(self, file_path: str) -> Iterator[str]:
+        """Streaming variant of analyze_document (yields text deltas)."""
+        doc_text, error = self._load_document(file_path)
+        if error:
+            yield error
+            return
+        yield from self.analyze_text_stream(doc_text, document_name=self.current_doc_name)
+
+    def _load_document(self, file_path: str) -> tuple[Optional[str], Optional[str]]:
+        """Extract a file's text. Returns (text, None) or (None, error message)."""
         # Step 1: Extract text
         if not os.path.exists(file_path):
-            return f"❌ Archivo no encontrado: {file_path}"
+            return None, f"❌ Archivo no encontrado: {file_path}"
         
         try:
             doc_text = extract_text_from_file(file_path)
         except Exception as e:
-            return f"❌ Error al procesar el archivo: {e}"
+            return None, f"❌ Error al procesar el archivo: {e}"
         
         if not doc_text.strip():
-            return "❌ El documento está vacío o no se pudo extraer texto."
+            return None, "❌ El documento está vacío o no se pudo extraer texto."
         
         self.current_document = doc_text
         self.current_doc_name = os.path.basename(file_path)
-        
-        return self.analyze_text(doc_text, document_name=self.current_doc_name)
+        return doc_text, None
 
     def analyze_text(self, doc_text: str, document_name: str = "Documento") -> str:
         """
@@ -354,6 +324,59 @@ class DocumentAnalysisAgent:
         Returns:
             Comprehensive legal analysis.
         """
+        return "".join(self.analyze_text_stream(doc_text, document_name))
+
+    def analyze_text_stream(self, doc_text: str, document_name: str = "Documento") -> Iterator[str]:
+        """
+        Streaming variant of analyze_text: yields the analysis in text deltas.
+        The conversation history is updated once the stream completes.
+        """
+        analysis_prompt, articles, fingerprint = self._build_analysis_prompt(doc_text, document_name)
+        yield from stream_reply(
+            self.client,
+            self.conversation,
+            analysis_prompt,
+            turn=self._analysis_turn(articles, fingerprint),
+            error_prefix="❌ Error al consultar GPT-4o-mini",
+            cache=self._cache_slot(f"{document_name}\n{doc_text}", articles, fingerprint),
+            model=MODEL,
+            max_tokens=MAX_TOKENS_RESPONSE,
+            temperature=TEMPERATURE,
+        )
+
+    def _turn(self, query: str, articles: list[Article], fingerprint: str) -> Turn:
+        """
+        How an exchange is remembered: the question and its context article
+        ids, under the fingerprint of the knowledge base they came from.
+        """
+        return Turn(query, article_ids=tuple(art.article_id for art in articles), fingerprint=fingerprint)
+
+    def _analysis_turn(self, articles: list[Article], fingerprint: str) -> Turn:
+        # The document itself is re-sent (budgeted) with each follow-up
+        return self._turn(
+            f'[Análisis del documento "{self.current_doc_name}" ({self.current_doc_type})]', articles, fingerprint
+        )
+
+    def _cache_slot(self, query: str, articles: list[Article], fingerprint: str) -> Optional[CacheSlot]:
+        """Where the answer to ``query`` is cached (None without a response cache)."""
+        if self.response_cache is None:
+            return None
+        return self.response_cache.slot(
+            fingerprint,
+            query,
+            [art.article_id for art in articles],
+            MODEL,
+            self.conversation.history,
+            max_tokens=MAX_TOKENS_RESPONSE,
+            temperature=TEMPERATURE,
+        )
+
+    def _build_analysis_prompt(self, doc_text: str, document_name: str) -> tuple[str, list[Article], str]:
+        """
+        Load the document as current, search the knowledge base and build the
+        analysis prompt. Returns the prompt, the articles in its context and
+        the fingerprint of the knowledge base snapshot they came from.
+        """
         self.current_document = doc_text
         self.current_doc_name = document_name
         
@@ -367,49 +390,59 @@ class DocumentAnalysisAgent:
         # Step 3: Detect topics for keyword search
         topics = detect_document_topics(doc_text)
         
-        # Step 4: Search knowledge base
-        found_articles: list[Article] = []
+        # Step 4: Search knowledge base (one snapshot for the whole request)
+        kb = self.kb
+        found_articles = ArticleCollector(MAX_CONTEXT_ARTICLES)
         search_log: list[str] = [
             f"📄 Tipo de documento detectado: {doc_type}",
             f"📝 Longitud del documento: {len(doc_text):,} caracteres",
         ]
         
-        # 4a: Exact article references found in document
-        for ref in doc_refs:
-            code_hint = ref.get("code_hint")
+        # 4a: Exact article references found in document (one batched lookup)
+        resolved = resolve_references(kb, doc_refs, range_limit=MAX_CONTEXT_ARTICLES)
+        for ref, arts in zip(doc_refs, resolved):
             num = ref["number"]
-            
-            if code_hint:
-                arts = self.kb.find_article(code_hint, num)
-            else:
-                arts = self.kb.find_article_any_code(num)
-            
             if arts:
-                for art in arts:
-                    if art not in found_articles:
-                        found_articles.append(art)
+                found_articles.extend(arts)
                 search_log.append(f"✅ Referencia del documento: Art. {num}")
+        pinned = len(found_articles)
         
         # 4b: Topic-based search
         for topic in topics:
-            remaining = MAX_CONTEXT_ARTICLES - len(found_articles)
+            remaining = found_articles.remaining
             if remaining <= 0:
                 break
-            keyword_results = self.kb.search_by_topic(topic, max_results=min(5, remaining))
-            for art in keyword_results:
-                if art not in found_articles:
-                    found_articles.append(art)
+            keyword_results = kb.search_by_topic(topic, max_results=min(5, remaining))
+            found_articles.extend(keyword_results)
             search_log.append(f"🔍 Tema detectado '{topic}': {len(keyword_results)} arts. relevantes")
         
-        search_log.append(f"\n📚 Total artículos en contexto: {len(found_articles)}")
+        if found_articles.dropped:
+            search_log.append(
+                f"⚠️ {found_articles.dropped} artículos omitidos (límite de {MAX_CONTEXT_ARTICLES} en contexto)"
+            )
         
-        # Step 5: Truncate document if too long
-        doc_for_context = doc_text[:MAX_DOCUMENT_CHARS]
-        if len(doc_text) > MAX_DOCUMENT_CHARS:
-            doc_for_context += f"\n\n[... Documento truncado. Se muestran los primeros {MAX_DOCUMENT_CHARS:,} caracteres de {len(doc_text):,} totales ...]"
+        # Step 5: Fit the articles and the document into their token budgets
+        # (long ones are trimmed to the passages about the detected topics)
+        terms = topic_terms(topics)
+        packed = pack_articles(
+            found_articles.articles,
+            ARTICLES_TOKEN_BUDGET,
+            terms,
+            pinned=pinned,
+            max_article_tokens=MAX_ARTICLE_TOKENS,
+        )
+        search_log.append(packed.summary())
+        search_log.append(f"\n📚 Total artículos en contexto: {len(packed.articles)}")
+        
+        doc_for_context = excerpt(doc_text, terms, DOCUMENT_TOKEN_BUDGET, keep_first=DOCUMENT_HEAD_PASSAGES)
+        if doc_for_context is not doc_text:
+            search_log.append(
+                f"✂️ Documento recortado a sus pasajes relevantes (~{DOCUMENT_TOKEN_BUDGET:,} de"
+                f" {count_tokens(doc_text):,} tokens)"
+            )
         
         # Step 6: Build prompt and send to GPT-4o-mini
-        articles_context = self._build_articles_context(found_articles)
+        articles_context = self._build_articles_context(packed.articles)
         
         analysis_prompt = f"""ANÁLISIS DE DOCUMENTO LEGAL
 
@@ -440,34 +473,7 @@ Proporciona un análisis jurídico PROFESIONAL y COMPLETO del documento:
 6. **CONCLUSIÓN**: Resumen ejecutivo del estado legal del documento
 
 IMPORTANTE: Fundamenta CADA observación en artículos específicos del contexto."""
-
-        self.conversation_history.append({"role": "user", "content": analysis_prompt})
-        
-        try:
-            response = self.client.chat.completions.create(
-                model=MODEL,
-                messages=self.conversation_history,
-                max_tokens=MAX_TOKENS_RESPONSE,
-                temperature=0.1,
-            )
-            
-            assistant_message = response.choices[0].message.content
-            self.conversation_history.append({
-                "role": "assistant",
-                "content": assistant_message,
-            })
-            
-            # Keep history manageable
-            if len(self.conversation_history) > 21:
-                self.conversation_history = (
-                    [self.conversation_history[0]]
-                    + self.conversation_history[-20:]
-                )
-            
-            return assistant_message
-            
-        except Exception as e:
-            return f"❌ Error al consultar GPT-4o-mini: {str(e)}"
+        return analysis_prompt, [p.article for p in packed.articles], kb.fingerprint
 
     def ask_followup(self, question: str) -> str:
         """
@@ -479,97 +485,178 @@ IMPORTANTE: Fundamenta CADA observación en artículos específicos del contexto
         Returns:
             Agent's response.
         """
+        return "".join(self.ask_followup_stream(question))
+
+    def ask_followup_stream(self, question: str) -> Iterator[str]:
+        """Streaming variant of ask_followup (yields text deltas)."""
         if not self.current_document:
-            return "⚠️ No hay documento cargado. Use 'analyze_document' primero."
-        
+            yield NO_DOCUMENT_MESSAGE
+            return
+        
+        followup_prompt, articles, fingerprint = self._build_followup_prompt(question)
+        yield from stream_reply(
+            self.client,
+            self.conversation,
+            followup_prompt,
+            turn=self._turn(question, articles, fingerprint),
+            cache=self._cache_slot(question, articles, fingerprint),
+            model=MODEL,
+            max_tokens=MAX_TOKENS_RESPONSE,
+            temperature=TEMPERATURE,
+        )
+
+    def _build_followup_prompt(self, question: str) -> tuple[str, list[Article], str]:
+        """
+        Search articles for a follow-up question and build its prompt.
+        Returns the prompt, its articles and their knowledge base fingerprint.
+        """
         # Search for specific articles if the question references them
         from agents.repository_search_agent import extract_article_references, detect_search_topics
         
         article_refs = extract_article_references(question)
         topics = detect_search_topics(question)
         
-        additional_articles: list[Article] = []
+        additional_articles = ArticleCollector(MAX_FOLLOWUP_ARTICLES)
+        kb = self.kb
         
-        for ref in article_refs:
-            code_hint = ref.get("code_hint")
-            num = ref["number"]
-            if code_hint:
-                arts = self.kb.find_article(code_hint, num)
-            else:
-                arts = self.kb.find_article_any_code(num)
+        for arts in resolve_references(kb, article_refs, range_limit=MAX_FOLLOWUP_ARTICLES):
             additional_articles.extend(arts)
+        pinned = len(additional_articles)
         
         for topic in topics:
-            remaining = 5 - len(additional_articles)
+            remaining = additional_articles.remaining
             if remaining <= 0:
                 break
             additional_articles.extend(
-                self.kb.search_by_topic(topic, max_results=min(3, remaining))
+                kb.search_by_topic(topic, max_results=min(3, remaining))
             )
         
+        # Past turns are kept without their context: the articles they used
+        # and the document's relevant passages are sent again, once, here
+        earlier = [
+            art for art in kb.find_articles_by_id(self.conversation.article_ids(kb.fingerprint))
+            if art not in additional_articles
+        ]
+        terms = query_terms(question, *topics)
+        packed = pack_articles(
+            additional_articles.articles + earlier,
+            FOLLOWUP_TOKEN_BUDGET,
+            terms,
+            pinned=pinned,
+            max_article_tokens=MAX_ARTICLE_TOKENS,
+        )
+        document = excerpt(
+            self.current_document, terms, FOLLOWUP_DOCUMENT_TOKENS, keep_first=DOCUMENT_HEAD_PASSAGES
+        )
+        
         # Build follow-up prompt
         context = ""
-        if additional_articles:
-            context = "\n\nARTÍCULOS ADICIONALES RELEVANTES:\n"
-            context += self._build_articles_context(additional_articles)
+        if packed.articles:
+            context = "\n\nARTÍCULOS RELEVANTES:\n"
+            context += self._build_articles_context(packed.articles)
         
         followup_prompt = f"""PREGUNTA DE SEGUIMIENTO sobre el documento "{self.current_doc_name}" ({self.current_doc_type}):
 
 {question}
-{context}
+
+{'='*60}
+📄 DOCUMENTO (pasajes relevantes):
+{document}
+{'='*60}{context}
 
 Responde basándote en el análisis previo del documento y los artículos disponibles.
 Cita textualmente los artículos cuando sea relevante."""
+        return followup_prompt, [p.article for p in packed.articles], kb.fingerprint
 
-        self.conversation_history.append({"role": "user", "content": followup_prompt})
-        
-        try:
-            response = self.client.chat.completions.create(
-                model=MODEL,
-                messages=self.conversation_history,
-                max_tokens=MAX_TOKENS_RESPONSE,
-                temperature=0.1,
-            )
-            
-            assistant_message = response.choices[0].message.content
-            self.conversation_history.append({
-                "role": "assistant",
-                "content": assistant_message,
-            })
-            
-            if len(self.conversation_history) > 21:
-                self.conversation_history = (
-                    [self.conversation_history[0]]
-                    + self.conversation_history[-20:]
-                )
-            
-            return assistant_message
-            
-        except Exception as e:
-            return f"❌ Error: {str(e)}"
-
-    def _build_articles_context(self, articles: list[Article]) -> str:
-        """Build formatted context string from articles."""
+    def _build_articles_context(self, articles: list[PackedArticle]) -> str:
+        """Build formatted context string from packed articles."""
         if not articles:
             return "⚠️ No se encontraron artículos directamente relevantes en la base de datos."
         
         parts = []
-        for i, art in enumerate(articles, 1):
+        for i, packed in enumerate(articles, 1):
             parts.append(f"\n--- Artículo {i}/{len(articles)} ---")
-            parts.append(f"📌 {art.citation()}")
-            parts.append(f"📝 Texto:")
-            parts.append(f'"{art.content}"')
+            parts.append(f"📌 {packed.article.citation()}")
+            parts.append(f"📝 Extracto:" if packed.trimmed else f"📝 Texto:")
+            parts.append(f'"{packed.text}"')
         
         return "\n".join(parts)
 
     def reset(self):
         """Reset agent state (document and conversation)."""
-        self.conversation_history = [self.conversation_history[0]]
+        self.conversation.reset()
         self.current_document = None
         self.current_doc_name = None
         self.current_doc_type = None
 
 
+class AsyncDocumentAnalysisAgent(DocumentAnalysisAgent):
+    """
+    Async counterpart of DocumentAnalysisAgent (see AsyncRepositorySearchAgent).
+    Text extraction and knowledge base searches run in a worker thread.
+    """
+
+    def _create_client(self):
+        # None: use the running event loop's shared client (get_async_client)
+        return None
+
+    async def analyze_document(self, file_path: str) -> str:
+        """Async analyze_document."""
+        return "".join([delta async for delta in self.analyze_document_stream(file_path)])
+
+    async def analyze_document_stream(self, file_path: str) -> AsyncIterator[str]:
+        """Async analyze_document_stream."""
+        doc_text, error = await asyncio.to_thread(self._load_document, file_path)
+        if error:
+            yield error
+            return
+        async for delta in self.analyze_text_stream(doc_text, document_name=self.current_doc_name):
+            yield delta
+
+    async def analyze_text(self, doc_text: str, document_name: str = "Documento") -> str:
+        """Async analyze_text."""
+        return "".join([delta async for delta in self.analyze_text_stream(doc_text, document_name)])
+
+    async def analyze_text_stream(self, doc_text: str, document_name: str = "Documento") -> AsyncIterator[str]:
+        """Async analyze_text_stream."""
+        analysis_prompt, articles, fingerprint = await asyncio.to_thread(self._build_analysis_prompt, doc_text, document_name)
+        async for delta in self._astream(
+            analysis_prompt,
+            turn=self._analysis_turn(articles, fingerprint),
+            error_prefix="❌ Error al consultar GPT-4o-mini",
+            cache=self._cache_slot(f"{document_name}\n{doc_text}", articles, fingerprint),
+        ):
+            yield delta
+
+    async def ask_followup(self, question: str) -> str:
+        """Async ask_followup."""
+        return "".join([delta async for delta in self.ask_followup_stream(question)])
+
+    async def ask_followup_stream(self, question: str) -> AsyncIterator[str]:
+        """Async ask_followup_stream."""
+        if not self.current_document:
+            yield NO_DOCUMENT_MESSAGE
+            return
+        followup_prompt, articles, fingerprint = await asyncio.to_thread(self._build_followup_prompt, question)
+        async for delta in self._astream(
+            followup_prompt,
+            turn=self._turn(question, articles, fingerprint),
+            cache=self._cache_slot(question, articles, fingerprint),
+        ):
+            yield delta
+
+    def _astream(self, prompt: str, **kwargs) -> AsyncIterator[str]:
+        return astream_reply(
+            self.client or get_async_client(self.api_key),
+            self.conversation,
+            prompt,
+            model=MODEL,
+            max_tokens=MAX_TOKENS_RESPONSE,
+            temperature=TEMPERATURE,
+            **kwargs,
+        )
+
+
 # ---------------------------------------------------------------------------
 # Interactive CLI
 # ---------------------------------------------------------------------------
@@ -578,7 +665,6 @@ def main():
     """Run the document analysis agent in interactive mode."""
     try:
         from rich.console import Console
-        from rich.markdown import Markdown
         from rich.panel import Panel
         USE_RICH = True
     except ImportError:
@@ -612,18 +698,24 @@ def main():
         print(f"\n{e}")
         sys.exit(1)
 
+    # Pick up re-runs of process_docs.py without restarting the session
+    get_kb_holder().start_watching()
+
     # Check if a file was passed as argument
     if len(sys.argv) > 1:
         file_path = sys.argv[1]
         if os.path.exists(file_path):
             if USE_RICH:
-                with console.status(f"[bold magenta]Analizando {file_path}...[/bold magenta]"):
-                    result = agent.analyze_document(file_path)
-                console.print(Panel(Markdown(result), title="⚖️ Análisis", border_style="blue", padding=(1, 2)))
+                print_stream(
+                    agent.analyze_document_stream(file_path),
+                    console,
+                    title="⚖️ Análisis",
+                    status=f"[bold magenta]Analizando {file_path}...[/bold magenta]",
+                )
             else:
-                print(f"\n📄 Analizando: {file_path}...")
-                result = agent.analyze_document(file_path)
-                print(f"\n{result}\n")
+                print(f"\n📄 Analizando: {file_path}...\n")
+                print_stream(agent.analyze_document_stream(file_path))
+                print()
         else:
             print(f"❌ Archivo no encontrado: {file_path}")
 
@@ -650,18 +742,16 @@ def main():
                 
                 file_path = parts[1].strip()
                 if USE_RICH:
-                    with console.status(f"[bold magenta]Analizando {file_path}...[/bold magenta]"):
-                        result = agent.analyze_document(file_path)
-                    console.print(Panel(
-                        Markdown(result),
+                    print_stream(
+                        agent.analyze_document_stream(file_path),
+                        console,
                         title=f"⚖️ Análisis: {os.path.basename(file_path)}",
-                        border_style="blue",
-                        padding=(1, 2),
-                    ))
+                        status=f"[bold magenta]Analizando {file_path}...[/bold magenta]",
+                    )
                 else:
-                    print(f"\n📄 Analizando: {file_path}...")
-                    result = agent.analyze_document(file_path)
-                    print(f"\n{result}\n")
+                    print(f"\n📄 Analizando: {file_path}...\n")
+                    print_stream(agent.analyze_document_stream(file_path))
+                    print()
                 continue
             
             if user_input.lower() == "/texto":
@@ -679,18 +769,16 @@ def main():
                     continue
                 
                 if USE_RICH:
-                    with console.status("[bold magenta]Analizando texto...[/bold magenta]"):
-                        result = agent.analyze_text(doc_text, "Texto pegado")
-                    console.print(Panel(
-                        Markdown(result),
+                    print_stream(
+                        agent.analyze_text_stream(doc_text, "Texto pegado"),
+                        console,
                         title="⚖️ Análisis del Texto",
-                        border_style="blue",
-                        padding=(1, 2),
-                    ))
+                        status="[bold magenta]Analizando texto...[/bold magenta]",
+                    )
                 else:
-                    print("\n📄 Analizando texto...")
-                    result = agent.analyze_text(doc_text, "Texto pegado")
-                    print(f"\n{result}\n")
+                    print("\n📄 Analizando texto...\n")
+                    print_stream(agent.analyze_text_stream(doc_text, "Texto pegado"))
+                    print()
                 continue
             
             if user_input.lower() == "/codigos":
@@ -707,17 +795,16 @@ def main():
             # Follow-up question
             if agent.current_document:
                 if USE_RICH:
-                    with console.status("[bold magenta]Analizando...[/bold magenta]"):
-                        result = agent.ask_followup(user_input)
-                    console.print(Panel(
-                        Markdown(result),
+                    print_stream(
+                        agent.ask_followup_stream(user_input),
+                        console,
                         title="⚖️ Respuesta",
-                        border_style="blue",
-                        padding=(1, 2),
-                    ))
+                        status="[bold magenta]Analizando...[/bold magenta]",
+                    )
                 else:
-                    result = agent.ask_followup(user_input)
-                    print(f"\n⚖️ {result}\n")
+                    print("\n⚖️ ", end="")
+                    print_stream(agent.ask_followup_stream(user_input))
+                    print()
             else:
                 print("⚠️ No hay documento cargado. Use /cargar <archivo> o /texto para comenzar.")
                 
@@ -0,0 +1,229 @@
+"""
+Embedding Cache - Content-addressed, on-disk cache of embedding vectors.
+
+ingest.py, validate_ingest.py and the agents' OpenAI embedding provider all
+call the embeddings API on their own, so identical texts were embedded again
+and again (the same article in the PDF and the TXT copy of a code, the same
+validation query on every run). They now share one SQLite file keyed by:
+
+    (model, dimensions, sha256(text))
+
+where ``text`` is the input as sent to the API, after the caller clips it to
+the model's input limit: changing a clip limit changes the keys of the texts
+it cuts. ``dimensions`` is 0 for the model's default size. Vectors are stored as
+float32 blobs. The file is bounded by ``max_bytes``: past it, the least
+recently used vectors are evicted (down to 90% of the bound). Hit, miss and
+eviction counters are kept per process (``stats()``).
+
+Usage:
+    cache = get_embedding_cache()
+    vectors = cache.embed(texts, "text-embedding-3-small", None, compute)
+
+    LEXAI_EMBEDDING_CACHE=<path>         # default data/cache/embeddings.sqlite3
+    LEXAI_EMBEDDING_CACHE=off            # disable
+    LEXAI_EMBEDDING_CACHE_MB=1024        # size bound
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Callable, Optional, Sequence
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_PATH = os.path.join(REPO_ROOT, "data", "cache", "embeddings.sqlite3")
+DEFAULT_MAX_MB = 1024
+
+CACHE_SETTING = os.environ.get("LEXAI_EMBEDDING_CACHE", "")
+CACHE_MAX_MB = float(os.environ.get("LEXAI_EMBEDDING_CACHE_MB", DEFAULT_MAX_MB))
+
+# Keys per SELECT ... IN (...) (SQLite's default variable limit is 999)
+_LOOKUP_CHUNK = 500
+
+Vector = Sequence[float]
+
+
+def text_sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Thread-safe SQLite store of vectors with LRU eviction by total size."""
+
+    def __init__(self, path: str = DEFAULT_PATH, max_bytes: int = int(DEFAULT_MAX_MB * 2**20)):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL, dimensions INTEGER NOT NULL, sha256 TEXT NOT NULL,"
+            " vector BLOB NOT NULL, last_used REAL NOT NULL,"
+            " PRIMARY KEY (model, dimensions, sha256)) WITHOUT ROWID"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._bytes = self._stored_bytes()
+
+    # ------------------------------------------------------------------
+    # Lookups
+    # ------------------------------------------------------------------
+
+    def get_many(self, model: str, dimensions: Optional[int], texts: Sequence[str]) -> list[Optional[list[float]]]:
+        """Cached vectors of ``texts`` (None where missing), refreshing their LRU position."""
+        dims = dimensions or 0
+        keys = [text_sha256(text) for text in texts]
+        found: dict[str, list[float]] = {}
+        with self._lock:
+            unique = list(dict.fromkeys(keys))
+            for start in range(0, len(unique), _LOOKUP_CHUNK):
+                chunk = unique[start:start + _LOOKUP_CHUNK]
+                rows = self._db.execute(
+                    f"SELECT sha256, vector FROM embeddings WHERE model = ? AND dimensions = ?"
+                    f" AND sha256 IN ({', '.join('?' * len(chunk))})",
+                    (model, dims, *chunk),
+                ).fetchall()
+                for sha, blob in rows:
+                    found[sha] = array("f", blob).tolist()
+            if found:
+                now = time.time()
+                self._db.execute("BEGIN")
+                self._db.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND dimensions = ? AND sha256 = ?",
+                    [(now, model, dims, sha) for sha in found],
+                )
+                self._db.execute("COMMIT")
+            vectors = [found.get(key) for key in keys]
+            hits = sum(vector is not None for vector in vectors)
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return vectors
+
+    def put_many(self, model: str, dimensions: Optional[int], texts: Sequence[str], vectors: Sequence[Vector]):
+        """Store ``vectors`` of ``texts`` (None entries are skipped), then evict over the bound."""
+        dims = dimensions or 0
+        now = time.time()
+        rows = [
+            (model, dims, text_sha256(text), array("f", vector).tobytes(), now)
+            for text, vector in zip(texts, vectors)
+            if vector is not None
+        ]
+        if not rows:
+            return
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, dimensions, sha256, vector, last_used)"
+                " VALUES (?, ?, ?, ?, ?)", rows,
+            )
+            self._db.execute("COMMIT")
+            self._bytes += sum(len(row[3]) for row in rows)
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def embed(
+        self,
+        texts: Sequence[str],
+        model: str,
+        dimensions: Optional[int],
+        compute: Callable[[list[str]], Sequence[Optional[Vector]]],
+    ) -> list[Optional[list[float]]]:
+        """
+        Vectors of ``texts``: cached ones as they are, the rest from
+        ``compute`` (called once, on the distinct missing texts) and stored.
+        """
+        vectors = self.get_many(model, dimensions, texts)
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        if missing:
+            computed = [list(v) if v is not None else None for v in compute(missing)]
+            self.put_many(model, dimensions, missing, computed)
+            by_text = dict(zip(missing, computed))
+            vectors = [vector if vector is not None else by_text[text] for text, vector in zip(texts, vectors)]
+        return vectors
+
+    # ------------------------------------------------------------------
+    # Maintenance
+    # ------------------------------------------------------------------
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return {
+            "entries": entries,
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+    def summary(self) -> str:
+        """One log line with the counters."""
+        stats = self.stats()
+        return (
+            f"🗄️  Caché de embeddings: {stats['hits']} aciertos, {stats['misses']} fallos"
+            f" ({stats['hit_rate']:.0%}), {stats['entries']} vectores, {stats['bytes'] / 2**20:.1f} MB"
+        )
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM embeddings")
+            self._bytes = 0
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _stored_bytes(self) -> int:
+        return self._db.execute("SELECT COALESCE(SUM(length(vector)), 0) FROM embeddings").fetchone()[0]
+
+    def _evict(self):
+        """Drop least recently used vectors down to 90% of the bound (lock held)."""
+        # Other processes may have written too: start from the real size
+        self._bytes = self._stored_bytes()
+        excess = self._bytes - int(self.max_bytes * 0.9)
+        if self._bytes <= self.max_bytes or excess <= 0:
+            return
+        victims, freed = [], 0
+        oldest = self._db.execute(
+            "SELECT model, dimensions, sha256, length(vector) FROM embeddings ORDER BY last_used"
+        )
+        for model, dims, sha, size in oldest:
+            victims.append((model, dims, sha))
+            freed += size
+            if freed >= excess:
+                break
+        oldest.close()
+        self._db.execute("BEGIN")
+        self._db.executemany("DELETE FROM embeddings WHERE model = ? AND dimensions = ? AND sha256 = ?", victims)
+        self._db.execute("COMMIT")
+        self._bytes -= freed
+        self.evictions += len(victims)
+
+
+_default_cache: Optional[EmbeddingCache] = None
+_default_lock = threading.Lock()
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """The process-wide cache configured by LEXAI_EMBEDDING_CACHE (None when "off")."""
+    global _default_cache
+    if CACHE_SETTING.lower() in ("off", "0", "false", "no"):
+        return None
+    if _default_cache is None:
+        with _default_lock:
+            if _default_cache is None:
+                _default_cache = EmbeddingCache(
+                    path=CACHE_SETTING or DEFAULT_PATH, max_bytes=int(CACHE_MAX_MB * 2**20)
+                )
+    return _default_cache
@@ -0,0 +1,227 @@
+"""
+Embeddings - Pluggable embedding providers and the on-disk article matrices
+behind LegalKnowledgeBase.search_semantic.
+
+Each code's article embeddings are stored as one float32 ``.npy`` matrix
+(one L2-normalized row per article, in local article order) under
+data/processed/embeddings/<provider key>/, named after the code and its
+source hash. Matrices are memory-mapped on load, so cosine similarity is a
+single matrix product per code and several processes share the pages.
+
+Providers:
+    hashing   Deterministic, offline feature-hashing embedder (default).
+              No network, no cost — for tests and machines without an API key.
+    openai    OpenAI text-embedding-3-small (same model ingest.py uses).
+              Vectors go through the shared on-disk embedding cache
+              (agents/embedding_cache.py), like ingest.py's.
+
+Select the default with LEXAI_EMBEDDING_PROVIDER=hashing|openai.
+"""
+
+import os
+import zlib
+from abc import ABC, abstractmethod
+from typing import Optional, Union
+
+import numpy as np
+
+from agents.text_normalization import fold_query
+
+EMBEDDINGS_DIRNAME = "embeddings"
+DEFAULT_PROVIDER = os.environ.get("LEXAI_EMBEDDING_PROVIDER", "hashing")
+# Providers whose vectors capture meaning beyond shared words; hybrid
+# retrieval only adds a vector ranking when the default is one of them
+SEMANTIC_PROVIDERS = ("openai",)
+
+
+class EmbeddingProvider(ABC):
+    """
+    Turns texts into L2-normalized float32 vectors.
+
+    Subclasses set ``key`` (names the on-disk matrices; change it whenever
+    the vectors would change) and ``dim``, and implement ``_embed``.
+    """
+
+    key = ""
+    dim = 0
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        """Embed ``texts`` into a (len(texts), dim) float32 matrix of unit rows."""
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        vectors = np.asarray(self._embed(texts), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    @abstractmethod
+    def _embed(self, texts: list[str]) -> np.ndarray:
+        """Raw (len(texts), dim) vectors; ``embed`` normalizes them."""
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """
+    Signed feature hashing of accent-folded words and their 5-letter
+    prefixes (a crude stemmer: "contratos" and "contratante" share
+    "contr"). Deterministic across processes and platforms.
+    """
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+        self.key = f"hashing-{dim}-v1"
+
+    def _features(self, text: str) -> list[str]:
+        words = [w for w in fold_query(text).split() if len(w) >= 3]
+        return words + [f"{w[:5]}~" for w in words if len(w) > 5]
+
+    def _embed(self, texts: list[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                h = zlib.crc32(feature.encode("utf-8"))
+                vectors[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        # Sublinear term frequency
+        return np.sign(vectors) * np.log1p(np.abs(vectors))
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """OpenAI embeddings API, batched."""
+
+    # Articles longer than this are truncated (the model's input limit is
+    # 8191 tokens; Spanish legal text averages ~4 chars per token)
+    MAX_CHARS = 24000
+
+    def __init__(self, model: str = "text-embedding-3-small", dim: int = 1536, batch_size: int = 128):
+        from openai import OpenAI
+        self.client = OpenAI()
+        self.model = model
+        self.dim = dim
+        self.batch_size = batch_size
+        self.key = f"openai-{model}"
+
+    def _embed(self, texts: list[str]) -> np.ndarray:
+        from agents.embedding_cache import get_embedding_cache
+
+        # Clipped before the cache, which is keyed by the input actually sent
+        texts = [t[:self.MAX_CHARS] or " " for t in texts]
+        cache = get_embedding_cache()
+        if cache is None:
+            rows = self._request(texts)
+        else:
+            rows = cache.embed(texts, self.model, None, self._request)
+        return np.array(rows, dtype=np.float32)
+
+    def _request(self, texts: list[str]) -> list[list[float]]:
+        rows = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start:start + self.batch_size]
+            response = self.client.embeddings.create(model=self.model, input=batch)
+            rows.extend(item.embedding for item in sorted(response.data, key=lambda d: d.index))
+        return rows
+
+
+PROVIDERS = {
+    "hashing": HashingEmbeddingProvider,
+    "openai": OpenAIEmbeddingProvider,
+}
+
+_providers: dict[str, EmbeddingProvider] = {}
+
+
+def get_embedding_provider(name: Union[str, EmbeddingProvider, None] = None) -> EmbeddingProvider:
+    """
+    Get (or create) the shared provider registered under ``name``.
+    Provider instances are returned as-is.
+    """
+    if isinstance(name, EmbeddingProvider):
+        return name
+    name = name or DEFAULT_PROVIDER
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown embedding provider: {name!r}. Use one of {tuple(PROVIDERS)}")
+    provider = _providers.get(name)
+    if provider is None:
+        provider = _providers.setdefault(name, PROVIDERS[name]())
+    return provider
+
+
+def semantic_retrieval_enabled() -> bool:
+    """True when the default provider is a semantic one (not the offline hashing stand-in)."""
+    return DEFAULT_PROVIDER in SEMANTIC_PROVIDERS
+
+
+def article_text(article) -> str:
+    """Text embedded for an article."""
+    return f"{article.title}\n{article.content}"
+
+
+# ---------------------------------------------------------------------------
+# On-disk matrices
+# ---------------------------------------------------------------------------
+
+def matrix_path(data_dir: str, provider: EmbeddingProvider, code_id: str, source_sha256: str) -> str:
+    return os.path.join(
+        data_dir, EMBEDDINGS_DIRNAME, provider.key, f"{code_id}-{source_sha256[:16]}.npy"
+    )
+
+
+def load_matrix(path: str, rows: int, dim: int) -> Optional[np.ndarray]:
+    """Memory-map a stored matrix; None if missing or of the wrong shape."""
+    if not os.path.exists(path):
+        return None
+    try:
+        matrix = np.load(path, mmap_mode="r")
+    except (OSError, ValueError) as e:
+        print(f"⚠️  Ignoring embedding matrix {path}: {e}")
+        return None
+    if matrix.shape != (rows, dim) or matrix.dtype != np.float32:
+        return None
+    return matrix
+
+
+def save_matrix(path: str, matrix: np.ndarray):
+    """Write ``matrix`` atomically and drop stale matrices of the same code."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        np.save(f, np.ascontiguousarray(matrix, dtype=np.float32))
+    os.replace(tmp_path, path)
+    remove_stale_versions(path)
+
+
+def remove_stale_versions(path: str):
+    """
+    Delete the files next to ``path`` that belong to the same code but
+    another source hash (``<code_id>-<hash>.*``).
+    """
+    directory, filename = os.path.split(path)
+    stem = filename.split(".", 1)[0]
+    code_id = stem.rsplit("-", 1)[0]
+    for name in os.listdir(directory):
+        if name.split(".", 1)[0] != stem and name.split(".", 1)[0].rsplit("-", 1)[0] == code_id:
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Indices of the ``k`` highest scores of each row of ``scores``, best
+    first, ties broken by lower index. O(n) selection plus a sort of the
+    (usually k) candidates.
+    """
+    rows, n = scores.shape
+    k = min(k, n)
+    result = np.empty((rows, max(k, 0)), dtype=np.intp)
+    for r, row in enumerate(scores):
+        if k <= 0:
+            break
+        if k < n:
+            threshold = np.partition(row, n - k)[n - k]
+            candidates = np.flatnonzero(row >= threshold)
+        else:
+            candidates = np.arange(n)
+        # lexsort: last key is primary -> score descending, then index
+        order = np.lexsort((candidates, -row[candidates]))[:k]
+        result[r] = candidates[order]
+    return result
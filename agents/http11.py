@@ -0,0 +1,186 @@
+"""
+HTTP/1.1 - Minimal asyncio HTTP plumbing for the agent service and the mock
+OpenAI server (stdlib only).
+
+Supports what those need: keep-alive connections, request bodies with
+Content-Length, JSON responses, chunked responses for streaming, and a small
+client (HTTPConnection) for the load test.
+"""
+
+import asyncio
+import json
+from dataclasses import dataclass, field
+from typing import Optional
+from urllib.parse import parse_qsl, urlsplit
+
+REASONS = {
+    200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 409: "Conflict",
+    413: "Payload Too Large", 429: "Too Many Requests", 500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class HTTPError(Exception):
+    """Raised by handlers; answered with ``status`` and a JSON error body."""
+
+    def __init__(self, status: int, message: str, headers: Optional[dict] = None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+
+@dataclass
+class Request:
+    method: str
+    path: str
+    query: dict = field(default_factory=dict)
+    headers: dict = field(default_factory=dict)
+    body: bytes = b""
+
+    @property
+    def keep_alive(self) -> bool:
+        return self.headers.get("connection", "").lower() != "close"
+
+    def json(self) -> dict:
+        """Body parsed as a JSON object (400 if it is not one)."""
+        try:
+            data = json.loads(self.body or b"{}")
+        except ValueError:
+            raise HTTPError(400, "Body must be valid JSON")
+        if not isinstance(data, dict):
+            raise HTTPError(400, "Body must be a JSON object")
+        return data
+
+
+async def read_request(reader: asyncio.StreamReader, max_body: int = 1 << 20) -> Optional[Request]:
+    """Read one request; None when the client closed the connection."""
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None
+    except asyncio.LimitOverrunError:
+        raise HTTPError(400, "Request headers too large")
+    request_line, *header_lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, _ = request_line.split(" ", 2)
+    except ValueError:
+        raise HTTPError(400, "Malformed request line")
+    headers = {
+        name.strip().lower(): value.strip()
+        for name, _, value in (line.partition(":") for line in header_lines if line)
+    }
+    try:
+        length = int(headers.get("content-length") or 0)
+    except ValueError:
+        raise HTTPError(400, "Invalid Content-Length")
+    if length < 0:
+        raise HTTPError(400, "Invalid Content-Length")
+    if length > max_body:
+        raise HTTPError(413, f"Body larger than {max_body} bytes")
+    try:
+        body = await reader.readexactly(length)
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None
+    url = urlsplit(target)
+    return Request(method.upper(), url.path, dict(parse_qsl(url.query)), headers, body)
+
+
+def response_head(status: int, headers: dict) -> bytes:
+    lines = [f"HTTP/1.1 {status} {REASONS.get(status, 'Error')}"]
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode()
+
+
+async def send_json(writer: asyncio.StreamWriter, status: int, data, headers: Optional[dict] = None):
+    body = json.dumps(data, ensure_ascii=False).encode()
+    writer.write(response_head(status, {
+        "content-type": "application/json; charset=utf-8",
+        "content-length": str(len(body)),
+        **(headers or {}),
+    }) + body)
+    await writer.drain()
+
+
+async def start_chunked(writer: asyncio.StreamWriter, content_type: str, headers: Optional[dict] = None):
+    writer.write(response_head(200, {
+        "content-type": content_type, "transfer-encoding": "chunked", "cache-control": "no-cache",
+        **(headers or {}),
+    }))
+    await writer.drain()
+
+
+async def send_chunk(writer: asyncio.StreamWriter, data: bytes):
+    if data:
+        writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        await writer.drain()
+
+
+async def end_chunked(writer: asyncio.StreamWriter):
+    writer.write(b"0\r\n\r\n")
+    await writer.drain()
+
+
+def sse_event(data) -> bytes:
+    """One server-sent event carrying ``data`` (a str, or JSON-encoded)."""
+    if not isinstance(data, str):
+        data = json.dumps(data, ensure_ascii=False)
+    return f"data: {data}\n\n".encode()
+
+
+class HTTPConnection:
+    """
+    One keep-alive client connection. ``request`` returns (status, body);
+    ``on_chunk`` receives each chunk of a chunked response as it arrives.
+    """
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    async def request(self, method: str, path: str, data=None, on_chunk=None) -> tuple[int, bytes]:
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        body = b"" if data is None else json.dumps(data).encode()
+        self._writer.write(
+            f"{method} {path} HTTP/1.1\r\nhost: {self.host}\r\n"
+            f"content-type: application/json\r\ncontent-length: {len(body)}\r\n\r\n".encode() + body
+        )
+        await self._writer.drain()
+        try:
+            return await self._read_response(on_chunk)
+        except BaseException:
+            await self.close()
+            raise
+
+    async def _read_response(self, on_chunk) -> tuple[int, bytes]:
+        head = await self._reader.readuntil(b"\r\n\r\n")
+        status_line, *header_lines = head.decode("latin-1").split("\r\n")
+        status = int(status_line.split(" ", 2)[1])
+        headers = {
+            name.strip().lower(): value.strip()
+            for name, _, value in (line.partition(":") for line in header_lines if line)
+        }
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            parts = []
+            while True:
+                size = int((await self._reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                chunk = await self._reader.readexactly(size + 2)
+                if not size:
+                    break
+                parts.append(chunk[:-2])
+                if on_chunk:
+                    on_chunk(chunk[:-2])
+            body = b"".join(parts)
+        else:
+            body = await self._reader.readexactly(int(headers.get("content-length") or 0))
+        if headers.get("connection", "").lower() == "close":
+            await self.close()
+        return status, body
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
@@ -0,0 +1,157 @@
+"""
+KB Holder - Thread-safe, hot-reloadable owner of the shared knowledge base.
+
+A loaded LegalKnowledgeBase is treated as an immutable snapshot: searches run
+against whatever instance they fetched, and a reload never mutates it. The
+holder builds a replacement (reusing every code whose source is unchanged,
+rebuilding only the changed ones) and swaps the reference in a single
+assignment, so in-flight searches never observe a half-built index.
+
+Usage:
+    holder = get_kb_holder()
+    holder.start_watching()     # optional: follow re-runs of process_docs.py
+    kb = holder.get()           # fetch once per request
+"""
+
+import os
+import sys
+import threading
+from typing import Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from agents.legal_knowledge_base import LegalKnowledgeBase
+
+# Seconds between polls of data/processed/
+DEFAULT_WATCH_INTERVAL = 2.0
+
+# LEXAI_KB_LAZY=1 makes the shared knowledge base load each code on first
+# access (see LegalKnowledgeBase's ``lazy`` option)
+LAZY_BY_DEFAULT = os.environ.get("LEXAI_KB_LAZY", "").lower() in ("1", "true", "yes")
+
+
+class KnowledgeBaseHolder:
+    """
+    Owns the current LegalKnowledgeBase and replaces it when its sources change.
+
+    - ``get()`` loads exactly once, even when many threads call it at once.
+    - ``reload()`` rebuilds the changed codes and atomically swaps them in.
+    - ``start_watching()`` polls the source JSONs and reloads in a
+      background thread once a change has settled.
+    """
+
+    def __init__(self, data_dir: Optional[str] = None, **kb_options):
+        self.data_dir = data_dir
+        self._kb_options = kb_options
+        self._kb: Optional[LegalKnowledgeBase] = None
+        self._load_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watcher: Optional[threading.Thread] = None
+        # Incremented on every swap; lets callers detect a new snapshot
+        self.generation = 0
+
+    def _new_kb(self, **overrides) -> LegalKnowledgeBase:
+        return LegalKnowledgeBase(data_dir=self.data_dir, **{**self._kb_options, **overrides})
+
+    def get(self) -> LegalKnowledgeBase:
+        """Return the current knowledge base, loading it on first use."""
+        kb = self._kb
+        if kb is None:
+            with self._load_lock:
+                if self._kb is None:
+                    self._kb = self._new_kb().load()
+                    self.generation += 1
+                kb = self._kb
+        return kb
+
+    def reload(self) -> bool:
+        """
+        Rebuild the codes whose sources changed and swap in the result.
+        Returns True if a new knowledge base was swapped in.
+        """
+        with self._reload_lock:
+            current = self.get()
+            changed = current.changed_sources()
+            if not changed:
+                return False
+            replacement = self._new_kb(verbose=False).load(previous=current)
+            # Copy first: a lazy knowledge base may still be adding codes
+            current_codes = dict(current.codes)
+            if replacement.codes.keys() == current_codes.keys() and all(
+                replacement.codes[cid] is code for cid, code in current_codes.items()
+            ):
+                return False  # every changed source failed to load; keep current
+            self._kb = replacement
+            self.generation += 1
+            print(f"🔄 Knowledge base reloaded ({', '.join(changed)}): "
+                  f"{len(replacement.codes)} codes, generation {self.generation}")
+            return True
+
+    # ------------------------------------------------------------------
+    # Watching data/processed/
+    # ------------------------------------------------------------------
+
+    def _signatures(self, kb: LegalKnowledgeBase) -> dict[str, tuple[int, int]]:
+        """Cheap (mtime, size) signature of every source JSON."""
+        sigs = {}
+        for code_id in kb.CODE_REGISTRY:
+            try:
+                st = os.stat(kb.source_path(code_id))
+                sigs[code_id] = (st.st_mtime_ns, st.st_size)
+            except OSError:
+                continue
+        return sigs
+
+    def start_watching(self, interval: float = DEFAULT_WATCH_INTERVAL):
+        """Start a daemon thread that hot-reloads on source changes."""
+        if self._watcher and self._watcher.is_alive():
+            return
+        self._stop.clear()
+        self._watcher = threading.Thread(
+            target=self._watch_loop, args=(interval,), name="kb-watcher", daemon=True
+        )
+        self._watcher.start()
+
+    def stop_watching(self):
+        self._stop.set()
+        if self._watcher:
+            self._watcher.join()
+            self._watcher = None
+
+    def _watch_loop(self, interval: float):
+        last = self._signatures(self.get())
+        while not self._stop.wait(interval):
+            current = self._signatures(self.get())
+            if current == last:
+                continue
+            # Wait one more interval so a writer still rewriting the file
+            # (e.g. process_docs.py) has finished before we parse it
+            if self._stop.wait(interval):
+                break
+            settled = self._signatures(self.get())
+            if settled != current:
+                continue
+            try:
+                self.reload()
+            except Exception as e:
+                print(f"❌ Knowledge base reload failed: {e}")
+            last = settled
+
+
+_holders: dict[Optional[str], KnowledgeBaseHolder] = {}
+_holders_lock = threading.Lock()
+
+
+def get_kb_holder(data_dir: Optional[str] = None, **kb_options) -> KnowledgeBaseHolder:
+    """
+    Get (or create) the process-wide holder for ``data_dir``.
+    ``kb_options`` (e.g. ``lazy=True``) only apply when the holder is created.
+    """
+    holder = _holders.get(data_dir)
+    if holder is None:
+        kb_options.setdefault("lazy", LAZY_BY_DEFAULT)
+        with _holders_lock:
+            holder = _holders.get(data_dir)
+            if holder is None:
+                holder = _holders[data_dir] = KnowledgeBaseHolder(data_dir, **kb_options)
+    return holder
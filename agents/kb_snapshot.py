@@ -0,0 +1,219 @@
+"""
+KB Snapshot - Compiled, memory-mappable binary snapshot of the knowledge base.
+
+Parsing the processed JSONs, normalizing every article and rebuilding every
+index takes most of a second per process. The snapshot stores the result of
+that work (article columns, normalized text and the inverted index of each
+code) in a single versioned file under data/processed/, keyed by the SHA-256
+of each source JSON. A cold start maps the file and only rebuilds the codes
+whose source hash changed.
+
+File layout:
+    8 bytes   magic  b"LEXAIKB\\0"
+    4 bytes   format version (little-endian uint32)
+    4 bytes   header length (little-endian uint32)
+    N bytes   JSON header: per-code metadata, source hash and section table
+    ...       8-byte aligned section blobs
+
+Materialized topic result tables (see TOPIC_VOCABULARY in
+legal_knowledge_base) are stored in an extra section tagged with the corpus
+fingerprint they were computed for.
+
+String columns are ``marshal``-encoded. Index arrays are raw native-endian
+uint32 data exposed as zero-copy ``memoryview`` slices of the mapping.
+"""
+
+import hashlib
+import json
+import marshal
+import mmap
+import os
+import struct
+import sys
+from array import array
+from dataclasses import dataclass
+from typing import Optional
+
+from agents.search_index import ARRAY_FIELDS, InvertedIndex
+from agents.text_normalization import NormalizedTextStore
+
+SNAPSHOT_MAGIC = b"LEXAIKB\x00"
+# Bump whenever the normalization, index layout or section encoding changes
+SNAPSHOT_VERSION = 1
+SNAPSHOT_FILENAME = "kb.snapshot"
+
+_PREAMBLE = struct.Struct("<8sII")
+_ALIGN = 8
+
+
+def source_digest(path: str) -> str:
+    """SHA-256 of a source JSON file."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+@dataclass
+class CodeSnapshot:
+    """Everything needed to rebuild one LegalCode without touching its JSON."""
+    code_id: str
+    source_sha256: str
+    name: str
+    law_number: str
+    total_articles: int
+    # (article_number, title, content) in local article order
+    articles: list[tuple[int, str, str]]
+    normalized: NormalizedTextStore
+    search_index: InvertedIndex
+
+
+def _environment() -> dict:
+    """Properties the raw sections depend on; a mismatch invalidates the file."""
+    return {
+        "byteorder": sys.byteorder,
+        "uint_size": array("I").itemsize,
+        "marshal": marshal.version,
+    }
+
+
+def write_snapshot(
+    path: str,
+    codes: list[CodeSnapshot],
+    topic_tables: Optional[tuple[str, dict]] = None,
+):
+    """
+    Serialize ``codes`` to ``path`` atomically (write temp + rename).
+
+    ``topic_tables`` is an optional (fingerprint, tables) pair; ``tables``
+    must be marshal-serializable.
+    """
+    blobs: list[bytes] = []
+    header = {"version": SNAPSHOT_VERSION, **_environment(), "codes": {}}
+    offset = 0
+
+    def add(data: bytes) -> list[int]:
+        nonlocal offset
+        pad = -len(data) % _ALIGN
+        blobs.append(data + b"\x00" * pad)
+        section = [offset, len(data)]
+        offset += len(data) + pad
+        return section
+
+    for code in codes:
+        index = code.search_index
+        numbers, titles, contents = (
+            zip(*code.articles) if code.articles else ((), (), ())
+        )
+        sections = {
+            "articles": add(marshal.dumps((list(numbers), list(titles), list(contents)))),
+            "normalized": add(marshal.dumps((code.normalized.titles, code.normalized.contents))),
+            "vocab": add(marshal.dumps(list(index.vocab))),
+            "trigram_keys": add(marshal.dumps(list(index.trigram_keys))),
+        }
+        for name in ARRAY_FIELDS:
+            sections[name] = add(bytes(getattr(index, name)))
+        header["codes"][code.code_id] = {
+            "source_sha256": code.source_sha256,
+            "name": code.name,
+            "law_number": code.law_number,
+            "total_articles": code.total_articles,
+            "sections": sections,
+        }
+
+    if topic_tables is not None:
+        fingerprint, tables = topic_tables
+        header["topics"] = {"fingerprint": fingerprint, "section": add(marshal.dumps(tables))}
+
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    header_bytes += b" " * (-(_PREAMBLE.size + len(header_bytes)) % _ALIGN)
+
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(_PREAMBLE.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp_path, path)
+
+
+class Snapshot:
+    """
+    Read-only view over a memory-mapped snapshot file. Codes are decoded on
+    demand with ``load_code``; index arrays stay backed by the mapping.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, header_len = _PREAMBLE.unpack_from(self._mm, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError(f"incompatible snapshot (version {version})")
+        header = json.loads(self._mm[_PREAMBLE.size:_PREAMBLE.size + header_len])
+        env = _environment()
+        if any(header.get(k) != v for k, v in env.items()):
+            raise ValueError("snapshot was written on an incompatible platform")
+        self._data_start = _PREAMBLE.size + header_len
+        self._codes: dict[str, dict] = header["codes"]
+        self._topics: Optional[dict] = header.get("topics")
+        # A truncated file would otherwise hand out short sections
+        sections = [s for entry in self._codes.values() for s in entry["sections"].values()]
+        sections += [self._topics["section"]] if self._topics else []
+        if any(self._data_start + offset + length > len(self._mm) for offset, length in sections):
+            raise ValueError("truncated snapshot")
+        self._view = memoryview(self._mm)
+
+    @property
+    def code_ids(self) -> list[str]:
+        return list(self._codes)
+
+    def source_sha256(self, code_id: str) -> Optional[str]:
+        entry = self._codes.get(code_id)
+        return entry["source_sha256"] if entry else None
+
+    @property
+    def topic_fingerprint(self) -> Optional[str]:
+        return self._topics["fingerprint"] if self._topics else None
+
+    def load_topic_tables(self) -> dict:
+        return marshal.loads(self._section(self._topics, "section"))
+
+    def _section(self, sections: dict, name: str) -> memoryview:
+        offset, length = sections[name]
+        start = self._data_start + offset
+        return self._view[start:start + length]
+
+    def load_code(self, code_id: str) -> CodeSnapshot:
+        entry = self._codes[code_id]
+        sections = entry["sections"]
+        numbers, titles, contents = marshal.loads(self._section(sections, "articles"))
+        norm_titles, norm_contents = marshal.loads(self._section(sections, "normalized"))
+        arrays = {name: self._section(sections, name).cast("I") for name in ARRAY_FIELDS}
+        index = InvertedIndex(
+            vocab=marshal.loads(self._section(sections, "vocab")),
+            trigram_keys=marshal.loads(self._section(sections, "trigram_keys")),
+            **arrays,
+        )
+        return CodeSnapshot(
+            code_id=code_id,
+            source_sha256=entry["source_sha256"],
+            name=entry["name"],
+            law_number=entry["law_number"],
+            total_articles=entry["total_articles"],
+            articles=list(zip(numbers, titles, contents)),
+            normalized=NormalizedTextStore(norm_titles, norm_contents),
+            search_index=index,
+        )
+
+
+def open_snapshot(path: str) -> Optional[Snapshot]:
+    """Open ``path`` if it exists and is readable by this build, else None."""
+    if not os.path.exists(path):
+        return None
+    try:
+        return Snapshot(path)
+    except (OSError, ValueError, struct.error) as e:
+        print(f"⚠️  Ignoring knowledge base snapshot {path}: {e}")
+        return None
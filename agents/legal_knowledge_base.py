@@ -14,26 +14,155 @@ Supported codes:
 - Código de Trabajo (Ley N° 2)
 """
 
+import bisect
+import hashlib
+import heapq
 import json
 import os
-import re
-import unicodedata
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
-from typing import Optional
+from typing import TYPE_CHECKING, Iterable, Optional, Union
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from agents.kb_snapshot import (
+    SNAPSHOT_FILENAME, CodeSnapshot, open_snapshot, source_digest, write_snapshot,
+)
+from agents.search_index import SCORING_PARAMS, InvertedIndex, bm25_idf
+from agents.text_normalization import NormalizedTextStore, fold_query, strip_accents
+
+if TYPE_CHECKING:
+    import numpy as np
+    from agents.ann_index import IVFFlatIndex
+    from agents.embeddings import EmbeddingProvider
+
+# Query stopwords (already lowercase and accent-free)
+STOPWORDS = frozenset({
+    "el", "la", "los", "las", "un", "una", "unos", "unas",
+    "de", "del", "en", "por", "para", "con", "sin", "que",
+    "se", "al", "es", "su", "sus", "no", "si", "como",
+    "mas", "pero", "este", "esta", "estos", "estas",
+    "ser", "hay", "son", "fue", "han", "puede", "debe",
+    "todo", "toda", "todos", "todas", "otro", "otra",
+    "cual", "cuando", "donde", "quien", "sobre", "entre",
+})
+
+# Ranking modes for search_by_keywords / search_by_topic:
+# - "legacy": +2 per title hit, +1 per content hit, +3 if all terms match.
+#   The default; keeps the answers our regression queries were tuned on.
+# - "bm25": BM25F with per-field (title/content) weights and length
+#   normalization, so very long articles no longer dominate.
+RANKING_LEGACY = "legacy"
+RANKING_BM25 = "bm25"
+RANKING_MODES = (RANKING_LEGACY, RANKING_BM25)
+
+# Legal term expansion applied by search_by_topic (first matching key wins)
+LEGAL_TERM_EXPANSIONS = {
+    "contrato": "contrato obligaciones acuerdo convenio partes",
+    "matrimonio": "matrimonio cónyuges divorcio separación familia",
+    "herencia": "herencia sucesión testamento herederos legatarios",
+    "despido": "despido terminación relación laboral trabajador patrono indemnización",
+    "arrendamiento": "arrendamiento alquiler arrendatario arrendador renta",
+    "propiedad": "propiedad dominio inmueble bienes posesión",
+    "delito": "delito pena sanción penal culpable",
+    "prescripción": "prescripción plazo caducidad término vencimiento",
+    "obligación": "obligación deuda acreedor deudor pago",
+    "sociedad": "sociedad mercantil socios capital acciones",
+    "salario": "salario remuneración pago jornal compensación sueldo",
+    "vacaciones": "vacaciones descanso licencia permiso",
+    "aguinaldo": "aguinaldo décimo tercer mes sueldo adicional",
+    "homicidio": "homicidio muerte matar vida",
+    "robo": "robo hurto sustracción apoderamiento",
+    "estafa": "estafa fraude engaño perjuicio patrimonial",
+    "divorcio": "divorcio separación disolución vínculo matrimonial",
+    "alimentos": "alimentos pensión alimentaria manutención",
+    "daños": "daños perjuicios indemnización responsabilidad civil",
+    "embargo": "embargo secuestro bienes ejecución",
+}
+
+# Every topic label emitted by the agents' detectors (detect_search_topics in
+# repository_search_agent, detect_document_topics in document_analysis_agent).
+# search_by_topic results for these are materialized per code filter and
+# ranking mode, so topic retrieval is a dictionary lookup.
+TOPIC_VOCABULARY = (
+    "contrato", "despido", "vacaciones", "aguinaldo", "salario", "matrimonio",
+    "divorcio", "herencia", "propiedad", "arrendamiento", "sociedad",
+    "prescripción", "obligación", "obligaciones", "delito", "homicidio", "robo",
+    "estafa", "daños", "embargo", "alimentos", "familia", "jornada laboral",
+    "preaviso", "cesantía", "garantía", "hipoteca", "testamento", "usufructo",
+    "servidumbre", "posesión", "compraventa", "donación", "mandato",
+    "responsabilidad", "capacidad", "persona jurídica", "comerciante", "quiebra",
+    "títulos valores", "relación laboral", "trabajo", "sindicato",
+    "seguridad social",
+)
+# Results kept per (topic, code filter, ranking); deeper requests are computed
+TOPIC_TABLE_DEPTH = 50
 
 # ---------------------------------------------------------------------------
 # Data classes
 # ---------------------------------------------------------------------------
 
-@dataclass
+# Article ids are code_number * ARTICLE_ID_STRIDE + local position, so they
+# are stable across processes and reloads of the same source
+ARTICLE_ID_STRIDE = 1 << 20
+
+
+class CodeInfo:
+    """Metadata of a legal code, shared by every Article of that code."""
+
+    __slots__ = ("number", "code_id", "name", "law_number")
+
+    def __init__(self, number: int, code_id: str, name: str, law_number: str):
+        self.number = number          # position in CODE_REGISTRY
+        self.code_id = code_id        # e.g. "codigo-civil"
+        self.name = name              # e.g. "Código Civil de Costa Rica"
+        self.law_number = law_number  # e.g. "Ley N° 63"
+
+    def __repr__(self) -> str:
+        return f"CodeInfo({self.number}, {self.code_id!r})"
+
+
 class Article:
-    """Normalized article from any legal code."""
-    code_id: str          # e.g. "codigo-civil"
-    code_name: str        # e.g. "Código Civil de Costa Rica"
-    law_number: str       # e.g. "Ley N° 63"
-    article_number: int
-    title: str
-    content: str
+    """
+    Normalized article from any legal code.
+
+    Slotted to keep per-article overhead small: code metadata lives in the
+    shared CodeInfo, and equality/hashing use the integer ``article_id``
+    instead of comparing full article text.
+    """
+
+    __slots__ = ("code", "article_id", "article_number", "title", "content")
+
+    def __init__(self, code: CodeInfo, article_id: int, article_number: int, title: str, content: str):
+        self.code = code
+        self.article_id = article_id
+        self.article_number = article_number
+        self.title = title
+        self.content = content
+
+    @property
+    def code_id(self) -> str:
+        return self.code.code_id
+
+    @property
+    def code_name(self) -> str:
+        return self.code.name
+
+    @property
+    def law_number(self) -> str:
+        return self.code.law_number
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Article):
+            return NotImplemented
+        return self.article_id == other.article_id
+
+    def __hash__(self) -> int:
+        return hash(self.article_id)
+
+    def __repr__(self) -> str:
+        return f"Article({self.code_id!r}, {self.article_number}, id={self.article_id})"
 
     def citation(self) -> str:
         return f"Artículo {self.article_number} del {self.code_name} ({self.law_number})"
@@ -52,16 +181,38 @@ class LegalCode:
     articles: list[Article] = field(default_factory=list)
     # Index: article_number -> Article (for O(1) exact lookup)
     _index: dict[int, list[Article]] = field(default_factory=dict, repr=False)
+    # Normalized (lowercase, accent-free) title/content columns
+    normalized: Optional[NormalizedTextStore] = field(default=None, repr=False)
+    # Inverted index over the normalized columns (for keyword search)
+    search_index: Optional[InvertedIndex] = field(default=None, repr=False)
+    # SHA-256 of the source JSON this code was built from
+    source_sha256: str = ""
+    # Article numbers in ascending order, and the local position of each
+    # (for range lookups with bisect)
+    _sorted_numbers: list[int] = field(default_factory=list, repr=False)
+    _sorted_positions: list[int] = field(default_factory=list, repr=False)
 
     def build_index(self):
         self._index = {}
         for art in self.articles:
             self._index.setdefault(art.article_number, []).append(art)
+        self._sorted_positions = sorted(
+            range(len(self.articles)), key=lambda pos: self.articles[pos].article_number
+        )
+        self._sorted_numbers = [self.articles[pos].article_number for pos in self._sorted_positions]
 
     def find_exact(self, article_number: int) -> list[Article]:
         """Exact article number lookup — O(1)."""
         return self._index.get(article_number, [])
 
+    def find_range(self, start: int, end: int, limit: Optional[int] = None) -> list[Article]:
+        """Articles numbered ``start``..``end`` (inclusive), by number — O(log n + k)."""
+        lo = bisect.bisect_left(self._sorted_numbers, start)
+        hi = bisect.bisect_right(self._sorted_numbers, end)
+        if limit is not None:
+            hi = min(hi, lo + limit)
+        return [self.articles[pos] for pos in self._sorted_positions[lo:hi]]
+
 
 # ---------------------------------------------------------------------------
 # Knowledge Base
@@ -76,7 +227,10 @@ class LegalKnowledgeBase:
     - Normalizes different JSON schemas into a unified Article format
     - Provides EXACT article number search (primary, deterministic)
     - Provides KEYWORD search (secondary, for topic-based queries)
+    - Provides SEMANTIC search over persisted article embeddings
     - Caches everything in-memory for fast access
+    - Persists the built codes in a binary snapshot for fast cold starts
+    - Optionally loads codes lazily, on first access (``lazy=True``)
     """
 
     # Map of code_id to its metadata for loading
@@ -88,13 +242,26 @@ class LegalKnowledgeBase:
         "codigo-trabajo": {"name": "Código de Trabajo de Costa Rica", "law": "Ley N° 2"},
     }
 
-    def __init__(self, data_dir: Optional[str] = None):
+    def __init__(
+        self,
+        data_dir: Optional[str] = None,
+        use_snapshot: bool = True,
+        snapshot_path: Optional[str] = None,
+        verbose: bool = True,
+        lazy: bool = False,
+    ):
         """
         Initialize and load all legal codes.
         
         Args:
             data_dir: Path to the data/processed/ directory.
                       Defaults to <project_root>/data/processed/
+            use_snapshot: Read/write the compiled binary snapshot. When False,
+                          every code is rebuilt from its JSON.
+            snapshot_path: Snapshot file. Defaults to <data_dir>/kb.snapshot
+            verbose: Print per-code loading progress.
+            lazy: Defer loading each code until it is first accessed.
+                  Single-code lookups then only pay for that code.
         """
         if data_dir is None:
             # Auto-detect: this file is at agents/legal_knowledge_base.py
@@ -102,55 +269,270 @@ class LegalKnowledgeBase:
             data_dir = os.path.join(project_root, "data", "processed")
         
         self.data_dir = data_dir
+        self.use_snapshot = use_snapshot
+        self.snapshot_path = snapshot_path or os.path.join(data_dir, SNAPSHOT_FILENAME)
+        self.verbose = verbose
+        self.lazy = lazy
         self.codes: dict[str, LegalCode] = {}
         self._all_articles: list[Article] = []
         self._loaded = False
+        # Lazy loading state: code_id -> lock for every code not yet
+        # materialized, plus the sources it will be materialized from
+        self._pending: dict[str, threading.Lock] = {}
+        self._snapshot = None
+        self._previous: Optional["LegalKnowledgeBase"] = None
+        # Set once every code is loaded and the corpus-wide data is computed
+        self._complete = False
+        self._complete_lock = threading.Lock()
+        # Corpus-wide BM25 statistics (filled by _compute_field_stats)
+        self._avg_title_len = 0.0
+        self._avg_content_len = 0.0
+        self._idf_cache: dict[str, float] = {}
+        # Hash of every loaded code's source; changes whenever the corpus does
+        self.fingerprint = ""
+        # (topic, code_id or "", ranking) -> ranked [(code_id, position), ...]
+        self._topic_tables: dict[tuple[str, str, str], list[tuple[str, int]]] = {}
+        # (provider key, code_id) -> memory-mapped article embedding matrix
+        self._embeddings: dict[tuple[str, str], "np.ndarray"] = {}
+        # (provider key, code_id) -> IVF index over that matrix
+        self._ann_indexes: dict[tuple[str, str], "IVFFlatIndex"] = {}
+        self._embeddings_lock = threading.Lock()
+
+    def load(self, previous: Optional["LegalKnowledgeBase"] = None) -> "LegalKnowledgeBase":
+        """
+        Load all legal codes. Codes whose source JSON hash matches the
+        snapshot are mapped from it; the rest are rebuilt from JSON and the
+        snapshot is rewritten. Returns self for chaining.
 
-    def load(self) -> "LegalKnowledgeBase":
-        """Load all legal codes from JSON files. Returns self for chaining."""
+        In lazy mode this only registers the available codes: each one is
+        materialized on first access, and the remaining ones are loaded
+        concurrently the first time a cross-code operation needs them.
+
+        Args:
+            previous: An already-loaded knowledge base (hot reload). Its codes
+                      are reused as-is when their source hash is unchanged, and
+                      kept as a fallback when a changed source fails to load.
+                      ``previous`` itself is never modified.
+        """
         if self._loaded:
             return self
 
-        for code_id, meta in self.CODE_REGISTRY.items():
-            json_path = os.path.join(self.data_dir, f"{code_id}.json")
+        self._snapshot = open_snapshot(self.snapshot_path) if self.use_snapshot else None
+        self._previous = previous
+
+        for code_id in self.CODE_REGISTRY:
+            json_path = self.source_path(code_id)
             if not os.path.exists(json_path):
-                print(f"⚠️  Skipping {code_id}: file not found at {json_path}")
+                self._log(f"⚠️  Skipping {code_id}: file not found at {json_path}")
                 continue
+            self._pending[code_id] = threading.Lock()
 
-            try:
-                with open(json_path, "r", encoding="utf-8") as f:
-                    raw = json.load(f)
-
-                code_name = raw.get("name", meta["name"])
-                law_number = raw.get("law_number", meta["law"])
+        self._loaded = True
+        if self.lazy:
+            # Codes the previous instance had already materialized are likely
+            # to be hit again (reusing them is just a hash check); new and
+            # previously failed sources load now, so a reload sees the change.
+            # Only codes it never touched stay pending
+            for code_id in list(self._pending) if previous else []:
+                if code_id not in previous._pending:
+                    self._code(code_id)
+            self._log(f"💤 Knowledge base registered lazily: {len(self._pending)} codes pending")
+        else:
+            for code_id in list(self._pending):
+                self._code(code_id)
+            self._finalize()
+        return self
 
-                legal_code = LegalCode(
-                    code_id=code_id,
-                    name=code_name,
-                    law_number=law_number,
-                    total_articles=raw.get("total_articles", 0),
-                )
+    def ensure_loaded(self):
+        """
+        Materialize every pending code (lazy mode), loading them
+        concurrently, then compute the corpus-wide statistics, topic tables
+        and snapshot. No-op once everything is loaded.
+        """
+        if self._complete:
+            return
+        with self._complete_lock:
+            if self._complete:
+                return
+            pending = list(self._pending)
+            if pending:
+                with ThreadPoolExecutor(max_workers=len(pending)) as pool:
+                    list(pool.map(self._code, pending))
+            self._finalize()
 
-                for raw_art in raw.get("articles", []):
-                    article = self._normalize_article(raw_art, code_id, code_name, law_number)
-                    if article:
-                        legal_code.articles.append(article)
-                        self._all_articles.append(article)
+    @property
+    def fully_loaded(self) -> bool:
+        """True once every code and the corpus-wide data are available."""
+        return self._complete
 
-                legal_code.build_index()
-                self.codes[code_id] = legal_code
-                print(f"✅ Loaded {code_id}: {len(legal_code.articles)} articles")
+    def _code(self, code_id: str) -> Optional[LegalCode]:
+        """Return a code, materializing it first if it is still pending."""
+        lock = self._pending.get(code_id)
+        if lock is not None:
+            with lock:
+                if code_id in self._pending:
+                    legal_code = self._load_code(code_id)
+                    if legal_code:
+                        self.codes[code_id] = legal_code
+                    # Publish the code before clearing the pending marker so
+                    # readers never observe neither
+                    del self._pending[code_id]
+        return self.codes.get(code_id)
 
-            except Exception as e:
+    def _load_code(self, code_id: str) -> Optional[LegalCode]:
+        """Load one code from the previous instance, the snapshot or its JSON."""
+        meta = self.CODE_REGISTRY[code_id]
+        json_path = self.source_path(code_id)
+        snapshot = self._snapshot
+        prev_code = self._previous.codes.get(code_id) if self._previous else None
+        try:
+            digest = source_digest(json_path)
+            if prev_code and prev_code.source_sha256 == digest:
+                legal_code = prev_code
+                source = "reused"
+            elif snapshot and snapshot.source_sha256(code_id) == digest:
+                legal_code = self._code_from_snapshot(snapshot.load_code(code_id))
+                source = "snapshot"
+            else:
+                legal_code = self._load_code_json(code_id, meta, json_path)
+                legal_code.source_sha256 = digest
+                source = "JSON"
+        except Exception as e:
+            if not prev_code:
                 print(f"❌ Error loading {code_id}: {e}")
+                return None
+            print(f"❌ Error reloading {code_id}, keeping previous version: {e}")
+            legal_code = prev_code
+            source = "previous"
 
-        self._loaded = True
-        print(f"\n📚 Knowledge base ready: {len(self.codes)} codes, {len(self._all_articles)} total articles")
-        return self
+        self._log(f"✅ Loaded {code_id}: {len(legal_code.articles)} articles ({source})")
+        return legal_code
+
+    def _finalize(self):
+        """Compute everything that depends on the whole corpus."""
+        snapshot = self._snapshot
+        # Lazy loading fills self.codes in access order; restore registry order
+        # (ties in search results follow it)
+        self.codes = {cid: self.codes[cid] for cid in self.CODE_REGISTRY if cid in self.codes}
+        self._all_articles = [art for code in self.codes.values() for art in code.articles]
+        self._compute_field_stats()
+        self.fingerprint = self._compute_fingerprint()
+
+        topics_stale = True
+        if snapshot and snapshot.topic_fingerprint == self._topic_fingerprint():
+            self._topic_tables = snapshot.load_topic_tables()
+            topics_stale = False
+        else:
+            self._topic_tables = self._materialize_topics()
+
+        if self.use_snapshot and (
+            topics_stale or snapshot is None
+            or set(snapshot.code_ids) != set(self.codes)
+            or any(snapshot.source_sha256(cid) != c.source_sha256 for cid, c in self.codes.items())
+        ):
+            self.save_snapshot()
+
+        self._snapshot = None
+        self._previous = None
+        self._complete = True
+        self._log(f"\n📚 Knowledge base ready: {len(self.codes)} codes, {len(self._all_articles)} total articles")
+
+    def source_path(self, code_id: str) -> str:
+        """Path of the processed JSON a code is built from."""
+        return os.path.join(self.data_dir, f"{code_id}.json")
+
+    def changed_sources(self) -> list[str]:
+        """
+        Return the code_ids whose source JSON appeared, disappeared or no
+        longer matches the hash this knowledge base was built from.
+        """
+        changed = []
+        for code_id in self.CODE_REGISTRY:
+            if code_id in self._pending:
+                continue  # not bound to a source version yet
+            path = self.source_path(code_id)
+            code = self.codes.get(code_id)
+            if not os.path.exists(path):
+                if code:
+                    changed.append(code_id)
+            elif not code or source_digest(path) != code.source_sha256:
+                changed.append(code_id)
+        return changed
+
+    def _log(self, message: str):
+        if self.verbose:
+            print(message)
+
+    def _load_code_json(self, code_id: str, meta: dict, json_path: str) -> LegalCode:
+        """Parse, normalize and index one code from its processed JSON."""
+        with open(json_path, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+
+        info = self._code_info(code_id, raw.get("name", meta["name"]), raw.get("law_number", meta["law"]))
+
+        legal_code = LegalCode(
+            code_id=code_id,
+            name=info.name,
+            law_number=info.law_number,
+            total_articles=raw.get("total_articles", 0),
+        )
+
+        base_id = info.number * ARTICLE_ID_STRIDE
+        for raw_art in raw.get("articles", []):
+            article = self._normalize_article(raw_art, info, base_id + len(legal_code.articles))
+            if article:
+                legal_code.articles.append(article)
+
+        legal_code.build_index()
+        legal_code.normalized = NormalizedTextStore.from_articles(legal_code.articles)
+        legal_code.search_index = InvertedIndex.build(legal_code.normalized)
+        return legal_code
+
+    @classmethod
+    def _code_info(cls, code_id: str, name: str, law_number: str) -> CodeInfo:
+        return CodeInfo(list(cls.CODE_REGISTRY).index(code_id), code_id, name, law_number)
+
+    @classmethod
+    def _code_from_snapshot(cls, snap: CodeSnapshot) -> LegalCode:
+        """Rebuild a LegalCode from its snapshot section (no JSON, no indexing)."""
+        info = cls._code_info(snap.code_id, snap.name, snap.law_number)
+        base_id = info.number * ARTICLE_ID_STRIDE
+        legal_code = LegalCode(
+            code_id=snap.code_id,
+            name=snap.name,
+            law_number=snap.law_number,
+            total_articles=snap.total_articles,
+            articles=[
+                Article(info, base_id + pos, number, title, content)
+                for pos, (number, title, content) in enumerate(snap.articles)
+            ],
+            normalized=snap.normalized,
+            search_index=snap.search_index,
+            source_sha256=snap.source_sha256,
+        )
+        legal_code.build_index()
+        return legal_code
 
-    def _normalize_article(
-        self, raw: dict, code_id: str, code_name: str, law_number: str
-    ) -> Optional[Article]:
+    def save_snapshot(self):
+        """Write the loaded codes to the binary snapshot file."""
+        try:
+            write_snapshot(self.snapshot_path, [
+                CodeSnapshot(
+                    code_id=code.code_id,
+                    source_sha256=code.source_sha256,
+                    name=code.name,
+                    law_number=code.law_number,
+                    total_articles=code.total_articles,
+                    articles=[(a.article_number, a.title, a.content) for a in code.articles],
+                    normalized=code.normalized,
+                    search_index=code.search_index,
+                )
+                for code in self.codes.values()
+            ], topic_tables=(self._topic_fingerprint(), self._topic_tables))
+        except OSError as e:
+            print(f"⚠️  Could not write knowledge base snapshot: {e}")
+
+    def _normalize_article(self, raw: dict, code: CodeInfo, article_id: int) -> Optional[Article]:
         """
         Normalize an article from either JSON schema into our unified format.
         
@@ -178,9 +560,8 @@ class LegalKnowledgeBase:
             title = raw.get("title", f"Artículo {art_num}")
 
             return Article(
-                code_id=code_id,
-                code_name=code_name,
-                law_number=law_number,
+                code=code,
+                article_id=article_id,
                 article_number=art_num,
                 title=title,
                 content=content,
@@ -197,71 +578,204 @@ class LegalKnowledgeBase:
         EXACT search: find article by code + number.
         Returns list because some codes have duplicate numbers (e.g., título preliminar).
         """
-        code = self.codes.get(code_id)
+        code = self._code(code_id)
         if not code:
             return []
         return code.find_exact(article_number)
 
     def find_article_any_code(self, article_number: int) -> list[Article]:
         """Search for an article number across ALL codes."""
+        self.ensure_loaded()
         results = []
         for code in self.codes.values():
             results.extend(code.find_exact(article_number))
         return results
 
+    def find_article_range(
+        self,
+        code_id: Optional[str],
+        start: int,
+        end: int,
+        limit: Optional[int] = None,
+    ) -> list[Article]:
+        """
+        RANGE search: articles numbered ``start`` to ``end`` (inclusive) in
+        ascending number order. ``code_id=None`` searches every code, one
+        code after another. Stops after ``limit`` articles.
+        """
+        if end < start:
+            return []
+        if code_id is None:
+            self.ensure_loaded()
+            codes = list(self.codes.values())
+        else:
+            code = self._code(code_id)
+            codes = [code] if code else []
+
+        results: list[Article] = []
+        for code in codes:
+            remaining = None if limit is None else limit - len(results)
+            if remaining is not None and remaining <= 0:
+                break
+            results.extend(code.find_range(start, end, remaining))
+        return results
+
+    def find_articles_bulk(
+        self, refs: Iterable[tuple[Optional[str], int]]
+    ) -> list[list[Article]]:
+        """
+        Resolve many (code_id or None, article_number) references in one
+        call. Returns one result list per reference, in input order; a
+        ``None`` code searches every code (like find_article_any_code).
+        Only the codes the references need are loaded.
+        """
+        refs = list(refs)
+        any_code = any(code_id is None for code_id, _ in refs)
+        if any_code:
+            self.ensure_loaded()
+        all_codes = list(self.codes.values()) if any_code else []
+        codes = {code_id: self._code(code_id) for code_id, _ in refs if code_id is not None}
+
+        results = []
+        for code_id, number in refs:
+            if code_id is None:
+                results.append([art for code in all_codes for art in code.find_exact(number)])
+            else:
+                code = codes[code_id]
+                results.append(list(code.find_exact(number)) if code else [])
+        return results
+
+    def find_articles_by_id(self, article_ids: Iterable[int]) -> list[Article]:
+        """
+        Articles by ``article_id``, in input order (unknown ids are skipped).
+        Ids are only stable within one knowledge base version (fingerprint).
+        """
+        registry = list(self.CODE_REGISTRY)
+        results = []
+        for article_id in article_ids:
+            code_number, position = divmod(article_id, ARTICLE_ID_STRIDE)
+            if code_number >= len(registry):
+                continue
+            code = self._code(registry[code_number])
+            if code and position < len(code.articles):
+                results.append(code.articles[position])
+        return results
+
     def search_by_keywords(
         self,
         query: str,
         code_id: Optional[str] = None,
         max_results: int = 10,
+        ranking: str = RANKING_LEGACY,
     ) -> list[Article]:
         """
         KEYWORD search: find articles whose content matches the query terms.
         
         This is a TF-based keyword search that scores articles by how many
         query terms they contain (case-insensitive, accent-insensitive).
+        It runs against each code's inverted index, so only the postings of
+        the matched terms are visited. Ties keep corpus order.
         
         Args:
             query: Natural language search query
             code_id: If provided, search only this code. Otherwise, search all.
             max_results: Maximum number of results to return.
+            ranking: "legacy" (default) or "bm25". BM25 uses corpus-wide
+                     statistics, so filtering by code does not change scores.
         
         Returns:
             List of Articles sorted by relevance (most matching terms first).
         """
-        # Normalize and tokenize query
-        query_terms = self._tokenize(query)
-        if not query_terms:
-            return []
+        if ranking not in RANKING_MODES:
+            raise ValueError(f"Unknown ranking mode: {ranking!r}. Use one of {RANKING_MODES}")
 
-        articles_to_search = (
-            self.codes[code_id].articles if code_id and code_id in self.codes
-            else self._all_articles
-        )
-
-        scored: list[tuple[float, Article]] = []
-        for art in articles_to_search:
-            score = self._score_article(art, query_terms)
-            if score > 0:
-                scored.append((score, art))
-
-        # Sort by score descending
-        scored.sort(key=lambda x: x[0], reverse=True)
-        return [art for _, art in scored[:max_results]]
+        code_ids = self._search_scope(code_id, corpus_stats=ranking == RANKING_BM25)
+        ranked = self._rank(self._tokenize(query), code_ids, ranking, max_results)
+        return [self.codes[cid].articles[pos] for cid, pos in ranked]
 
     def search_by_topic(
         self,
         topic: str,
         code_id: Optional[str] = None,
         max_results: int = 10,
+        ranking: str = RANKING_LEGACY,
     ) -> list[Article]:
         """
         TOPIC search: Enhanced keyword search that also checks titles 
         and uses legal term expansion.
+
+        Topics from TOPIC_VOCABULARY are served from the materialized topic
+        tables when ``max_results`` fits within TOPIC_TABLE_DEPTH.
         """
+        if ranking not in RANKING_MODES:
+            raise ValueError(f"Unknown ranking mode: {ranking!r}. Use one of {RANKING_MODES}")
+
+        self._search_scope(code_id, corpus_stats=ranking == RANKING_BM25)
+        if self._complete:
+            table_key = (topic, code_id if code_id in self.codes else "", ranking)
+            refs = self._topic_tables.get(table_key)
+            if refs is not None and max_results <= TOPIC_TABLE_DEPTH:
+                return [self.codes[cid].articles[pos] for cid, pos in refs[:max_results]]
+
         # Expand common legal topic terms
         expanded = self._expand_legal_terms(topic)
-        return self.search_by_keywords(expanded, code_id=code_id, max_results=max_results)
+        return self.search_by_keywords(
+            expanded, code_id=code_id, max_results=max_results, ranking=ranking
+        )
+
+    def search_semantic(
+        self,
+        query: str,
+        code_id: Optional[str] = None,
+        max_results: int = 10,
+        provider: Union[str, "EmbeddingProvider", None] = None,
+        nprobe: Optional[int] = None,
+    ) -> list[Article]:
+        """
+        SEMANTIC search: articles whose embedding is most cosine-similar to
+        the query's, using the persisted per-code embedding matrices
+        (computed and saved on first use). No database round-trip.
+
+        Codes with at least ANN_MIN_ROWS articles are searched through an
+        IVF-flat ANN index (see ann_index); smaller ones exactly.
+
+        Args:
+            query: Natural language search query
+            code_id: If provided, search only this code. Otherwise, search all.
+            max_results: Maximum number of results to return.
+            provider: Embedding provider name or instance. Defaults to
+                      LEXAI_EMBEDDING_PROVIDER (the offline "hashing" provider).
+            nprobe: Search every code through its ANN index, probing this
+                    many cells (higher = better recall, slower). None keeps
+                    the size-based default.
+        """
+        return self.search_semantic_batch([query], code_id, max_results, provider, nprobe)[0]
+
+    def search_semantic_batch(
+        self,
+        queries: list[str],
+        code_id: Optional[str] = None,
+        max_results: int = 10,
+        provider: Union[str, "EmbeddingProvider", None] = None,
+        nprobe: Optional[int] = None,
+    ) -> list[list[Article]]:
+        """Semantic search for several queries with one matrix product per code."""
+        ranked = self._semantic_rank(
+            queries, self._search_scope(code_id), max_results, provider, nprobe
+        )
+        return [
+            [self.codes[cid].articles[pos] for cid, pos, _ in results]
+            for results in ranked
+        ]
+
+    def build_embeddings(self, provider: Union[str, "EmbeddingProvider", None] = None):
+        """Compute (or load) the embedding matrix of every code now."""
+        from agents.embeddings import get_embedding_provider
+
+        provider = get_embedding_provider(provider)
+        self.ensure_loaded()
+        for code in self.codes.values():
+            self._embedding_matrix(code, provider)
 
     # ------------------------------------------------------------------
     # Utility / Info
@@ -269,6 +783,7 @@ class LegalKnowledgeBase:
 
     def get_available_codes(self) -> list[dict]:
         """Return metadata about all loaded codes."""
+        self.ensure_loaded()
         return [
             {
                 "code_id": code.code_id,
@@ -281,6 +796,7 @@ class LegalKnowledgeBase:
 
     def get_stats(self) -> dict:
         """Return overall statistics."""
+        self.ensure_loaded()
         return {
             "total_codes": len(self.codes),
             "total_articles": len(self._all_articles),
@@ -293,90 +809,215 @@ class LegalKnowledgeBase:
     # Internal helpers
     # ------------------------------------------------------------------
 
-    @staticmethod
-    def _remove_accents(text: str) -> str:
-        """Remove accent marks for accent-insensitive matching."""
-        nfkd = unicodedata.normalize("NFKD", text)
-        return "".join(c for c in nfkd if not unicodedata.category(c).startswith("M"))
+    def _search_scope(self, code_id: Optional[str], corpus_stats: bool = False) -> list[str]:
+        """
+        Code ids a search covers, loading what it needs. A search of one
+        code only needs that code, unless its scores use corpus-wide
+        statistics (BM25); unfiltered searches load everything.
+        """
+        if code_id and not corpus_stats and self._code(code_id):
+            return [code_id]
+        self.ensure_loaded()
+        return [code_id] if code_id and code_id in self.codes else list(self.codes)
 
-    def _tokenize(self, text: str) -> list[str]:
-        """Tokenize text into lowercase, accent-free terms (min 3 chars)."""
-        text = self._remove_accents(text.lower())
-        # Remove non-alphanumeric except spaces
-        text = re.sub(r"[^a-z0-9\s]", " ", text)
-        tokens = text.split()
-        # Filter stopwords and short tokens
-        stopwords = {
-            "el", "la", "los", "las", "un", "una", "unos", "unas",
-            "de", "del", "en", "por", "para", "con", "sin", "que",
-            "se", "al", "es", "su", "sus", "no", "si", "como",
-            "mas", "pero", "este", "esta", "estos", "estas",
-            "ser", "hay", "son", "fue", "han", "puede", "debe",
-            "todo", "toda", "todos", "todas", "otro", "otra",
-            "cual", "cuando", "donde", "quien", "sobre", "entre",
-        }
-        return [t for t in tokens if len(t) >= 3 and t not in stopwords]
+    def _rank(
+        self,
+        query_terms: list[str],
+        code_ids: list[str],
+        ranking: str,
+        max_results: Optional[int] = None,
+    ) -> list[tuple[str, int]]:
+        """
+        Rank the articles of ``code_ids`` for ``query_terms``. Returns
+        (code_id, local position) pairs, best first, ties in corpus order.
+        """
+        if not query_terms:
+            return []
 
-    def _score_article(self, article: Article, query_terms: list[str]) -> float:
+        # (negated score, code order, local position) — sorting ascending
+        # gives score descending with ties in corpus order
+        scored: list[tuple[float, int, int]] = []
+        if ranking == RANKING_BM25:
+            idf = {term: self._idf(term) for term in query_terms}
+        for order, cid in enumerate(code_ids):
+            index = self.codes[cid].search_index
+            if ranking == RANKING_BM25:
+                scores = index.score_bm25(
+                    query_terms, idf, self._avg_title_len, self._avg_content_len
+                )
+            else:
+                scores = index.score_terms(query_terms)
+            for doc, score in scores.items():
+                scored.append((-score, order, doc))
+
+        top = heapq.nsmallest(max_results, scored) if max_results is not None else sorted(scored)
+        return [(code_ids[order], doc) for _, order, doc in top]
+
+    def _embedding_matrix(self, code: LegalCode, provider: "EmbeddingProvider") -> "np.ndarray":
+        """Article embeddings of ``code``: cached, memory-mapped, or computed and saved."""
+        from agents.embeddings import article_text, load_matrix, matrix_path, save_matrix
+
+        key = (provider.key, code.code_id)
+        matrix = self._embeddings.get(key)
+        if matrix is not None:
+            return matrix
+        with self._embeddings_lock:
+            matrix = self._embeddings.get(key)
+            if matrix is None:
+                path = matrix_path(self.data_dir, provider, code.code_id, code.source_sha256)
+                matrix = load_matrix(path, len(code.articles), provider.dim)
+                if matrix is None:
+                    self._log(f"🧮 Embedding {code.code_id} ({len(code.articles)} articles, {provider.key})")
+                    matrix = provider.embed([article_text(art) for art in code.articles])
+                    try:
+                        save_matrix(path, matrix)
+                    except OSError as e:
+                        print(f"⚠️  Could not save embeddings for {code.code_id}: {e}")
+                self._embeddings[key] = matrix
+        return matrix
+
+    def _ann_index(self, code: LegalCode, provider: "EmbeddingProvider") -> "IVFFlatIndex":
+        """IVF index over a code's embedding matrix: cached, loaded, or built and saved."""
+        from agents.ann_index import IVFFlatIndex, index_path
+        from agents.embeddings import matrix_path
+
+        key = (provider.key, code.code_id)
+        index = self._ann_indexes.get(key)
+        if index is not None:
+            return index
+        matrix = self._embedding_matrix(code, provider)
+        with self._embeddings_lock:
+            index = self._ann_indexes.get(key)
+            if index is None:
+                path = index_path(matrix_path(self.data_dir, provider, code.code_id, code.source_sha256))
+                index = IVFFlatIndex.load(path, matrix)
+                if index is None:
+                    self._log(f"🧭 Building ANN index for {code.code_id} ({provider.key})")
+                    index = IVFFlatIndex.build(matrix)
+                    try:
+                        index.save(path)
+                    except OSError as e:
+                        print(f"⚠️  Could not save ANN index for {code.code_id}: {e}")
+                self._ann_indexes[key] = index
+        return index
+
+    def _semantic_rank(
+        self,
+        queries: list[str],
+        code_ids: list[str],
+        max_results: int,
+        provider: Union[str, "EmbeddingProvider", None] = None,
+        nprobe: Optional[int] = None,
+    ) -> list[list[tuple[str, int, float]]]:
         """
-        Score an article based on how many query terms appear in its content.
-        
-        Scoring:
-        - +2.0 for each term found in the title
-        - +1.0 for each term found in the content
-        - Bonus for articles where ALL terms appear
+        Cosine top-k for each query over ``code_ids``. Returns, per query,
+        (code_id, local position, similarity) triples, best first, ties in
+        corpus order. See search_semantic for ``nprobe``.
         """
-        title_norm = self._remove_accents(article.title.lower())
-        content_norm = self._remove_accents(article.content.lower())
-        full_text = title_norm + " " + content_norm
+        from agents.ann_index import ANN_MIN_ROWS, DEFAULT_NPROBE
+        from agents.embeddings import get_embedding_provider, top_k
 
-        score = 0.0
-        terms_found = 0
+        provider = get_embedding_provider(provider)
+        query_vectors = provider.embed(queries)
+        # Per query: (negated similarity, code order, local position)
+        candidates: list[list[tuple[float, int, int]]] = [[] for _ in queries]
+        for order, cid in enumerate(code_ids):
+            code = self.codes[cid]
+            if nprobe is not None or len(code.articles) >= ANN_MIN_ROWS:
+                index = self._ann_index(code, provider)
+                hits = index.search(query_vectors, max_results, nprobe or DEFAULT_NPROBE)
+                for q, (positions, sims) in enumerate(hits):
+                    candidates[q].extend(
+                        (-float(sim), order, int(pos)) for pos, sim in zip(positions, sims)
+                    )
+                continue
 
-        for term in query_terms:
-            if term in title_norm:
-                score += 2.0
-                terms_found += 1
-            elif term in content_norm:
-                score += 1.0
-                terms_found += 1
+            matrix = self._embedding_matrix(code, provider)
+            if not len(matrix):
+                continue
+            scores = query_vectors @ matrix.T
+            for q, positions in enumerate(top_k(scores, max_results)):
+                candidates[q].extend((-float(scores[q, pos]), order, int(pos)) for pos in positions)
 
-        # Bonus: all terms present
-        if terms_found == len(query_terms) and len(query_terms) > 1:
-            score += 3.0
+        return [
+            [(code_ids[order], pos, -neg) for neg, order, pos in heapq.nsmallest(max_results, cands)]
+            for cands in candidates
+        ]
+
+    def _materialize_topics(self) -> dict[tuple[str, str, str], list[tuple[str, int]]]:
+        """
+        Precompute search_by_topic results for every TOPIC_VOCABULARY topic,
+        code filter ("" = all codes) and ranking mode. Scores do not depend on
+        the code filter, so each per-code table is a filtered view of one
+        corpus-wide ranking.
+        """
+        tables: dict[tuple[str, str, str], list[tuple[str, int]]] = {}
+        code_ids = list(self.codes)
+        for topic in TOPIC_VOCABULARY:
+            terms = self._tokenize(self._expand_legal_terms(topic))
+            for ranking in RANKING_MODES:
+                ranked = self._rank(terms, code_ids, ranking)
+                tables[(topic, "", ranking)] = ranked[:TOPIC_TABLE_DEPTH]
+                for cid in code_ids:
+                    tables[(topic, cid, ranking)] = [
+                        ref for ref in ranked if ref[0] == cid
+                    ][:TOPIC_TABLE_DEPTH]
+        return tables
+
+    def _compute_fingerprint(self) -> str:
+        """Hash of the loaded codes and their source JSON hashes."""
+        h = hashlib.sha256()
+        for cid, code in self.codes.items():
+            h.update(f"{cid}={code.source_sha256};".encode())
+        return h.hexdigest()
+
+    def _topic_fingerprint(self) -> str:
+        """Corpus fingerprint plus everything the topic tables depend on, scoring included."""
+        h = hashlib.sha256(self.fingerprint.encode())
+        h.update(repr((
+            TOPIC_VOCABULARY, LEGAL_TERM_EXPANSIONS, TOPIC_TABLE_DEPTH, RANKING_MODES, SCORING_PARAMS,
+        )).encode())
+        return h.hexdigest()
+
+    def _compute_field_stats(self):
+        """Precompute corpus-wide average field lengths for BM25F."""
+        total_docs = sum(len(c.search_index) for c in self.codes.values())
+        if total_docs:
+            self._avg_title_len = sum(
+                sum(c.search_index.title_len) for c in self.codes.values()
+            ) / total_docs
+            self._avg_content_len = sum(
+                sum(c.search_index.content_len) for c in self.codes.values()
+            ) / total_docs
+        self._idf_cache = {}
+
+    def _idf(self, term: str) -> float:
+        """Corpus-wide IDF of a query term (memoized)."""
+        idf = self._idf_cache.get(term)
+        if idf is None:
+            doc_freq = sum(len(c.search_index.term_hits(term)) for c in self.codes.values())
+            total_docs = sum(len(c.search_index) for c in self.codes.values())
+            idf = self._idf_cache[term] = bm25_idf(doc_freq, total_docs)
+        return idf
+
+    @staticmethod
+    def _remove_accents(text: str) -> str:
+        """Remove accent marks for accent-insensitive matching."""
+        return strip_accents(text)
 
-        return score
+    def _tokenize(self, text: str) -> list[str]:
+        """Tokenize text into lowercase, accent-free terms (min 3 chars)."""
+        # Filter stopwords and short tokens
+        return [t for t in fold_query(text).split() if len(t) >= 3 and t not in STOPWORDS]
 
     @staticmethod
     def _expand_legal_terms(topic: str) -> str:
         """
         Expand common legal topics with related terms to improve search.
         """
-        expansions = {
-            "contrato": "contrato obligaciones acuerdo convenio partes",
-            "matrimonio": "matrimonio cónyuges divorcio separación familia",
-            "herencia": "herencia sucesión testamento herederos legatarios",
-            "despido": "despido terminación relación laboral trabajador patrono indemnización",
-            "arrendamiento": "arrendamiento alquiler arrendatario arrendador renta",
-            "propiedad": "propiedad dominio inmueble bienes posesión",
-            "delito": "delito pena sanción penal culpable",
-            "prescripción": "prescripción plazo caducidad término vencimiento",
-            "obligación": "obligación deuda acreedor deudor pago",
-            "sociedad": "sociedad mercantil socios capital acciones",
-            "salario": "salario remuneración pago jornal compensación sueldo",
-            "vacaciones": "vacaciones descanso licencia permiso",
-            "aguinaldo": "aguinaldo décimo tercer mes sueldo adicional",
-            "homicidio": "homicidio muerte matar vida",
-            "robo": "robo hurto sustracción apoderamiento",
-            "estafa": "estafa fraude engaño perjuicio patrimonial",
-            "divorcio": "divorcio separación disolución vínculo matrimonial",
-            "alimentos": "alimentos pensión alimentaria manutención",
-            "daños": "daños perjuicios indemnización responsabilidad civil",
-            "embargo": "embargo secuestro bienes ejecución",
-        }
         topic_lower = topic.lower()
         expanded = topic
-        for key, expansion in expansions.items():
+        for key, expansion in LEGAL_TERM_EXPANSIONS.items():
             if key in topic_lower:
                 expanded = f"{topic} {expansion}"
                 break
@@ -387,15 +1028,14 @@ class LegalKnowledgeBase:
 # Singleton accessor
 # ---------------------------------------------------------------------------
 
-_kb_instance: Optional[LegalKnowledgeBase] = None
-
-
 def get_knowledge_base(data_dir: Optional[str] = None) -> LegalKnowledgeBase:
     """
-    Get (or create) the singleton LegalKnowledgeBase instance.
-    Thread-safe for typical Python use (GIL).
+    Get (or create) the shared LegalKnowledgeBase instance.
+
+    Backed by KnowledgeBaseHolder: the first call loads exactly once even
+    under concurrent callers, and after a hot reload this returns the newly
+    swapped-in knowledge base. Callers should fetch it once per request
+    rather than caching it for the lifetime of the process.
     """
-    global _kb_instance
-    if _kb_instance is None:
-        _kb_instance = LegalKnowledgeBase(data_dir=data_dir).load()
-    return _kb_instance
+    from agents.kb_holder import get_kb_holder
+    return get_kb_holder(data_dir).get()
@@ -0,0 +1,338 @@
+"""
+Legal Matcher - One compiled scanner behind every query/document detector.
+
+The agents classify text in several ways: search topics of a query, type and
+topics of a document, code hints, and article references ("artículo 45",
+"arts. 10 al 15 del Código Civil"). Each used to scan the full text with its
+own regexes. For a long contract that meant well over a hundred passes.
+
+Here every keyword of every detector is compiled into a single trie-shaped
+regex, built once at import. ``scan_legal_text`` finds all of them, plus the
+article references and line breaks, in ONE left-to-right pass. It then
+derives each detector's answer from those matches. Matches may overlap
+("procesal penal" also contains "penal"), because the keyword trie sits
+inside a lookahead that is tried at every position.
+
+Keyword syntax (a tiny subset of the original regexes):
+    word      whole word (\\bword\\b)
+    word*     word prefix (\\bword)
+    *word*    plain substring
+    [ií]      one of these characters
+    ~         optional separator (the original ".?")
+    .         exactly one separator (the original ".")
+Separators are whitespace and common punctuation; the original "." also
+matched letters, which no rule relied on.
+"""
+
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional, Union
+
+# A rule is (keywords, label). Keywords are alternatives; a tuple of two
+# keyword lists (A, B) means "an A word followed by a B word on the same
+# line" (the original "\bA\b.*\bB").
+Keywords = Union[list[str], tuple[list[str], list[str]]]
+
+# Query topics -> search terms (first match of each label wins, in order)
+SEARCH_TOPIC_RULES: list[tuple[Keywords, str]] = [
+    (["contrat*"], "contrato"),
+    (["despi*"], "despido"),
+    (["vacacion*"], "vacaciones"),
+    (["aguinaldo", "décimo~tercer"], "aguinaldo"),
+    (["salario*", "sueldo*", "remunerac*"], "salario"),
+    (["matrimonio*", "casar*"], "matrimonio"),
+    (["divorci*"], "divorcio"),
+    (["herencia*", "hered*"], "herencia"),
+    (["propiedad", "inmueble", "terreno", "finca"], "propiedad"),
+    (["arrendamiento*", "alquiler*", "inquilin*"], "arrendamiento"),
+    (["sociedad", "empresa", "compañía"], "sociedad"),
+    (["prescripci*", "prescrib*"], "prescripción"),
+    (["obligaci*", "deuda*"], "obligación"),
+    (["delito", "crimen", "criminal"], "delito"),
+    (["homicidio", "asesinat", "matar"], "homicidio"),
+    (["robo", "hurto", "robar"], "robo"),
+    (["estafa", "fraude", "engaño"], "estafa"),
+    (["daños*", "perjuicios*", "indemnizaci*"], "daños"),
+    (["embargo", "embargar"], "embargo"),
+    (["alimento*", "pensión~alimentaria*", "manutenci*"], "alimentos"),
+    (["jornada", "horas~extra", "horario"], "jornada laboral"),
+    (["preaviso"], "preaviso"),
+    (["cesant[ií]a"], "cesantía"),
+    (["garantía", "fianza"], "garantía"),
+    (["hipoteca*"], "hipoteca"),
+    (["testamento*", "sucesi*"], "testamento"),
+    (["usufruct*"], "usufructo"),
+    (["servidumbre*"], "servidumbre"),
+    (["posesi[oó]n", "poseedor"], "posesión"),
+    (["compraventa", "compra", "venta"], "compraventa"),
+    (["donaci[oó]n", "donar"], "donación"),
+    (["poder", "mandato", "poderdante"], "mandato"),
+    (["responsabilidad"], "responsabilidad"),
+    (["capacidad", "incapacidad", "menor"], "capacidad"),
+    (["persona~jur[ií]dica*", "asociaci*"], "persona jurídica"),
+    (["comerciant", "actividad~comercial"], "comerciante"),
+    (["quiebra", "insolvencia"], "quiebra"),
+    (["t[ií]tulo~valor", "letra~de~cambio", "pagar[eé]", "cheque"], "títulos valores"),
+    (["trabajador*", "patrono*", "empleador*", "emplead*"], "relación laboral"),
+    (["sindicato", "huelga"], "sindicato"),
+    (["seguridad~social", "ccss"], "seguridad social"),
+    (["justa~causa"], "despido"),
+    ((["derecho", "derechos"], ["laboral*", "trabajador*"]), "relación laboral"),
+]
+
+# Document type (the first matching rule wins)
+DOCUMENT_TYPE_RULES: list[tuple[Keywords, str]] = [
+    (["contrato"], "Contrato"),
+    (["convenio"], "Convenio"),
+    (["demanda"], "Demanda"),
+    (["recurso.de.amparo"], "Recurso de Amparo"),
+    (["apelaci[oó]n"], "Apelación"),
+    (["testamento"], "Testamento"),
+    (["escritura"], "Escritura Pública"),
+    ((["poder"], ["especial"]), "Poder Especial"),
+    ((["poder"], ["general"]), "Poder General"),
+    (["notificaci[oó]n"], "Notificación"),
+    (["resoluci[oó]n"], "Resolución"),
+    (["sentencia"], "Sentencia"),
+    (["denuncia"], "Denuncia"),
+    (["querella"], "Querella"),
+    (["arrendamiento"], "Contrato de Arrendamiento"),
+    (["compraventa"], "Contrato de Compraventa"),
+    ((["laboral"], ["contrato"]), "Contrato Laboral"),
+    ((["contrato"], ["trabajo"]), "Contrato Laboral"),
+    ((["sociedad"], ["an[oó]nima"]), "Constitución de Sociedad"),
+    (["fideicomiso"], "Fideicomiso"),
+    (["hipoteca"], "Hipoteca"),
+    (["pagaré"], "Pagaré"),
+    (["letra.de.cambio"], "Letra de Cambio"),
+]
+
+# Document topics (plain substring checks, in order)
+DOCUMENT_TOPIC_RULES: list[tuple[Keywords, str]] = [
+    (["*contrato*", "*cláusula*", "*obligación*", "*acuerdo*"], "contrato"),
+    (["*arrendamiento*", "*alquiler*", "*inquilino*", "*arrendatario*"], "arrendamiento"),
+    (["*compraventa*", "*precio*", "*vendedor*", "*comprador*"], "compraventa"),
+    (["*trabajador*", "*patrono*", "*empleador*", "*salario*", "*despido*", "*laboral*"], "trabajo"),
+    (["*sociedad*", "*acciones*", "*socios*", "*capital social*", "*asamblea*"], "sociedad"),
+    (["*propiedad*", "*inmueble*", "*finca*", "*terreno*", "*inscripción*"], "propiedad"),
+    (["*herencia*", "*heredero*", "*testamento*", "*sucesión*", "*legado*"], "herencia"),
+    (["*matrimonio*", "*cónyuge*", "*bienes gananciales*"], "matrimonio"),
+    (["*hipoteca*", "*garantía hipotecaria*", "*acreedor hipotecario*"], "hipoteca"),
+    (["*daños*", "*perjuicios*", "*indemnización*", "*responsabilidad*"], "daños"),
+    (["*obligación*", "*acreedor*", "*deudor*", "*pago*", "*mora*"], "obligaciones"),
+    (["*prescripción*", "*caducidad*", "*plazo*"], "prescripción"),
+    (["*delito*", "*pena*", "*imputado*", "*víctima*", "*denuncia*"], "delito"),
+    (["*alimentos*", "*custodia*", "*patria potestad*", "*divorcio*"], "familia"),
+    (["*letra de cambio*", "*pagaré*", "*cheque*", "*título valor*"], "títulos valores"),
+    (["*comerciante*", "*registro mercantil*", "*empresa*"], "comerciante"),
+]
+
+# Code hints in a query (plain substring, the first matching rule wins)
+QUERY_CODE_HINT_RULES: list[tuple[Keywords, str]] = [
+    (["*civil*"], "codigo-civil"),
+    (["*comercio*"], "codigo-comercio"),
+    (["*penal*"], "codigo-penal"),
+    (["*procesal penal*"], "codigo-procesal-penal"),
+    (["*procesal*"], "codigo-procesal-penal"),
+    (["*trabajo*"], "codigo-trabajo"),
+    (["*laboral*"], "codigo-trabajo"),
+]
+
+# Code named right after an article reference ("art. 45 del Código Civil")
+REFERENCE_CODE_MAP = {
+    "civil": "codigo-civil",
+    "comercio": "codigo-comercio",
+    "penal": "codigo-penal",
+    "trabajo": "codigo-trabajo",
+    "laboral": "codigo-trabajo",
+    "procesal": "codigo-procesal-penal",
+}
+
+# "artículo(s) X", "art. X", "arts X" with an optional range end
+# ("al/a/hasta Y") and an optional code ("del Código Civil")
+_REFERENCE_PATTERN = (
+    r"art(?:[ií]culos?|s?\.?)\s*(?P<num>\d+)"
+    r"(?:\s*(?:al|a|hasta)\s*(?P<end>\d+))?"
+    r"(?:\s*(?:del|de\s+la?|al)\s*)?"
+    r"(?:(?:c[oó]digo|ley)\s+(?:de\s+)?)?"
+    r"(?P<code>civil|comercio|penal|trabajo|laboral|procesal)?"
+)
+
+_SEPARATORS = (" ", "\t", "-", "_", ".", ",", "/")
+_RULE_SETS = {
+    "search_topic": SEARCH_TOPIC_RULES,
+    "document_type": DOCUMENT_TYPE_RULES,
+    "document_topic": DOCUMENT_TOPIC_RULES,
+    "code_hint": QUERY_CODE_HINT_RULES,
+}
+
+
+# ---------------------------------------------------------------------------
+# Compilation
+# ---------------------------------------------------------------------------
+
+def _expand(keyword: str) -> tuple[list[str], bool, bool]:
+    """Expand a keyword into its literal spellings plus its boundary flags."""
+    left = not keyword.startswith("*")
+    right = not keyword.endswith("*")
+    body = keyword.strip("*")
+    variants = [""]
+    i = 0
+    while i < len(body):
+        ch = body[i]
+        if ch == "[":
+            close = body.index("]", i)
+            options = list(body[i + 1:close])
+            i = close + 1
+        elif ch == "~":
+            options = [""] + list(_SEPARATORS)
+            i += 1
+        elif ch == ".":
+            options = list(_SEPARATORS)
+            i += 1
+        else:
+            options = [ch]
+            i += 1
+        variants = [v + o for v in variants for o in options]
+    return variants, left, right
+
+
+def _trie_regex(literals) -> str:
+    """Regex matching the longest of ``literals`` at the current position."""
+    trie: dict = {}
+    for literal in literals:
+        node = trie
+        for ch in literal:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def build(node: dict) -> str:
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{body})?" if "" in node else body
+
+    return build(trie)
+
+
+# literal -> [(rule set, rule index, part, needs left boundary, needs right boundary)]
+# part is None for simple rules, 0/1 for the A/B side of "A ... B" rules
+_LITERAL_RULES: dict[str, list[tuple[str, int, Optional[int], bool, bool]]] = {}
+for _set_name, _rules in _RULE_SETS.items():
+    for _index, (_keywords, _label) in enumerate(_rules):
+        _parts = list(enumerate(_keywords)) if isinstance(_keywords, tuple) else [(None, _keywords)]
+        for _part, _words in _parts:
+            for _word in _words:
+                _variants, _left, _right = _expand(_word)
+                for _literal in _variants:
+                    _LITERAL_RULES.setdefault(_literal, []).append(
+                        (_set_name, _index, _part, _left, _right)
+                    )
+
+# For each literal, the literals that are prefixes of it (itself included):
+# the trie reports only the longest literal starting at a position
+_PREFIX_LITERALS = {
+    literal: [literal[:n] for n in range(1, len(literal) + 1) if literal[:n] in _LITERAL_RULES]
+    for literal in _LITERAL_RULES
+}
+
+_TRIE = _trie_regex(_LITERAL_RULES)
+_SCANNER = re.compile(
+    rf"(?=(?P<ref>{_REFERENCE_PATTERN}))(?:(?=(?P<lit>{_TRIE})))?"
+    rf"|(?=(?P<lit2>{_TRIE}))"
+    r"|(?P<nl>\n)"
+)
+
+
+# ---------------------------------------------------------------------------
+# Scanning
+# ---------------------------------------------------------------------------
+
+@dataclass(frozen=True)
+class ArticleReference:
+    number: int
+    end: Optional[int]          # last number of a range ("arts. 10 al 15")
+    code_hint: Optional[str]    # code named right after the reference
+
+
+@dataclass(frozen=True)
+class LegalTextSignals:
+    """Everything the detectors need, from one pass over a text."""
+    search_topics: tuple[str, ...]
+    document_type: Optional[str]
+    document_topics: tuple[str, ...]
+    code_hint: Optional[str]
+    references: tuple[ArticleReference, ...]
+
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isalnum() or ch == "_"
+
+
+@lru_cache(maxsize=16)
+def scan_legal_text(text: str) -> LegalTextSignals:
+    """
+    Scan ``text`` once and return topics, document type, code hint and
+    article references. Results are cached: the detectors of one request
+    share a single pass.
+    """
+    text = text.lower()
+    n = len(text)
+    matched: dict[str, set[int]] = {name: set() for name in _RULE_SETS}
+    # (rule set, rule index) -> (line, smallest end) of its "A" words so far
+    pending_a: dict[tuple[str, int], tuple[int, int]] = {}
+    references: list[ArticleReference] = []
+    line = 0
+
+    for m in _SCANNER.finditer(text):
+        if m.lastgroup == "nl":
+            line += 1
+            continue
+        start = m.start()
+        if m.group("ref") is not None:
+            end = m.group("end")
+            code = m.group("code")
+            references.append(ArticleReference(
+                int(m.group("num")),
+                int(end) if end else None,
+                REFERENCE_CODE_MAP[code] if code else None,
+            ))
+        longest = m.group("lit") or m.group("lit2")
+        if not longest:
+            continue
+        left_ok = start == 0 or not _is_word_char(text[start - 1])
+        for literal in _PREFIX_LITERALS[longest]:
+            stop = start + len(literal)
+            right_ok = stop == n or not _is_word_char(text[stop])
+            for set_name, index, part, left, right in _LITERAL_RULES[literal]:
+                if (left and not left_ok) or (right and not right_ok):
+                    continue
+                if part is None:
+                    matched[set_name].add(index)
+                elif part == 0:
+                    key = (set_name, index)
+                    seen = pending_a.get(key)
+                    if seen is None or seen[0] != line or stop < seen[1]:
+                        pending_a[key] = (line, stop)
+                else:
+                    seen = pending_a.get((set_name, index))
+                    if seen is not None and seen[0] == line and seen[1] <= start:
+                        matched[set_name].add(index)
+
+    def labels(set_name: str) -> tuple[str, ...]:
+        rules = _RULE_SETS[set_name]
+        return tuple(dict.fromkeys(rules[i][1] for i in sorted(matched[set_name])))
+
+    def first(set_name: str) -> Optional[str]:
+        found = matched[set_name]
+        return _RULE_SETS[set_name][min(found)][1] if found else None
+
+    return LegalTextSignals(
+        search_topics=labels("search_topic"),
+        document_type=first("document_type"),
+        document_topics=labels("document_topic"),
+        code_hint=first("code_hint"),
+        references=tuple(references),
+    )
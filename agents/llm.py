@@ -0,0 +1,190 @@
+"""
+LLM - Chat completion helpers shared by the agents.
+
+Answers are streamed: stream_reply yields text deltas as the model produces
+them, so the first words reach the user after the time-to-first-token
+instead of after the whole 2000–3000 token answer. The turn is recorded in
+the Conversation (agents/conversation.py) only once the stream has completed.
+
+With a response cache slot (agents/response_cache.py) a cached answer is
+replayed without calling the model, and a new complete answer is stored.
+
+The async helpers (astream_chat, astream_reply) serve the Async* agents.
+Each event loop gets one shared AsyncOpenAI client on one pooled HTTP client
+(openai's httpx defaults: up to 1000 connections, 100 kept alive). Hundreds
+of concurrent conversations therefore share one connection pool instead of
+each paying for its own client and TLS handshakes.
+"""
+
+import asyncio
+import os
+import sys
+import weakref
+from dataclasses import replace
+from typing import AsyncIterator, Iterable, Iterator, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from agents.conversation import Conversation, Turn
+
+# event loop -> (HTTP client, {(api key, base URL): AsyncOpenAI}). Connections
+# are bound to the loop that opened them, so clients are never shared across loops
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, tuple]" = weakref.WeakKeyDictionary()
+
+
+def stream_chat(client, messages: list[dict], **params) -> Iterator[str]:
+    """Yield the content deltas of a streamed chat completion."""
+    stream = client.chat.completions.create(messages=messages, stream=True, **params)
+    try:
+        for chunk in stream:
+            if chunk.choices:
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
+    finally:
+        # Abandoned early (e.g. Ctrl+C): release the HTTP connection
+        close = getattr(stream, "close", None)
+        if close:
+            close()
+
+
+def stream_reply(
+    client,
+    conversation: Conversation,
+    user_message: str,
+    turn: Optional[Turn] = None,
+    error_prefix: str = "❌ Error",
+    cache=None,
+    **params,
+) -> Iterator[str]:
+    """
+    Stream the assistant's answer to ``user_message`` after ``conversation``.
+
+    ``turn`` (query and context article ids, without the answer) is what the
+    conversation records; by default the whole ``user_message``. It is
+    recorded only after the stream finishes: a failed or abandoned stream
+    leaves the conversation untouched. Errors are yielded as a final text
+    delta starting with ``error_prefix``.
+
+    ``cache`` is an optional CacheSlot: a hit is yielded as a single delta
+    without calling the model; otherwise the complete answer is stored.
+    """
+    messages = conversation.messages(user_message)
+    answer = cache.get() if cache else None
+    if answer is not None:
+        yield answer
+    else:
+        parts: list[str] = []
+        try:
+            for delta in stream_chat(client, messages, **params):
+                parts.append(delta)
+                yield delta
+        except Exception as e:
+            separator = "\n\n" if parts else ""
+            yield f"{separator}{error_prefix}: {e}"
+            return
+        answer = "".join(parts)
+        if cache:
+            cache.put(answer)
+
+    conversation.record(replace(turn or Turn(user_message), answer=answer))
+
+
+# ---------------------------------------------------------------------------
+# Async
+# ---------------------------------------------------------------------------
+
+def get_async_client(api_key: str, base_url=None):
+    """
+    The running event loop's shared AsyncOpenAI client for ``api_key``.
+    ``base_url`` defaults to OPENAI_BASE_URL (e.g. a local mock server).
+    """
+    from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+    loop = asyncio.get_running_loop()
+    state = _async_clients.get(loop)
+    if state is None:
+        state = _async_clients[loop] = (DefaultAsyncHttpxClient(), {})
+    http_client, clients = state
+    key = (api_key, base_url)
+    if key not in clients:
+        clients[key] = AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http_client)
+    return clients[key]
+
+
+async def astream_chat(client, messages: list[dict], **params) -> AsyncIterator[str]:
+    """Async stream_chat."""
+    stream = await client.chat.completions.create(messages=messages, stream=True, **params)
+    try:
+        async for chunk in stream:
+            if chunk.choices:
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
+    finally:
+        await stream.close()
+
+
+async def astream_reply(
+    client,
+    conversation: Conversation,
+    user_message: str,
+    turn: Optional[Turn] = None,
+    error_prefix: str = "❌ Error",
+    cache=None,
+    **params,
+) -> AsyncIterator[str]:
+    """Async stream_reply (same conversation, error and cache semantics)."""
+    messages = conversation.messages(user_message)
+    # SQLite reads and writes (and their lock) stay off the event loop
+    answer = await asyncio.to_thread(cache.get) if cache else None
+    if answer is not None:
+        yield answer
+    else:
+        parts: list[str] = []
+        try:
+            async for delta in astream_chat(client, messages, **params):
+                parts.append(delta)
+                yield delta
+        except Exception as e:
+            separator = "\n\n" if parts else ""
+            yield f"{separator}{error_prefix}: {e}"
+            return
+        answer = "".join(parts)
+        if cache:
+            await asyncio.to_thread(cache.put, answer)
+
+    conversation.record(replace(turn or Turn(user_message), answer=answer))
+
+
+def print_stream(deltas: Iterable[str], console=None, title: str = "⚖️ LexAI", status: str = "") -> str:
+    """
+    Render a stream of deltas as it arrives and return the full text.
+
+    With a rich ``console`` a spinner shows ``status`` until the first delta,
+    then a Markdown panel is re-rendered as the answer grows. Without one,
+    the deltas are printed as plain text.
+    """
+    if console is None:
+        parts = []
+        for delta in deltas:
+            print(delta, end="", flush=True)
+            parts.append(delta)
+        print()
+        return "".join(parts)
+
+    from rich.live import Live
+    from rich.markdown import Markdown
+    from rich.panel import Panel
+    from rich.spinner import Spinner
+
+    text = ""
+    with Live(
+        Spinner("dots", text=status),
+        console=console,
+        refresh_per_second=12,
+        vertical_overflow="visible",
+    ) as live:
+        for delta in deltas:
+            text += delta
+            live.update(Panel(Markdown(text), title=title, border_style="blue", padding=(1, 2)))
+    return text
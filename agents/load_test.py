@@ -0,0 +1,168 @@
+"""
+Load test for the agent service (`run_agents.py serve`).
+
+Each simulated user holds a two-turn conversation: a first /search that
+opens a session, then a follow-up /search in the same session. Reports
+throughput, latency percentiles, time to first delta (with --stream) and
+how many requests were shed with 429.
+
+By default it starts everything in-process: a local mock LLM
+(agents/mock_openai.py) and an AgentServer pointed at it. So it runs
+offline and measures the service itself, not OpenAI.
+
+Usage:
+    python -m agents.load_test                                  # in-process, defaults
+    python -m agents.load_test --users 500 --concurrency 300 --workers 64 --queue 64
+    python -m agents.load_test --url http://127.0.0.1:8000 --stream   # a running server
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from agents.http11 import HTTPConnection
+
+QUERIES = [
+    "¿Qué dice el artículo 29 del Código de Trabajo?",
+    "despido sin justa causa",
+    "contrato de arrendamiento de vivienda",
+    "prescripción de la acción penal",
+    "herencia y testamento",
+    "sociedad anónima: responsabilidad de los socios",
+]
+FOLLOWUPS = ["¿Y qué plazo aplica?", "¿Qué artículos lo regulan?"]
+
+
+def _percentiles(samples: list[float]) -> str:
+    if not samples:
+        return "-"
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+    return f"p50 {statistics.median(ordered):7.0f}   p95 {pick(0.95):7.0f}   p99 {pick(0.99):7.0f}"
+
+
+async def _run(host: str, port: int, users: int, concurrency: int, stream: bool) -> dict:
+    statuses: Counter = Counter()
+    latency_ms: list[float] = []
+    first_delta_ms: list[float] = []
+    pending = asyncio.Queue()
+    for i in range(users):
+        pending.put_nowait(i)
+
+    async def call(conn: HTTPConnection, payload: dict):
+        start = time.perf_counter()
+        first = []
+
+        def on_chunk(_):
+            if not first:
+                first.append((time.perf_counter() - start) * 1000)
+
+        status, body = await conn.request("POST", "/search", {**payload, "stream": stream}, on_chunk)
+        statuses[status] += 1
+        if status != 200:
+            return None
+        latency_ms.append((time.perf_counter() - start) * 1000)
+        first_delta_ms.extend(first)
+        if stream:
+            last = body.decode().strip().rsplit("data: ", 1)[-1]
+            return json.loads(last).get("session_id")
+        return json.loads(body)["session_id"]
+
+    async def user_loop():
+        conn = HTTPConnection(host, port)
+        try:
+            while not pending.empty():
+                i = pending.get_nowait()
+                try:
+                    session_id = await call(conn, {"query": QUERIES[i % len(QUERIES)]})
+                    if session_id:
+                        await call(conn, {"query": FOLLOWUPS[i % len(FOLLOWUPS)], "session_id": session_id})
+                except (OSError, asyncio.IncompleteReadError) as e:
+                    statuses[type(e).__name__] += 1
+        finally:
+            await conn.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user_loop() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    metrics_conn = HTTPConnection(host, port)
+    _, metrics = await metrics_conn.request("GET", "/metrics")
+    await metrics_conn.close()
+    return {
+        "elapsed": elapsed,
+        "statuses": statuses,
+        "latency_ms": latency_ms,
+        "first_delta_ms": first_delta_ms,
+        "server": json.loads(metrics),
+    }
+
+
+def run_load_test(
+    url: str = "",
+    users: int = 200,
+    concurrency: int = 100,
+    stream: bool = False,
+    workers: int = 64,
+    queue: int = 256,
+    ttft: float = 0.3,
+    token_delay: float = 0.01,
+) -> dict:
+    """Run the load test and print a report. Returns the raw results."""
+    mock = server = None
+    if not url:
+        from agents.mock_openai import MockOpenAIServer
+        from agents.server import AgentServer
+
+        mock = MockOpenAIServer(ttft=ttft, token_delay=token_delay, tokens=50).start()
+        os.environ["OPENAI_BASE_URL"] = mock.base_url
+        server = AgentServer(port=0, workers=workers, queue=queue, api_key="sk-mock").start()
+        url = f"http://127.0.0.1:{server.port}"
+        print(f"🧪 In-process service (workers {workers}, queue {queue}) on a mock LLM"
+              f" (TTFT {ttft * 1000:.0f} ms, 50 deltas every {token_delay * 1000:.0f} ms)")
+    try:
+        target = urlsplit(url)
+        results = asyncio.run(_run(target.hostname, target.port or 80, users, concurrency, stream))
+    finally:
+        if server:
+            server.stop()
+        if mock:
+            mock.stop()
+
+    done = results["statuses"].get(200, 0)
+    print(f"📈 {users} users x 2 requests, {concurrency} concurrent, {'streamed' if stream else 'JSON'} answers")
+    print(f"   wall {results['elapsed']:.2f} s   {done / results['elapsed']:.1f} answers/s")
+    print(f"   statuses: {dict(results['statuses'])}")
+    print(f"   latency (ms)         {_percentiles(results['latency_ms'])}")
+    if stream:
+        print(f"   first delta (ms)     {_percentiles(results['first_delta_ms'])}")
+    print(f"   server /metrics: {json.dumps(results['server']['latency_ms'])}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test for `run_agents.py serve`")
+    parser.add_argument("--url", default="", help="running server (default: in-process server + mock LLM)")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--workers", type=int, default=64, help="in-process server only")
+    parser.add_argument("--queue", type=int, default=256, help="in-process server only")
+    parser.add_argument("--ttft", type=float, default=0.3, help="mock LLM time to first token (s)")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="mock LLM delay between deltas (s)")
+    args = parser.parse_args()
+    run_load_test(
+        args.url, args.users, args.concurrency, args.stream,
+        args.workers, args.queue, args.ttft, args.token_delay,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+"""
+Mock OpenAI - A local stand-in for the OpenAI API, for tests and load tests.
+
+Serves the two endpoints the agents and the ingestion scripts use:
+    POST /v1/chat/completions   JSON or streamed (SSE) answers
+    POST /v1/embeddings         deterministic vectors (float or base64)
+
+Latency is configurable (``ttft`` before the first byte, ``token_delay``
+between streamed deltas), so concurrency can be exercised without network
+access or API cost. ``fail_every`` makes every N-th request fail with
+``fail_status`` (default 429) to exercise retries; ``max_input_chars``
+rejects embedding requests with a longer input (400), like the model's
+context limit.
+
+Usage:
+    python -m agents.mock_openai --port 8089 --ttft 0.3 --token-delay 0.02
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=sk-mock python run_agents.py search
+
+In-process (runs in a background thread with its own event loop):
+    with MockOpenAIServer(ttft=0.2) as server:
+        client = AsyncOpenAI(base_url=server.base_url, api_key="sk-mock")
+"""
+
+import argparse
+import asyncio
+import base64
+import os
+import random
+import sys
+import threading
+import time
+import zlib
+from array import array
+from typing import Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from agents.http11 import (
+    HTTPError, Request, end_chunked, read_request, send_chunk, send_json, sse_event, start_chunked,
+)
+
+ANSWER_WORDS = (
+    "**Respuesta simulada.** Según el artículo citado en el contexto, la consulta "
+    "se resuelve conforme a la normativa vigente de Costa Rica. Se recomienda "
+    "verificar en SCIJ o consultar con un abogado colegiado."
+).split()
+
+
+class MockOpenAIServer:
+    """OpenAI-compatible HTTP/1.1 server on 127.0.0.1 (keep-alive, chunked streaming)."""
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        ttft: float = 0.05,
+        token_delay: float = 0.0,
+        tokens: int = 40,
+        embedding_dim: int = 1536,
+        fail_every: int = 0,
+        fail_status: int = 429,
+        max_input_chars: int = 0,
+    ):
+        self.host = host
+        self.port = port
+        self.ttft = ttft
+        self.token_delay = token_delay
+        self.tokens = tokens
+        self.embedding_dim = embedding_dim
+        self.fail_every = fail_every
+        self.fail_status = fail_status
+        self.max_input_chars = max_input_chars
+        # Counters, for assertions and load-test reports
+        self.requests = 0
+        self.active = 0
+        self.max_active = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._thread: Optional[threading.Thread] = None
+        # Connection handler task -> its writer
+        self._handlers: dict[asyncio.Task, asyncio.StreamWriter] = {}
+        self._tables: dict[int, array] = {}
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------
+
+    def start(self) -> "MockOpenAIServer":
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="mock-openai", daemon=True)
+        self._thread.start()
+        self._server = asyncio.run_coroutine_threadsafe(
+            asyncio.start_server(self._handle, self.host, self.port), self._loop
+        ).result()
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    def stop(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._close(), self._loop).result(timeout=5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+        self._loop = None
+
+    def __enter__(self) -> "MockOpenAIServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # ------------------------------------------------------------------
+    # HTTP
+    # ------------------------------------------------------------------
+
+    async def _close(self):
+        """Stop listening and end open (keep-alive) connections while the loop still runs."""
+        self._server.close()
+        for writer in self._handlers.values():
+            writer.close()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+        await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._handlers[task] = writer
+        try:
+            while True:
+                try:
+                    request = await read_request(reader, max_body=64 << 20)
+                except HTTPError as e:
+                    await send_json(writer, e.status, {"error": {"message": e.message}})
+                    return
+                if request is None:
+                    return
+                await self._respond(request, writer)
+                if not request.keep_alive:
+                    return
+        except ConnectionError:
+            pass
+        finally:
+            self._handlers.pop(task, None)
+            writer.close()
+
+    async def _respond(self, request: Request, writer: asyncio.StreamWriter):
+        self.requests += 1
+        number = self.requests
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.ttft)
+            if self.fail_every and number % self.fail_every == 0:
+                await send_json(writer, self.fail_status, {
+                    "error": {"message": "mock failure", "type": "mock_error", "code": self.fail_status}
+                }, {"retry-after": "0"})
+                return
+            try:
+                payload = request.json()
+            except HTTPError as e:
+                await send_json(writer, e.status, {"error": {"message": e.message}})
+                return
+            if request.method == "POST" and request.path.endswith("/chat/completions"):
+                if payload.get("stream"):
+                    await self._stream_completion(writer, payload)
+                else:
+                    await send_json(writer, 200, self._completion(payload))
+            elif request.method == "POST" and request.path.endswith("/embeddings"):
+                inputs = payload.get("input", [])
+                inputs = [inputs] if isinstance(inputs, str) else inputs
+                if self.max_input_chars and any(len(str(text)) > self.max_input_chars for text in inputs):
+                    # What the API answers for an input over the model's context length
+                    await send_json(writer, 400, {"error": {
+                        "message": "input exceeds the maximum context length", "type": "invalid_request_error",
+                    }})
+                else:
+                    await send_json(writer, 200, self._embeddings(payload))
+            else:
+                await send_json(writer, 404, {"error": {"message": f"unknown endpoint {request.path}"}})
+        finally:
+            self.active -= 1
+
+    # ------------------------------------------------------------------
+    # Endpoints
+    # ------------------------------------------------------------------
+
+    def _answer(self) -> list[str]:
+        words = [ANSWER_WORDS[i % len(ANSWER_WORDS)] for i in range(max(1, self.tokens))]
+        return [words[0]] + [f" {word}" for word in words[1:]]
+
+    def _usage(self, payload: dict, completion_tokens: int) -> dict:
+        prompt_chars = sum(len(str(m.get("content", ""))) for m in payload.get("messages", []))
+        prompt_tokens = prompt_chars // 4
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+
+    def _completion(self, payload: dict) -> dict:
+        deltas = self._answer()
+        return {
+            "id": f"chatcmpl-mock-{self.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "mock"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(deltas)},
+                "finish_reason": "stop",
+            }],
+            "usage": self._usage(payload, len(deltas)),
+        }
+
+    async def _stream_completion(self, writer, payload: dict):
+        await start_chunked(writer, "text/event-stream")
+        chunk_id = f"chatcmpl-mock-{self.requests}"
+        model = payload.get("model", "mock")
+
+        def chunk(delta: dict, finish_reason: Optional[str] = None) -> bytes:
+            return sse_event({
+                "id": chunk_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            })
+
+        deltas = self._answer()
+        for i, text in enumerate(deltas):
+            await send_chunk(writer, chunk({"content": text, **({"role": "assistant"} if i == 0 else {})}))
+            if self.token_delay:
+                await asyncio.sleep(self.token_delay)
+        await send_chunk(writer, chunk({}, "stop"))
+        await send_chunk(writer, sse_event("[DONE]"))
+        await end_chunked(writer)
+
+    def _gaussian_table(self, dim: int) -> array:
+        """2 * ``dim`` standard normal floats, generated once per dimension."""
+        table = self._tables.get(dim)
+        if table is None:
+            rng = random.Random(dim)
+            table = self._tables[dim] = array("f", (rng.gauss(0.0, 1.0) for _ in range(2 * dim)))
+        return table
+
+    def _embeddings(self, payload: dict) -> dict:
+        inputs = payload.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        dim = payload.get("dimensions") or self.embedding_dim
+        as_base64 = payload.get("encoding_format") == "base64"
+        data = []
+        table = self._gaussian_table(dim)
+        for index, text in enumerate(inputs):
+            # Deterministic per input text: a window of a fixed random table
+            offset = zlib.crc32(str(text).encode("utf-8")) % dim
+            vector = table[offset:offset + dim]
+            embedding = base64.b64encode(vector.tobytes()).decode() if as_base64 else vector.tolist()
+            data.append({"object": "embedding", "index": index, "embedding": embedding})
+        tokens = sum(len(str(text)) // 4 for text in inputs)
+        return {
+            "object": "list",
+            "data": data,
+            "model": payload.get("model", "mock"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local mock of the OpenAI API")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--ttft", type=float, default=0.05, help="seconds before the first byte")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="seconds between streamed deltas")
+    parser.add_argument("--tokens", type=int, default=40, help="deltas per answer")
+    parser.add_argument("--fail-every", type=int, default=0, help="fail every N-th request (0 = never)")
+    args = parser.parse_args()
+
+    server = MockOpenAIServer(
+        port=args.port, ttft=args.ttft, token_delay=args.token_delay,
+        tokens=args.tokens, fail_every=args.fail_every,
+    ).start()
+    print(f"🧪 Mock OpenAI API on {server.base_url}  (Ctrl+C to stop)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -19,18 +19,26 @@ Usage:
     python -m agents.repository_search_agent
 """
 
+import asyncio
 import json
 import os
-import re
 import sys
-from typing import Optional
+from typing import AsyncIterator, Iterator, Optional
 
 from openai import OpenAI
 from dotenv import load_dotenv
 
 # Add parent directory to path for imports
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from agents.legal_knowledge_base import get_knowledge_base, Article
+from agents.kb_holder import get_kb_holder
+from agents.legal_knowledge_base import Article, LegalKnowledgeBase
+from agents.context_packer import PackedArticle, pack_articles, query_terms
+from agents.conversation import Conversation, Turn
+from agents.legal_matcher import scan_legal_text
+from agents.llm import astream_reply, get_async_client, print_stream, stream_reply
+from agents.response_cache import CacheSlot, ResponseCache, get_response_cache
+from agents.embeddings import semantic_retrieval_enabled
+from agents.retrieval import ArticleCollector, hybrid_search, resolve_references
 
 # Load environment variables
 load_dotenv()
@@ -40,8 +48,13 @@ load_dotenv()
 # ---------------------------------------------------------------------------
 
 MODEL = "gpt-4o-mini"
-MAX_CONTEXT_ARTICLES = 15  # Max articles to include in context
+# Max articles to include in context; semantic recall (LEXAI_EMBEDDING_PROVIDER=openai)
+# puts the relevant ones higher, so fewer are needed
+MAX_CONTEXT_ARTICLES = 10 if semantic_retrieval_enabled() else 15
+CONTEXT_TOKEN_BUDGET = 6000  # Tokens of article text in the prompt
+MAX_ARTICLE_TOKENS = 1200  # Longer ranked results are trimmed to relevant passages
 MAX_TOKENS_RESPONSE = 2000
+TEMPERATURE = 0.1  # Low temperature for accuracy
 
 # System prompt for the search agent
 SYSTEM_PROMPT = """Eres un ABOGADO EXPERTO especializado EXCLUSIVAMENTE en el sistema jurídico de Costa Rica.
@@ -101,55 +114,21 @@ def extract_article_references(query: str) -> list[dict]:
     - "artículos 10 al 15"
     - "art 200"
     
-    Returns list of {"number": int, "code_hint": str|None}
+    Returns list of {"number": int, "code_hint": str|None}. Ranges are
+    returned as one reference with an extra "end": int; how many of their
+    articles are used is bounded by the context budget, not here.
     """
-    results = []
-    query_lower = query.lower()
-    
-    # Pattern 1: "artículo(s) X" or "art. X" or "art X"
-    pattern_single = re.compile(
-        r'(?:art[ií]culos?|arts?\.?)\s*(\d+)',
-        re.IGNORECASE
-    )
-    for match in pattern_single.finditer(query):
-        num = int(match.group(1))
-        results.append({"number": num, "code_hint": None})
-    
-    # Pattern 2: "artículos X al Y" (range)
-    pattern_range = re.compile(
-        r'(?:art[ií]culos?|arts?\.?)\s*(\d+)\s*(?:al|a|hasta)\s*(\d+)',
-        re.IGNORECASE
-    )
-    for match in pattern_range.finditer(query):
-        start = int(match.group(1))
-        end = int(match.group(2))
-        # Limit range to prevent huge queries
-        if end - start <= 20:
-            for n in range(start, end + 1):
-                if not any(r["number"] == n for r in results):
-                    results.append({"number": n, "code_hint": None})
-    
-    # Detect code hints
-    code_hints = {
-        "civil": "codigo-civil",
-        "comercio": "codigo-comercio",
-        "penal": "codigo-penal",
-        "procesal penal": "codigo-procesal-penal",
-        "procesal": "codigo-procesal-penal",
-        "trabajo": "codigo-trabajo",
-        "laboral": "codigo-trabajo",
-    }
-    
-    detected_code = None
-    for keyword, code_id in code_hints.items():
-        if keyword in query_lower:
-            detected_code = code_id
-            break
+    signals = scan_legal_text(query)
+    # A reversed range ("15 al 10") is kept as its first article alone
+    ranges = [ref for ref in signals.references if ref.end is not None and ref.end >= ref.number]
+    range_starts = {ref.number for ref in ranges}
     
-    # Apply detected code hint to all results
-    if detected_code:
-        for r in results:
-            r["code_hint"] = detected_code
+    results = []
+    for ref in signals.references:
+        if ref not in ranges and ref.number not in range_starts:
+            results.append({"number": ref.number, "code_hint": signals.code_hint})
+    for ref in ranges:
+        results.append({"number": ref.number, "end": ref.end, "code_hint": signals.code_hint})
     
     return results
 
@@ -157,64 +136,9 @@ def extract_article_references(query: str) -> list[dict]:
 def detect_search_topics(query: str) -> list[str]:
     """
     Detect legal topics in the query for keyword-based search.
-    Returns a list of search terms to use.
+    Returns a list of search terms to use (see SEARCH_TOPIC_RULES).
     """
-    # Common legal topic patterns
-    topic_patterns = [
-        (r'\bcontrat', 'contrato'),
-        (r'\bdespi', 'despido'),
-        (r'\bvacacion', 'vacaciones'),
-        (r'\b(?:aguinaldo|décimo.?tercer)\b', 'aguinaldo'),
-        (r'\b(?:salario|sueldo|remunerac)', 'salario'),
-        (r'\b(?:matrimonio|casar)', 'matrimonio'),
-        (r'\bdivorci', 'divorcio'),
-        (r'\b(?:herencia|hered)', 'herencia'),
-        (r'\b(?:propiedad|inmueble|terreno|finca)\b', 'propiedad'),
-        (r'\b(?:arrendamiento|alquiler|inquilin)', 'arrendamiento'),
-        (r'\b(?:sociedad|empresa|compañía)\b', 'sociedad'),
-        (r'\b(?:prescripci|prescrib)', 'prescripción'),
-        (r'\b(?:obligaci|deuda)', 'obligación'),
-        (r'\b(?:delito|crimen|criminal)\b', 'delito'),
-        (r'\b(?:homicidio|asesinat|matar)\b', 'homicidio'),
-        (r'\b(?:robo|hurto|robar)\b', 'robo'),
-        (r'\b(?:estafa|fraude|engaño)\b', 'estafa'),
-        (r'\b(?:daños|perjuicios|indemnizaci)', 'daños'),
-        (r'\b(?:embargo|embargar)\b', 'embargo'),
-        (r'\b(?:alimento|pensión.?alimentaria|manutenci)', 'alimentos'),
-        (r'\b(?:jornada|horas.?extra|horario)\b', 'jornada laboral'),
-        (r'\bpreaviso\b', 'preaviso'),
-        (r'\bcesant[ií]a\b', 'cesantía'),
-        (r'\b(?:garantía|fianza)\b', 'garantía'),
-        (r'\bhipoteca', 'hipoteca'),
-        (r'\b(?:testamento|sucesi)', 'testamento'),
-        (r'\busufruct', 'usufructo'),
-        (r'\bservidumbre', 'servidumbre'),
-        (r'\b(?:posesi[oó]n|poseedor)\b', 'posesión'),
-        (r'\b(?:compraventa|compra|venta)\b', 'compraventa'),
-        (r'\b(?:donaci[oó]n|donar)\b', 'donación'),
-        (r'\b(?:poder|mandato|poderdante)\b', 'mandato'),
-        (r'\bresponsabilidad\b', 'responsabilidad'),
-        (r'\b(?:capacidad|incapacidad|menor)\b', 'capacidad'),
-        (r'\b(?:persona.?jur[ií]dica|asociaci)', 'persona jurídica'),
-        (r'\b(?:comerciant|actividad.?comercial)\b', 'comerciante'),
-        (r'\b(?:quiebra|insolvencia)\b', 'quiebra'),
-        (r'\b(?:t[ií]tulo.?valor|letra.?de.?cambio|pagar[eé]|cheque)\b', 'títulos valores'),
-        (r'\b(?:trabajador|patrono|empleador|emplead)', 'relación laboral'),
-        (r'\b(?:sindicato|huelga)\b', 'sindicato'),
-        (r'\b(?:seguridad.?social|ccss)\b', 'seguridad social'),
-        (r'\bjusta.?causa\b', 'despido'),
-        (r'\b(?:derecho|derechos)\b.*\b(?:laboral|trabajador)', 'relación laboral'),
-    ]
-    
-    query_lower = query.lower()
-    topics = []
-    seen = set()
-    for pattern, topic in topic_patterns:
-        if topic not in seen and re.search(pattern, query_lower, re.IGNORECASE):
-            topics.append(topic)
-            seen.add(topic)
-    
-    return topics
+    return list(scan_legal_text(query).search_topics)
 
 
 # ---------------------------------------------------------------------------
@@ -234,12 +158,14 @@ class RepositorySearchAgent:
     5. Returns grounded, accurate legal analysis
     """
 
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(self, api_key: Optional[str] = None, response_cache: Optional[ResponseCache] = None):
         """
         Initialize the agent.
         
         Args:
             api_key: OpenAI API key. If None, reads from OPENAI_API_KEY env var.
+            response_cache: Cache of complete answers. If None, uses the one
+                configured by LEXAI_RESPONSE_CACHE (off when unset).
         """
         self.api_key = api_key or os.environ.get("OPENAI_API_KEY")
         if not self.api_key:
@@ -247,15 +173,25 @@ class RepositorySearchAgent:
                 "❌ OPENAI_API_KEY not set. Please set it in your .env file or pass it directly."
             )
         
-        self.client = OpenAI(api_key=self.api_key)
-        self.kb = get_knowledge_base()
-        self.conversation_history: list[dict] = []
-        
-        # Initialize with system prompt
-        self.conversation_history.append({
-            "role": "system",
-            "content": SYSTEM_PROMPT,
-        })
+        self.client = self._create_client()
+        self.response_cache = response_cache or get_response_cache()
+        self._kb_holder = get_kb_holder()
+        self._kb_holder.get()  # load (or reuse) the shared knowledge base now
+        # Compact history: queries, answers and context article ids
+        self.conversation = Conversation(SYSTEM_PROMPT)
+
+    def _create_client(self):
+        return OpenAI(api_key=self.api_key)
+
+    @property
+    def kb(self) -> LegalKnowledgeBase:
+        """Current knowledge base (changes after a hot reload)."""
+        return self._kb_holder.get()
+
+    @property
+    def conversation_history(self) -> list[dict]:
+        """The history sent with the next request, as chat messages."""
+        return self.conversation.history
 
     def search_and_respond(self, user_query: str) -> str:
         """
@@ -269,6 +205,58 @@ class RepositorySearchAgent:
         Returns:
             The agent's response with citations and analysis.
         """
+        return "".join(self.search_and_respond_stream(user_query))
+
+    def search_and_respond_stream(self, user_query: str) -> Iterator[str]:
+        """
+        Streaming variant of search_and_respond: yields the response in
+        text deltas as the model generates it. The conversation history is
+        updated once the stream completes.
+        """
+        user_message, articles, fingerprint = self._build_user_message(user_query)
+        yield from stream_reply(
+            self.client,
+            self.conversation,
+            user_message,
+            turn=self._turn(user_query, articles, fingerprint),
+            error_prefix="❌ Error al consultar GPT-4o-mini",
+            cache=self._cache_slot(user_query, articles, fingerprint),
+            model=MODEL,
+            max_tokens=MAX_TOKENS_RESPONSE,
+            temperature=TEMPERATURE,
+        )
+
+    def _turn(self, user_query: str, articles: list[Article], fingerprint: str) -> Turn:
+        """
+        How the exchange is remembered: the query and its context article ids,
+        under the fingerprint of the knowledge base they were retrieved from.
+        """
+        return Turn(user_query, article_ids=tuple(art.article_id for art in articles), fingerprint=fingerprint)
+
+    def _cache_slot(self, user_query: str, articles: list[Article], fingerprint: str) -> Optional[CacheSlot]:
+        """Where the answer to ``user_query`` is cached (None without a response cache)."""
+        if self.response_cache is None:
+            return None
+        return self.response_cache.slot(
+            fingerprint,
+            user_query,
+            [art.article_id for art in articles],
+            MODEL,
+            self.conversation.history,
+            max_tokens=MAX_TOKENS_RESPONSE,
+            temperature=TEMPERATURE,
+        )
+
+    def _build_user_message(self, user_query: str) -> tuple[str, list[Article], str]:
+        """
+        Search the knowledge base and build the prompt for ``user_query``.
+        Returns the prompt, the articles in its context and the fingerprint
+        of the knowledge base snapshot they came from (a hot reload may swap
+        ``self.kb`` meanwhile).
+        """
+        # One knowledge base snapshot for the whole request
+        kb = self.kb
+        
         # Step 1: Extract article references
         article_refs = extract_article_references(user_query)
         
@@ -276,49 +264,70 @@ class RepositorySearchAgent:
         topics = detect_search_topics(user_query)
         
         # Step 3: Search the knowledge base
-        found_articles: list[Article] = []
+        found_articles = ArticleCollector(MAX_CONTEXT_ARTICLES)
         search_log: list[str] = []
         
-        # 3a: Exact article searches
-        for ref in article_refs:
+        # 3a: Exact article searches (one batched lookup)
+        resolved = resolve_references(kb, article_refs, range_limit=MAX_CONTEXT_ARTICLES)
+        for ref, arts in zip(article_refs, resolved):
             code_hint = ref.get("code_hint")
             num = ref["number"]
+            label = f"Arts. {num}-{ref['end']}" if "end" in ref else f"Art. {num}"
             
             if code_hint:
-                arts = self.kb.find_article(code_hint, num)
                 if arts:
                     found_articles.extend(arts)
-                    search_log.append(f"✅ Encontrado: Art. {num} en {code_hint}")
+                    search_log.append(f"✅ Encontrado: {label} en {code_hint}")
                 else:
-                    search_log.append(f"❌ No encontrado: Art. {num} en {code_hint}")
+                    search_log.append(f"❌ No encontrado: {label} en {code_hint}")
             else:
-                arts = self.kb.find_article_any_code(num)
                 if arts:
                     found_articles.extend(arts)
-                    search_log.append(f"✅ Encontrado: Art. {num} en {', '.join(set(a.code_id for a in arts))}")
+                    search_log.append(f"✅ Encontrado: {label} en {', '.join(dict.fromkeys(a.code_id for a in arts))}")
                 else:
-                    search_log.append(f"❌ No encontrado: Art. {num} en ningún código")
+                    search_log.append(f"❌ No encontrado: {label} en ningún código")
+        pinned = len(found_articles)
         
-        # 3b: Topic/keyword searches
-        if topics and len(found_articles) < MAX_CONTEXT_ARTICLES:
-            for topic in topics:
-                remaining = MAX_CONTEXT_ARTICLES - len(found_articles)
-                if remaining <= 0:
-                    break
-                keyword_results = self.kb.search_by_topic(topic, max_results=min(5, remaining))
-                for art in keyword_results:
-                    if art not in found_articles:
-                        found_articles.append(art)
-                search_log.append(f"🔍 Búsqueda por tema '{topic}': {len(keyword_results)} resultados")
+        # 3b: Hybrid retrieval (lexical + semantic, fused with RRF) fills
+        # the slots left after the pinned exact hits
+        if found_articles.remaining and (topics or not article_refs):
+            remaining = found_articles.remaining
+            hybrid = hybrid_search(kb, user_query, topics, max_results=remaining + len(found_articles))
+            found_articles.extend([art for art in hybrid.articles if art not in found_articles][:remaining])
+            if topics:
+                search_log.append(f"🔍 Temas detectados: {', '.join(topics)}")
+            search_log.append(
+                f"🔍 Búsqueda híbrida: {hybrid.lexical} léxicos + {hybrid.semantic} semánticos"
+                f" → {len(hybrid.articles)} artículos ({hybrid.elapsed_ms:.0f} ms)"
+            )
+            if hybrid.timed_out:
+                search_log.append(f"⏱️ Sin resultados a tiempo de: {', '.join(hybrid.timed_out)}")
         
-        # 3c: If no specific articles found, do a general keyword search
-        if not found_articles and not article_refs:
-            keyword_results = self.kb.search_by_keywords(user_query, max_results=MAX_CONTEXT_ARTICLES)
-            found_articles.extend(keyword_results)
-            search_log.append(f"🔍 Búsqueda general: {len(keyword_results)} resultados")
+        if found_articles.dropped:
+            search_log.append(
+                f"⚠️ {found_articles.dropped} artículos omitidos (límite de {MAX_CONTEXT_ARTICLES} en contexto)"
+            )
         
-        # Step 4: Build context with actual article text
-        context = self._build_context(found_articles, search_log)
+        # 3c: Articles earlier answers relied on. Past turns are kept without
+        # their context, so these are sent once, here
+        earlier = [
+            art for art in kb.find_articles_by_id(self.conversation.article_ids(kb.fingerprint))
+            if art not in found_articles
+        ][:MAX_CONTEXT_ARTICLES]
+        if earlier:
+            search_log.append(f"🗂️ {len(earlier)} artículos de consultas anteriores")
+        
+        # Step 4: Build context with actual article text, within the token
+        # budget (exact hits first, long articles trimmed to relevant passages)
+        packed = pack_articles(
+            found_articles.articles + earlier,
+            CONTEXT_TOKEN_BUDGET,
+            query_terms(user_query, *topics),
+            pinned=pinned,
+            max_article_tokens=MAX_ARTICLE_TOKENS,
+        )
+        search_log.append(packed.summary())
+        context = self._build_context(packed.articles, search_log)
         
         # Step 5: Send to GPT-4o-mini with context
         user_message = f"""CONTEXTO DE BÚSQUEDA LEGAL:
@@ -333,36 +342,9 @@ INSTRUCCIONES:
 - Si no hay artículos relevantes en el contexto, indícalo claramente
 - Analiza y explica cómo aplican al caso del usuario
 - Incluye recomendaciones prácticas"""
+        return user_message, [p.article for p in packed.articles], kb.fingerprint
 
-        self.conversation_history.append({"role": "user", "content": user_message})
-        
-        try:
-            response = self.client.chat.completions.create(
-                model=MODEL,
-                messages=self.conversation_history,
-                max_tokens=MAX_TOKENS_RESPONSE,
-                temperature=0.1,  # Low temperature for accuracy
-            )
-            
-            assistant_message = response.choices[0].message.content
-            self.conversation_history.append({
-                "role": "assistant",
-                "content": assistant_message,
-            })
-            
-            # Keep conversation history manageable (last 20 messages + system)
-            if len(self.conversation_history) > 21:
-                self.conversation_history = (
-                    [self.conversation_history[0]]  # system prompt
-                    + self.conversation_history[-20:]  # last 20 messages
-                )
-            
-            return assistant_message
-            
-        except Exception as e:
-            return f"❌ Error al consultar GPT-4o-mini: {str(e)}"
-
-    def _build_context(self, articles: list[Article], search_log: list[str]) -> str:
+    def _build_context(self, articles: list[PackedArticle], search_log: list[str]) -> str:
         """Build the context string with found articles."""
         parts = []
         
@@ -381,11 +363,11 @@ INSTRUCCIONES:
         parts.append(f"📚 ARTÍCULOS ENCONTRADOS ({len(articles)}):")
         parts.append("=" * 60)
         
-        for i, art in enumerate(articles, 1):
+        for i, packed in enumerate(articles, 1):
             parts.append(f"\n--- Artículo {i}/{len(articles)} ---")
-            parts.append(f"📌 {art.citation()}")
-            parts.append(f"📝 Texto completo:")
-            parts.append(f'"{art.content}"')
+            parts.append(f"📌 {packed.article.citation()}")
+            parts.append(f"📝 Extracto:" if packed.trimmed else f"📝 Texto completo:")
+            parts.append(f'"{packed.text}"')
             parts.append("")
         
         parts.append("=" * 60)
@@ -401,7 +383,43 @@ INSTRUCCIONES:
 
     def reset_conversation(self):
         """Reset conversation history (keep system prompt)."""
-        self.conversation_history = [self.conversation_history[0]]
+        self.conversation.reset()
+
+
+class AsyncRepositorySearchAgent(RepositorySearchAgent):
+    """
+    Async counterpart of RepositorySearchAgent, for servers hosting many
+    concurrent conversations in one event loop.
+
+    Retrieval and prompts are the same. The knowledge base work runs in a
+    worker thread so it never blocks the event loop, and the model is called
+    through AsyncOpenAI over the loop's shared connection pool.
+    """
+
+    def _create_client(self):
+        # None: use the running event loop's shared client (get_async_client).
+        # Assign ``client`` to inject another one.
+        return None
+
+    async def search_and_respond(self, user_query: str) -> str:
+        """Async search_and_respond: returns the complete response."""
+        return "".join([delta async for delta in self.search_and_respond_stream(user_query)])
+
+    async def search_and_respond_stream(self, user_query: str) -> AsyncIterator[str]:
+        """Async search_and_respond_stream: yields text deltas."""
+        user_message, articles, fingerprint = await asyncio.to_thread(self._build_user_message, user_query)
+        async for delta in astream_reply(
+            self.client or get_async_client(self.api_key),
+            self.conversation,
+            user_message,
+            turn=self._turn(user_query, articles, fingerprint),
+            error_prefix="❌ Error al consultar GPT-4o-mini",
+            cache=self._cache_slot(user_query, articles, fingerprint),
+            model=MODEL,
+            max_tokens=MAX_TOKENS_RESPONSE,
+            temperature=TEMPERATURE,
+        ):
+            yield delta
 
 
 # ---------------------------------------------------------------------------
@@ -412,7 +430,6 @@ def main():
     """Run the agent in interactive chat mode."""
     try:
         from rich.console import Console
-        from rich.markdown import Markdown
         from rich.panel import Panel
         from rich.text import Text
         USE_RICH = True
@@ -447,6 +464,9 @@ def main():
         print("Configure OPENAI_API_KEY en su archivo .env")
         sys.exit(1)
 
+    # Pick up re-runs of process_docs.py without restarting the session
+    get_kb_holder().start_watching()
+
     if USE_RICH:
         console.print(f"\n[dim]{agent.get_available_codes()}[/dim]\n")
     else:
@@ -494,22 +514,21 @@ def main():
                 print("🔄 Conversación reiniciada.\n")
                 continue
             
-            # Process query
+            # Process query (the answer is rendered as it streams in)
             if USE_RICH:
-                with console.status("[bold cyan]Buscando en la base legal...[/bold cyan]"):
-                    response = agent.search_and_respond(user_input)
                 console.print()
-                console.print(Panel(
-                    Markdown(response),
+                print_stream(
+                    agent.search_and_respond_stream(user_input),
+                    console,
                     title="⚖️ LexAI",
-                    border_style="blue",
-                    padding=(1, 2),
-                ))
+                    status="[bold cyan]Buscando en la base legal...[/bold cyan]",
+                )
                 console.print()
             else:
                 print("\n🔍 Buscando...")
-                response = agent.search_and_respond(user_input)
-                print(f"\n⚖️ LexAI:\n{response}\n")
+                print("\n⚖️ LexAI:")
+                print_stream(agent.search_and_respond_stream(user_input))
+                print()
                 
         except KeyboardInterrupt:
             print("\n\n👋 ¡Hasta luego!")
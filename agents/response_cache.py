@@ -0,0 +1,239 @@
+"""
+Response Cache - Opt-in cache of complete LLM answers.
+
+The same legal questions recur constantly, and each one pays a full model
+round-trip even though the retrieved articles and the prompt are identical.
+An answer is cached under a hash of:
+
+- the normalized query (accents, case and punctuation folded),
+- the ids of the articles in its context,
+- the model and the generation parameters,
+- the conversation history sent along with it.
+
+Search-log details that vary between identical requests (timings) are
+deliberately not part of the key.
+
+Entries expire after ``ttl`` seconds. Every entry records the fingerprint of
+the knowledge base it was answered from. When the knowledge base changes
+(hot reload, new snapshot), the entries of older versions are dropped.
+
+The cache is an in-memory LRU, optionally backed by a SQLite file so answers
+survive restarts and are shared by processes on one host.
+
+Usage:
+    cache = ResponseCache(path="data/response_cache.sqlite3")
+    agent = RepositorySearchAgent(response_cache=cache)
+
+    LEXAI_RESPONSE_CACHE=memory      # every agent shares an in-memory cache
+    LEXAI_RESPONSE_CACHE=<path>      # ... backed by this SQLite file
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from agents.text_normalization import fold_query
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_TTL_S = 24 * 3600
+
+# "memory" (or 1/true/yes) for an in-memory cache, any other value is a SQLite path
+CACHE_SETTING = os.environ.get("LEXAI_RESPONSE_CACHE", "")
+
+
+def normalize_query(query: str) -> str:
+    """Fold accents, case, punctuation and whitespace ("¿Cuánto es…?" == "cuanto es")."""
+    return " ".join(fold_query(query).split())
+
+
+class CacheSlot:
+    """One request's place in a ResponseCache: ``get()`` a stored answer, or ``put()`` the new one."""
+
+    __slots__ = ("cache", "key", "fingerprint")
+
+    def __init__(self, cache: "ResponseCache", key: str, fingerprint: str):
+        self.cache = cache
+        self.key = key
+        self.fingerprint = fingerprint
+
+    def get(self) -> Optional[str]:
+        return self.cache.get(self.key, self.fingerprint)
+
+    def put(self, answer: str):
+        self.cache.put(self.key, self.fingerprint, answer)
+
+
+class ResponseCache:
+    """
+    Thread-safe LRU of answers with TTL and knowledge base invalidation,
+    optionally persisted to SQLite (``path``).
+    """
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        ttl: float = DEFAULT_TTL_S,
+        path: Optional[str] = None,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        # key -> (fingerprint, created, answer)
+        self._entries: "OrderedDict[str, tuple[str, float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._fingerprint: Optional[str] = None
+        self.hits = 0
+        self.misses = 0
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, fingerprint TEXT NOT NULL,"
+                " created REAL NOT NULL, answer TEXT NOT NULL)"
+            )
+
+    @staticmethod
+    def make_key(
+        query: str,
+        article_ids: Iterable[str],
+        model: str,
+        history: list[dict],
+        **params,
+    ) -> str:
+        """Hash of everything that determines the answer (see the module docstring)."""
+        h = hashlib.sha256()
+        h.update(json.dumps([
+            normalize_query(query),
+            sorted(set(article_ids)),
+            model,
+            sorted(params.items()),
+        ], ensure_ascii=False).encode())
+        for message in history:
+            h.update(f"\x00{message['role']}\x00{message['content']}".encode())
+        return h.hexdigest()
+
+    def slot(
+        self,
+        fingerprint: str,
+        query: str,
+        article_ids: Iterable[str],
+        model: str,
+        history: list[dict],
+        **params,
+    ) -> CacheSlot:
+        """The CacheSlot of one request, answered from knowledge base ``fingerprint``."""
+        return CacheSlot(self, self.make_key(query, article_ids, model, history, **params), fingerprint)
+
+    # ------------------------------------------------------------------
+    # Lookups
+    # ------------------------------------------------------------------
+
+    def get(self, key: str, fingerprint: str) -> Optional[str]:
+        """The cached answer, or None (missing, expired or from another KB version)."""
+        with self._lock:
+            self._check_fingerprint(fingerprint)
+            entry = self._entries.get(key)
+            if entry is None and self._db is not None:
+                row = self._db.execute(
+                    "SELECT fingerprint, created, answer FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    entry = self._remember(key, tuple(row))
+            if entry is not None:
+                entry_fingerprint, created, answer = entry
+                if entry_fingerprint == fingerprint and time.time() - created <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return answer
+                self._forget(key)
+            self.misses += 1
+            return None
+
+    def put(self, key: str, fingerprint: str, answer: str):
+        with self._lock:
+            self._check_fingerprint(fingerprint)
+            entry = self._remember(key, (fingerprint, time.time(), answer))
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, fingerprint, created, answer) VALUES (?, ?, ?, ?)",
+                    (key, *entry),
+                )
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    # ------------------------------------------------------------------
+    # Internals (called with the lock held)
+    # ------------------------------------------------------------------
+
+    def _remember(self, key: str, entry: tuple) -> tuple:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)  # least recently used (stays in SQLite)
+        return entry
+
+    def _forget(self, key: str):
+        self._entries.pop(key, None)
+        if self._db is not None:
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+    def _check_fingerprint(self, fingerprint: str):
+        """Drop every entry of older knowledge bases once a new one shows up."""
+        if fingerprint == self._fingerprint:
+            return
+        self._fingerprint = fingerprint
+        stale = [key for key, entry in self._entries.items() if entry[0] != fingerprint]
+        for key in stale:
+            del self._entries[key]
+        if self._db is not None:
+            # Expired rows go too (memory entries are checked on lookup)
+            self._db.execute(
+                "DELETE FROM responses WHERE fingerprint != ? OR created < ?",
+                (fingerprint, time.time() - self.ttl),
+            )
+
+
+_default_cache: Optional[ResponseCache] = None
+_default_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """The process-wide cache configured by LEXAI_RESPONSE_CACHE (None when unset)."""
+    global _default_cache
+    if not CACHE_SETTING:
+        return None
+    if _default_cache is None:
+        with _default_lock:
+            if _default_cache is None:
+                in_memory = CACHE_SETTING.lower() in ("memory", "1", "true", "yes")
+                _default_cache = ResponseCache(path=None if in_memory else CACHE_SETTING)
+    return _default_cache
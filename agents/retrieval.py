@@ -0,0 +1,214 @@
+"""
+Retrieval - Shared building blocks for the agents' retrieval planners.
+
+Both agents gather context articles from several sources in priority order
+(exact references first, then topic and keyword searches) and must keep the
+result free of duplicates and within their context budget.
+
+hybrid_search runs lexical and vector retrieval concurrently and fuses their
+rankings with reciprocal-rank fusion (RRF): an article's score is the sum of
+1 / (RRF_K + rank) over every ranking it appears in, so articles that several
+retrievers agree on rise to the top without having to calibrate their raw
+scores against each other. The lexical rankings (BM25 plus one per detected
+topic) are first fused into a single lexical ranking, so lexical and vector
+retrieval carry the same weight however many topics a query mentions.
+The vector ranking is only added when a semantic embedding provider is
+configured (LEXAI_EMBEDDING_PROVIDER=openai): the default hashing provider is
+one more bag-of-words ranking, and fusing it would halve the lexical weight.
+"""
+
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from agents.embeddings import semantic_retrieval_enabled
+from agents.legal_knowledge_base import Article, LegalKnowledgeBase
+
+
+class ArticleCollector:
+    """
+    Ordered, de-duplicated and budgeted set of context articles.
+
+    Articles are kept in the order they were first added, so adding sources
+    from highest to lowest priority yields a priority-ordered context.
+    Duplicates are detected by ``article_id`` in O(1). Once ``budget``
+    articles are collected, further new articles are counted in ``dropped``
+    instead of being added.
+    """
+
+    __slots__ = ("budget", "dropped", "_articles", "_seen")
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.dropped = 0
+        self._articles: list[Article] = []
+        self._seen: set[int] = set()
+
+    def add(self, article: Article) -> bool:
+        """Add one article. Returns True if it was new and fit the budget."""
+        if article.article_id in self._seen:
+            return False
+        if len(self._articles) >= self.budget:
+            self.dropped += 1
+            return False
+        self._seen.add(article.article_id)
+        self._articles.append(article)
+        return True
+
+    def extend(self, articles: Iterable[Article]) -> int:
+        """Add articles in order. Returns how many were added."""
+        return sum(self.add(art) for art in articles)
+
+    @property
+    def remaining(self) -> int:
+        """How many more articles fit in the budget."""
+        return max(0, self.budget - len(self._articles))
+
+    @property
+    def articles(self) -> list[Article]:
+        return list(self._articles)
+
+    def __contains__(self, article: Article) -> bool:
+        return article.article_id in self._seen
+
+    def __len__(self) -> int:
+        return len(self._articles)
+
+    def __iter__(self) -> Iterator[Article]:
+        return iter(self._articles)
+
+
+def resolve_references(
+    kb: LegalKnowledgeBase, refs: list[dict], range_limit: Optional[int] = None
+) -> list[list[Article]]:
+    """
+    Look up extracted article references ({"number", "code_hint"} dicts,
+    plus "end" for ranges) and return one result list per reference.
+
+    Single numbers are resolved together with one find_articles_bulk call;
+    ranges use find_article_range and stop after ``range_limit`` articles.
+    """
+    singles = kb.find_articles_bulk(
+        (ref.get("code_hint"), ref["number"]) for ref in refs if "end" not in ref
+    )
+    single_results = iter(singles)
+    return [
+        kb.find_article_range(ref.get("code_hint"), ref["number"], ref["end"], range_limit)
+        if "end" in ref else next(single_results)
+        for ref in refs
+    ]
+
+
+# ---------------------------------------------------------------------------
+# Hybrid retrieval
+# ---------------------------------------------------------------------------
+
+# RRF damping constant (the value from the original RRF paper)
+RRF_K = 60
+# Depth of each ranking fed into the fusion
+RRF_DEPTH = 20
+# Wall-clock budget for one hybrid retrieval; retrievers still running when
+# it expires are left out of the fusion
+RETRIEVAL_BUDGET_S = 2.0
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="retrieval")
+    return _executor
+
+
+def reciprocal_rank_fusion(rankings: Iterable[list[Article]], k: int = RRF_K) -> list[Article]:
+    """
+    Fuse ranked article lists with RRF. Ties keep the order in which
+    articles were first seen (earlier rankings first).
+    """
+    scores: dict[int, float] = {}
+    articles: dict[int, Article] = {}
+    for ranking in rankings:
+        for rank, art in enumerate(ranking, 1):
+            scores[art.article_id] = scores.get(art.article_id, 0.0) + 1.0 / (k + rank)
+            articles.setdefault(art.article_id, art)
+    order = sorted(scores, key=scores.__getitem__, reverse=True)  # stable
+    return [articles[article_id] for article_id in order]
+
+
+@dataclass
+class HybridResult:
+    """Fused articles plus what each retriever contributed."""
+    articles: list[Article]
+    lexical: int = 0          # articles returned by the lexical retrievers
+    semantic: int = 0         # articles returned by the vector retriever
+    timed_out: list[str] = field(default_factory=list)
+    elapsed_ms: float = 0.0
+
+
+def hybrid_search(
+    kb: LegalKnowledgeBase,
+    query: str,
+    topics: Iterable[str] = (),
+    max_results: int = 10,
+    code_id: Optional[str] = None,
+    budget_s: float = RETRIEVAL_BUDGET_S,
+    semantic: Optional[bool] = None,
+) -> HybridResult:
+    """
+    Run lexical retrieval (BM25 over the query, plus one topic search per
+    detected topic) and semantic retrieval concurrently, then fuse them with
+    RRF. Returns within ``budget_s``: a retriever that has not finished by
+    then (e.g. embeddings still being computed) is skipped, and the ones that
+    did finish are still used. ``semantic`` defaults to whether a semantic
+    embedding provider is configured; without it only lexical rankings are fused.
+    """
+    if semantic is None:
+        semantic = semantic_retrieval_enabled()
+    retrievers = {"bm25": lambda: kb.search_by_keywords(query, code_id=code_id, max_results=RRF_DEPTH, ranking="bm25")}
+    for topic in dict.fromkeys(topics):
+        retrievers[f"tema '{topic}'"] = (
+            lambda topic=topic: kb.search_by_topic(topic, code_id=code_id, max_results=RRF_DEPTH)
+        )
+    if semantic:
+        retrievers["semantic"] = lambda: kb.search_semantic(query, code_id=code_id, max_results=RRF_DEPTH)
+
+    start = time.perf_counter()
+    executor = _get_executor()
+    futures = {executor.submit(retrieve): name for name, retrieve in retrievers.items()}
+    done, _ = wait(futures, timeout=budget_s)
+
+    result = HybridResult(articles=[])
+    lexical: list[list[Article]] = []
+    vector: list[Article] = []
+    for future, name in futures.items():
+        if future not in done:
+            result.timed_out.append(name)
+            continue
+        try:
+            ranking = future.result()
+        except Exception as e:
+            print(f"⚠️  {name} retrieval failed: {e}")
+            continue
+        if name == "semantic":
+            vector = ranking
+        else:
+            lexical.append(ranking)
+    if result.timed_out:
+        print(f"⚠️  Retrieval over its {budget_s:g} s budget, left out: {', '.join(result.timed_out)}")
+    result.lexical = len({art.article_id for r in lexical for art in r})
+    result.semantic = len(vector)
+    # One lexical ranking against one vector ranking; lexical first: it wins RRF ties
+    lexical_ranking = reciprocal_rank_fusion(lexical)[:RRF_DEPTH]
+    fused = reciprocal_rank_fusion([lexical_ranking, vector])
+    result.articles = fused[:max_results]
+    result.elapsed_ms = (time.perf_counter() - start) * 1000
+    return result
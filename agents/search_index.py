@@ -0,0 +1,271 @@
+"""
+Search Index - Inverted index over normalized article text.
+
+Each LegalCode owns one InvertedIndex segment. Postings are stored in a
+compressed-sparse-row layout (one flat array per field, sliced by per-token
+offsets) so a query only touches the postings of the tokens it matches,
+instead of rescanning every article.
+
+Matching semantics are those of the original linear scorer: a query term
+matches an article when it appears as a SUBSTRING of the normalized title or
+content (e.g. "contrat" matches "contratos"). Because query terms only contain
+[a-z0-9], every such match falls inside a single [a-z0-9]+ run of the text, so
+we index those runs as the vocabulary and resolve each query term to the
+vocabulary tokens that contain it through a trigram index.
+"""
+
+import math
+import re
+from array import array
+from typing import Iterable
+
+# Query terms are at least 3 chars long (see LegalKnowledgeBase._tokenize),
+# so shorter vocabulary tokens can never contain one.
+MIN_TOKEN_LEN = 3
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_TERM_CACHE_LIMIT = 4096
+
+# BM25F parameters: title matches weigh more and are barely length-normalized
+# (titles are short and uniform); content is fully length-normalized so huge
+# articles stop winning just by containing every word.
+BM25_K1 = 1.2
+BM25_TITLE_WEIGHT = 3.0
+BM25_TITLE_B = 0.3
+BM25_CONTENT_WEIGHT = 1.0
+BM25_CONTENT_B = 0.75
+# Bump when score_terms or score_bm25 change in a way the constants above do
+# not capture: the topic tables materialized in kb.snapshot are keyed on it
+SCORING_VERSION = 1
+# Everything the scores depend on, for fingerprints of precomputed rankings
+SCORING_PARAMS = (
+    SCORING_VERSION, BM25_K1, BM25_TITLE_WEIGHT, BM25_TITLE_B, BM25_CONTENT_WEIGHT, BM25_CONTENT_B,
+)
+
+
+def bm25_idf(doc_freq: int, total_docs: int) -> float:
+    """Non-negative BM25 inverse document frequency."""
+    return math.log(1.0 + (total_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+
+
+def index_tokens(normalized_text: str) -> list[str]:
+    """Split already-normalized text into indexable [a-z0-9]+ runs."""
+    return [t for t in _TOKEN_RE.findall(normalized_text) if len(t) >= MIN_TOKEN_LEN]
+
+
+def _trigrams(token: str) -> set[str]:
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+
+# Flat unsigned-int arrays making up an index (persisted by kb_snapshot)
+ARRAY_FIELDS = (
+    "offsets", "doc_ids", "title_tf", "content_tf",
+    "trigram_offsets", "trigram_tokens", "title_len", "content_len",
+)
+
+
+class InvertedIndex:
+    """
+    Term -> postings index for the articles of one legal code.
+
+    Layout (token ids are positions in the sorted ``vocab``):
+        offsets[tid] .. offsets[tid + 1]   slice of the postings of token tid
+        doc_ids[k]                         local article position
+        title_tf[k] / content_tf[k]        term frequency per field
+        title_len[d] / content_len[d]      field length (tokens) of article d
+
+    The arrays may be ``array('I')`` objects or zero-copy ``memoryview``
+    slices of a memory-mapped snapshot; both index and slice the same way.
+    """
+
+    def __init__(
+        self,
+        vocab: list[str],
+        offsets: array,
+        doc_ids: array,
+        title_tf: array,
+        content_tf: array,
+        trigram_keys: list[str],
+        trigram_offsets: array,
+        trigram_tokens: array,
+        title_len: array,
+        content_len: array,
+    ):
+        self.vocab = vocab
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.title_tf = title_tf
+        self.content_tf = content_tf
+        self.trigram_keys = trigram_keys
+        self.trigram_offsets = trigram_offsets
+        self.trigram_tokens = trigram_tokens
+        self._trigram_pos = {tri: i for i, tri in enumerate(trigram_keys)}
+        self.title_len = title_len
+        self.content_len = content_len
+        self._term_cache: dict[str, tuple[int, ...]] = {}
+
+    @classmethod
+    def build(cls, documents: Iterable[tuple[str, str]]) -> "InvertedIndex":
+        """
+        Build the index from (normalized_title, normalized_content) pairs in
+        local article order — typically a NormalizedTextStore.
+        """
+        postings: dict[str, list[list[int]]] = {}
+        title_len, content_len = array("I"), array("I")
+        for doc_id, (title_norm, content_norm) in enumerate(documents):
+            counts: dict[str, list[int]] = {}
+            title_tokens = index_tokens(title_norm)
+            content_tokens = index_tokens(content_norm)
+            title_len.append(len(title_tokens))
+            content_len.append(len(content_tokens))
+            for tok in title_tokens:
+                counts.setdefault(tok, [0, 0])[0] += 1
+            for tok in content_tokens:
+                counts.setdefault(tok, [0, 0])[1] += 1
+            for tok, (ttf, ctf) in counts.items():
+                postings.setdefault(tok, []).append([doc_id, ttf, ctf])
+
+        vocab = sorted(postings)
+        offsets = array("I", [0])
+        doc_ids, title_tf, content_tf = array("I"), array("I"), array("I")
+        trigram_map: dict[str, list[int]] = {}
+        for tid, tok in enumerate(vocab):
+            for doc_id, ttf, ctf in postings[tok]:
+                doc_ids.append(doc_id)
+                title_tf.append(ttf)
+                content_tf.append(ctf)
+            offsets.append(len(doc_ids))
+            for tri in _trigrams(tok):
+                trigram_map.setdefault(tri, []).append(tid)
+
+        trigram_keys = sorted(trigram_map)
+        trigram_offsets = array("I", [0])
+        trigram_tokens = array("I")
+        for tri in trigram_keys:
+            trigram_tokens.extend(trigram_map[tri])
+            trigram_offsets.append(len(trigram_tokens))
+
+        return cls(
+            vocab, offsets, doc_ids, title_tf, content_tf,
+            trigram_keys, trigram_offsets, trigram_tokens,
+            title_len, content_len,
+        )
+
+    def __len__(self) -> int:
+        return len(self.title_len)
+
+    # ------------------------------------------------------------------
+    # Lookup
+    # ------------------------------------------------------------------
+
+    def _tokens_with_trigram(self, tri: str):
+        pos = self._trigram_pos.get(tri)
+        if pos is None:
+            return ()
+        return self.trigram_tokens[self.trigram_offsets[pos]:self.trigram_offsets[pos + 1]]
+
+    def matching_tokens(self, term: str) -> tuple[int, ...]:
+        """Return the ids of all vocabulary tokens that contain ``term``."""
+        cached = self._term_cache.get(term)
+        if cached is not None:
+            return cached
+
+        candidates = None
+        # Intersect starting from the rarest trigram to keep sets small
+        for tokens in sorted((self._tokens_with_trigram(t) for t in _trigrams(term)), key=len):
+            if candidates is None:
+                candidates = set(tokens)
+            else:
+                candidates.intersection_update(tokens)
+            if not candidates:
+                break
+
+        vocab = self.vocab
+        result = tuple(sorted(tid for tid in candidates or () if term in vocab[tid]))
+        if len(self._term_cache) >= _TERM_CACHE_LIMIT:
+            self._term_cache.clear()
+        self._term_cache[term] = result
+        return result
+
+    def term_hits(self, term: str) -> dict[int, bool]:
+        """
+        Return {local_doc_id: found_in_title} for every article containing
+        ``term`` in its title or content.
+        """
+        hits: dict[int, bool] = {}
+        offsets, doc_ids, title_tf = self.offsets, self.doc_ids, self.title_tf
+        for tid in self.matching_tokens(term):
+            for k in range(offsets[tid], offsets[tid + 1]):
+                doc = doc_ids[k]
+                if title_tf[k]:
+                    hits[doc] = True
+                elif doc not in hits:
+                    hits[doc] = False
+        return hits
+
+    def term_frequencies(self, term: str) -> dict[int, tuple[int, int]]:
+        """
+        Return {local_doc_id: (title_tf, content_tf)} for ``term``, summing
+        the frequencies of every vocabulary token that contains it.
+        """
+        freqs: dict[int, tuple[int, int]] = {}
+        offsets, doc_ids = self.offsets, self.doc_ids
+        title_tf, content_tf = self.title_tf, self.content_tf
+        for tid in self.matching_tokens(term):
+            for k in range(offsets[tid], offsets[tid + 1]):
+                doc = doc_ids[k]
+                ttf, ctf = freqs.get(doc, (0, 0))
+                freqs[doc] = (ttf + title_tf[k], ctf + content_tf[k])
+        return freqs
+
+    def score_bm25(
+        self,
+        query_terms: list[str],
+        idf: dict[str, float],
+        avg_title_len: float,
+        avg_content_len: float,
+    ) -> dict[int, float]:
+        """
+        BM25F score for every article matching at least one term. Field
+        frequencies are length-normalized per field, weighted, summed and
+        then saturated once per term. ``idf`` and the average field lengths
+        are corpus-wide statistics supplied by the knowledge base.
+        """
+        scores: dict[int, float] = {}
+        title_len, content_len = self.title_len, self.content_len
+        avg_title_len = avg_title_len or 1.0
+        avg_content_len = avg_content_len or 1.0
+        for term in dict.fromkeys(query_terms):
+            term_idf = idf.get(term, 0.0)
+            for doc, (ttf, ctf) in self.term_frequencies(term).items():
+                tf = 0.0
+                if ttf:
+                    norm = 1.0 - BM25_TITLE_B + BM25_TITLE_B * title_len[doc] / avg_title_len
+                    tf += BM25_TITLE_WEIGHT * ttf / norm
+                if ctf:
+                    norm = 1.0 - BM25_CONTENT_B + BM25_CONTENT_B * content_len[doc] / avg_content_len
+                    tf += BM25_CONTENT_WEIGHT * ctf / norm
+                scores[doc] = scores.get(doc, 0.0) + term_idf * tf / (BM25_K1 + tf)
+        return scores
+
+    def score_terms(self, query_terms: list[str]) -> dict[int, float]:
+        """
+        Legacy keyword score for every article matching at least one term:
+        +2.0 per term found in the title, +1.0 per term found only in the
+        content, +3.0 bonus when all (2+) terms are present.
+        """
+        scores: dict[int, float] = {}
+        found: dict[int, int] = {}
+        hits_by_term: dict[str, dict[int, bool]] = {}
+        for term in query_terms:
+            hits = hits_by_term.get(term)
+            if hits is None:
+                hits = hits_by_term[term] = self.term_hits(term)
+            for doc, in_title in hits.items():
+                scores[doc] = scores.get(doc, 0.0) + (2.0 if in_title else 1.0)
+                found[doc] = found.get(doc, 0) + 1
+
+        if len(query_terms) > 1:
+            for doc, n in found.items():
+                if n == len(query_terms):
+                    scores[doc] += 3.0
+        return scores
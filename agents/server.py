@@ -0,0 +1,425 @@
+"""
+Server - Long-lived HTTP/JSON service for both agents (`run_agents.py serve`).
+
+The knowledge base is loaded (and its embeddings warmed) once at startup and
+hot-reloaded by the KB holder's watcher. Every conversation is a session
+holding its own async agents. All sessions share the process' OpenAI
+connection pool.
+
+Endpoints:
+    POST   /search            {"query", "session_id"?, "stream"?}
+    POST   /analyze           {"text", "name"?, "session_id"?, "stream"?}
+    POST   /followup          {"session_id", "question", "stream"?}
+    DELETE /sessions/<id>
+    GET    /health
+    GET    /metrics
+
+Answers are {"session_id", "answer"}. With "stream": true the response is a
+server-sent event stream of {"delta": ...} events ending with
+{"done": true, "session_id": ...}, or with {"error": ...} if the answer
+fails midway. Omit session_id to start a new session.
+
+Admission control: at most ``workers`` requests run at once, and up to
+``queue`` more wait for a slot. Beyond that the server answers 429 right away
+(with Retry-After) instead of letting latency grow without bound.
+"""
+
+import asyncio
+import os
+import statistics
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from agents.document_analysis_agent import AsyncDocumentAnalysisAgent
+from agents.http11 import (
+    HTTPError, Request, end_chunked, read_request, send_chunk, send_json, sse_event, start_chunked,
+)
+from agents.kb_holder import get_kb_holder
+from agents.repository_search_agent import AsyncRepositorySearchAgent
+from agents.response_cache import ResponseCache, get_response_cache
+
+DEFAULT_PORT = 8000
+DEFAULT_WORKERS = 64
+DEFAULT_QUEUE = 256
+SESSION_TTL_S = 30 * 60
+MAX_SESSIONS = 10000
+MAX_BODY_BYTES = 2 * 1024 * 1024
+# Latency samples kept for the percentiles in /metrics
+METRICS_WINDOW = 2000
+
+
+@dataclass
+class Session:
+    session_id: str
+    search: Optional[AsyncRepositorySearchAgent] = None
+    documents: Optional[AsyncDocumentAnalysisAgent] = None
+    last_used: float = field(default_factory=time.monotonic)
+    # Requests of one conversation run one at a time (shared history)
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+
+class Metrics:
+    """Request counters and rolling latency windows."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.requests = Counter()
+        self.statuses = Counter()
+        self.latency_ms = deque(maxlen=METRICS_WINDOW)
+        self.first_delta_ms = deque(maxlen=METRICS_WINDOW)
+
+    @staticmethod
+    def _percentiles(samples) -> dict:
+        if not samples:
+            return {}
+        ordered = sorted(samples)
+        pick = lambda q: round(ordered[min(len(ordered) - 1, int(len(ordered) * q))], 1)
+        return {"p50": round(statistics.median(ordered), 1), "p95": pick(0.95), "p99": pick(0.99)}
+
+    def snapshot(self) -> dict:
+        return {
+            "uptime_s": round(time.time() - self.started, 1),
+            "requests": dict(self.requests),
+            "statuses": {str(k): v for k, v in self.statuses.items()},
+            "latency_ms": self._percentiles(self.latency_ms),
+            "first_delta_ms": self._percentiles(self.first_delta_ms),
+        }
+
+
+class AgentServer:
+    """asyncio HTTP service hosting many agent conversations in one process."""
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = DEFAULT_PORT,
+        workers: int = DEFAULT_WORKERS,
+        queue: int = DEFAULT_QUEUE,
+        session_ttl: float = SESSION_TTL_S,
+        max_sessions: int = MAX_SESSIONS,
+        api_key: Optional[str] = None,
+        response_cache: Optional[ResponseCache] = None,
+    ):
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.queue = queue
+        self.session_ttl = session_ttl
+        self.max_sessions = max_sessions
+        self.api_key = api_key or os.environ.get("OPENAI_API_KEY")
+        if not self.api_key:
+            raise ValueError("❌ OPENAI_API_KEY not set. Set it in .env or pass it directly.")
+        # Shared by every session (LEXAI_RESPONSE_CACHE when not given)
+        self.response_cache = response_cache or get_response_cache()
+        self.metrics = Metrics()
+        self.sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._admitted = 0   # running + waiting for a slot
+        self._running = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._expiry_task: Optional[asyncio.Task] = None
+        self._connections: set[asyncio.StreamWriter] = set()
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------
+
+    async def open(self):
+        """Warm the knowledge base and start listening."""
+        holder = get_kb_holder()
+        kb = await asyncio.to_thread(holder.get)
+        await asyncio.to_thread(kb.ensure_loaded)
+        # Embedding matrices are loaded (or built) on the first semantic query
+        await asyncio.to_thread(kb.search_semantic, "contrato", max_results=1)
+        holder.start_watching()
+        self._slots = asyncio.Semaphore(self.workers)
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._expiry_task = asyncio.get_running_loop().create_task(self._expire_sessions_periodically())
+
+    async def serve_forever(self):
+        await self.open()
+        print(f"🚀 LexAI agents on http://{self.host}:{self.port}"
+              f"  (workers {self.workers}, queue {self.queue})")
+        async with self._server:
+            await self._server.serve_forever()
+
+    def start(self) -> "AgentServer":
+        """Run the server in a background thread (tests, load tests)."""
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="agent-server", daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self.open(), self._loop).result()
+        return self
+
+    async def close(self):
+        """Stop listening and drop open (keep-alive) connections."""
+        self._expiry_task.cancel()
+        self._server.close()
+        for writer in list(self._connections):
+            writer.close()
+        await self._server.wait_closed()
+
+    def stop(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.close(), self._loop).result(timeout=5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+        self._loop = None
+
+    def __enter__(self) -> "AgentServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # ------------------------------------------------------------------
+    # Sessions
+    # ------------------------------------------------------------------
+
+    def _session(self, session_id: Optional[str]) -> Session:
+        if session_id is None:
+            session = Session(uuid.uuid4().hex)
+            self.sessions[session.session_id] = session
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)  # least recently used
+            return session
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise HTTPError(404, f"Unknown or expired session: {session_id}")
+        session.last_used = time.monotonic()
+        self.sessions.move_to_end(session_id)
+        return session
+
+    def expire_sessions(self) -> int:
+        """Drop sessions idle for longer than the TTL. Returns how many."""
+        cutoff = time.monotonic() - self.session_ttl
+        expired = [sid for sid, s in self.sessions.items() if s.last_used < cutoff and not s.lock.locked()]
+        for sid in expired:
+            del self.sessions[sid]
+        return len(expired)
+
+    async def _expire_sessions_periodically(self):
+        while True:
+            await asyncio.sleep(min(60.0, self.session_ttl))
+            self.expire_sessions()
+
+    # ------------------------------------------------------------------
+    # Admission control
+    # ------------------------------------------------------------------
+
+    @asynccontextmanager
+    async def _admit(self):
+        if self._admitted >= self.workers + self.queue:
+            raise HTTPError(429, "Server busy, retry later", {"retry-after": "1"})
+        self._admitted += 1
+        try:
+            async with self._slots:
+                self._running += 1
+                try:
+                    yield
+                finally:
+                    self._running -= 1
+        finally:
+            self._admitted -= 1
+
+    @asynccontextmanager
+    async def _conversation(self, session_id: Optional[str]):
+        """Admit a request, then hold its session (one request per session at a time)."""
+        async with self._admit():
+            session = self._session(session_id)
+            async with session.lock:
+                yield session
+
+    # ------------------------------------------------------------------
+    # HTTP
+    # ------------------------------------------------------------------
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._connections.add(writer)
+        try:
+            while True:
+                try:
+                    request = await read_request(reader, MAX_BODY_BYTES)
+                except HTTPError as e:
+                    await send_json(writer, e.status, {"error": e.message}, {"connection": "close"})
+                    return
+                if request is None:
+                    return
+                await self._dispatch(request, writer)
+                if not request.keep_alive:
+                    return
+        except ConnectionError:
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    async def _dispatch(self, request: Request, writer: asyncio.StreamWriter):
+        routes = {
+            ("POST", "/search"): self._search,
+            ("POST", "/analyze"): self._analyze,
+            ("POST", "/followup"): self._followup,
+            ("GET", "/health"): self._health,
+            ("GET", "/metrics"): self._metrics,
+        }
+        start = time.perf_counter()
+        name = request.path
+        try:
+            if request.method == "DELETE" and request.path.startswith("/sessions/"):
+                name = "/sessions"
+                handler = self._delete_session
+            else:
+                handler = routes.get((request.method, request.path))
+                if handler is None:
+                    raise HTTPError(404, f"No route for {request.method} {request.path}")
+            status = await handler(request, writer)
+        except HTTPError as e:
+            status = e.status
+            await send_json(writer, e.status, {"error": e.message}, e.headers)
+        except ConnectionError:
+            raise
+        except Exception as e:
+            status = 500
+            print(f"❌ {request.method} {request.path} failed: {e}")
+            await send_json(writer, 500, {"error": "Internal server error"})
+        self.metrics.requests[name] += 1
+        self.metrics.statuses[status] += 1
+        if status == 200 and name in ("/search", "/analyze", "/followup"):
+            self.metrics.latency_ms.append((time.perf_counter() - start) * 1000)
+
+    async def _answer(self, writer, session: Session, deltas, stream: bool) -> int:
+        """Send an agent's answer as JSON or as an SSE stream."""
+        start = time.perf_counter()
+        try:
+            # The first delta runs retrieval and prompt building: if that fails, nothing
+            # has been sent yet and _dispatch can still answer with a JSON error
+            try:
+                first = await deltas.__anext__()
+                self.metrics.first_delta_ms.append((time.perf_counter() - start) * 1000)
+            except StopAsyncIteration:
+                first = None
+            if not stream:
+                parts = [] if first is None else [first]
+                async for delta in deltas:
+                    parts.append(delta)
+                await send_json(writer, 200, {"session_id": session.session_id, "answer": "".join(parts)})
+                return 200
+            await start_chunked(writer, "text/event-stream")
+            try:
+                if first is not None:
+                    await send_chunk(writer, sse_event({"delta": first}))
+                async for delta in deltas:
+                    await send_chunk(writer, sse_event({"delta": delta}))
+            except ConnectionError:
+                raise
+            except Exception as e:
+                # Headers are out: report the error as an event and end the body properly
+                print(f"❌ Stream for session {session.session_id} failed: {e}")
+                await send_chunk(writer, sse_event({"error": "Internal server error"}))
+                await end_chunked(writer)
+                return 500
+            await send_chunk(writer, sse_event({"done": True, "session_id": session.session_id}))
+            await end_chunked(writer)
+            return 200
+        finally:
+            # Client gone mid-stream: close the model stream, history untouched
+            await deltas.aclose()
+
+    @staticmethod
+    def _field(data: dict, name: str) -> str:
+        value = data.get(name)
+        if not isinstance(value, str) or not value.strip():
+            raise HTTPError(400, f'"{name}" must be a non-empty string')
+        return value
+
+    async def _search(self, request: Request, writer) -> int:
+        data = request.json()
+        query = self._field(data, "query")
+        async with self._conversation(data.get("session_id")) as session:
+            if session.search is None:
+                session.search = AsyncRepositorySearchAgent(self.api_key, self.response_cache)
+            deltas = session.search.search_and_respond_stream(query)
+            return await self._answer(writer, session, deltas, bool(data.get("stream")))
+
+    async def _analyze(self, request: Request, writer) -> int:
+        data = request.json()
+        text = self._field(data, "text")
+        async with self._conversation(data.get("session_id")) as session:
+            if session.documents is None:
+                session.documents = AsyncDocumentAnalysisAgent(self.api_key, self.response_cache)
+            deltas = session.documents.analyze_text_stream(text, str(data.get("name") or "Documento"))
+            return await self._answer(writer, session, deltas, bool(data.get("stream")))
+
+    async def _followup(self, request: Request, writer) -> int:
+        data = request.json()
+        question = self._field(data, "question")
+        async with self._conversation(self._field(data, "session_id")) as session:
+            if session.documents is None or not session.documents.current_document:
+                raise HTTPError(409, "No document has been analyzed in this session")
+            deltas = session.documents.ask_followup_stream(question)
+            return await self._answer(writer, session, deltas, bool(data.get("stream")))
+
+    async def _delete_session(self, request: Request, writer) -> int:
+        session_id = request.path[len("/sessions/"):]
+        if self.sessions.pop(session_id, None) is None:
+            raise HTTPError(404, f"Unknown or expired session: {session_id}")
+        await send_json(writer, 200, {"deleted": session_id})
+        return 200
+
+    async def _health(self, request: Request, writer) -> int:
+        kb = get_kb_holder().get()
+        await send_json(writer, 200, {
+            "status": "ok",
+            "kb": {
+                "fingerprint": kb.fingerprint,
+                "codes": len(kb.codes),
+                "articles": sum(len(code.articles) for code in kb.codes.values()),
+            },
+            "sessions": len(self.sessions),
+        })
+        return 200
+
+    async def _metrics(self, request: Request, writer) -> int:
+        await send_json(writer, 200, {
+            **self.metrics.snapshot(),
+            "running": self._running,
+            "queued": self._admitted - self._running,
+            "workers": self.workers,
+            "queue_limit": self.queue,
+            "sessions": len(self.sessions),
+            "response_cache": self.response_cache.stats() if self.response_cache else None,
+        })
+        return 200
+
+
+def serve(
+    host: str = "127.0.0.1",
+    port: int = DEFAULT_PORT,
+    workers: int = DEFAULT_WORKERS,
+    queue: int = DEFAULT_QUEUE,
+    cache: str = "",
+):
+    """Run the service until interrupted. ``cache``: "memory" or a SQLite path."""
+    response_cache = None
+    if cache:
+        response_cache = ResponseCache(path=None if cache == "memory" else cache)
+    try:
+        server = AgentServer(host, port, workers, queue, response_cache=response_cache)
+    except ValueError as e:
+        print(f"\n{e}")
+        sys.exit(1)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        print("\n👋 Server stopped.")
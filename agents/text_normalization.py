@@ -0,0 +1,84 @@
+"""
+Text Normalization - Fast accent folding and the normalized-text column store.
+
+The knowledge base matches queries case- and accent-insensitively. The
+reference normalization is ``NFKD`` followed by dropping every combining mark
+(Unicode category M). Both steps act character by character, so they can be
+precomputed into a ``str.translate`` table. The table is filled lazily the
+first time each non-ASCII character is seen. ASCII text, which is most of the
+corpus, never goes through it.
+"""
+
+import re
+import unicodedata
+
+_NON_ASCII_RUN = re.compile(r"[^\x00-\x7f]+")
+_NON_ALNUM = re.compile(r"[^a-z0-9\s]")
+
+
+def _strip_char(char: str) -> str:
+    nfkd = unicodedata.normalize("NFKD", char)
+    return "".join(c for c in nfkd if not unicodedata.category(c).startswith("M"))
+
+
+class _AccentTable(dict):
+    """Translate table: code point -> accent-free replacement, computed on demand."""
+
+    def __missing__(self, codepoint: int) -> str:
+        value = _strip_char(chr(codepoint))
+        self[codepoint] = value
+        return value
+
+
+_ACCENT_TABLE = _AccentTable()
+# Pre-fill Latin-1 Supplement and Latin Extended-A/B: covers Spanish text
+for _cp in range(0x80, 0x250):
+    _ACCENT_TABLE[_cp]
+
+
+def _translate_run(match: re.Match) -> str:
+    return match.group().translate(_ACCENT_TABLE)
+
+
+def strip_accents(text: str) -> str:
+    """Remove accent marks (NFKD + drop combining marks)."""
+    if text.isascii():
+        return text
+    return _NON_ASCII_RUN.sub(_translate_run, text)
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase and remove accents — the form article text is matched in."""
+    return strip_accents(text.lower())
+
+
+def fold_query(text: str) -> str:
+    """Normalize a query and blank out everything except [a-z0-9] and whitespace."""
+    return _NON_ALNUM.sub(" ", normalize_text(text))
+
+
+class NormalizedTextStore:
+    """
+    Column store with the normalized title and content of each article of a
+    code, indexed by local article position. Computed once at load time so
+    scorers never normalize article text per query.
+    """
+
+    __slots__ = ("titles", "contents")
+
+    def __init__(self, titles: list[str], contents: list[str]):
+        self.titles = titles
+        self.contents = contents
+
+    @classmethod
+    def from_articles(cls, articles) -> "NormalizedTextStore":
+        return cls(
+            [normalize_text(art.title) for art in articles],
+            [normalize_text(art.content) for art in articles],
+        )
+
+    def __len__(self) -> int:
+        return len(self.titles)
+
+    def __iter__(self):
+        return zip(self.titles, self.contents)
@@ -10,8 +10,12 @@ Usage:
     python run_agents.py analyze       # Start the document analyzer
     python run_agents.py analyze doc.pdf  # Analyze a specific file
     python run_agents.py test          # Run a quick test of the knowledge base
+    python run_agents.py bench         # Run the knowledge base benchmarks
+    python run_agents.py embed         # Precompute article embeddings
+    python run_agents.py serve         # Serve both agents over HTTP
 """
 
+import json
 import sys
 import os
 
@@ -30,12 +34,18 @@ Usage:
     python run_agents.py analyze             Start the document analysis agent
     python run_agents.py analyze <file>      Analyze a specific document
     python run_agents.py test                Test the knowledge base loading
+    python run_agents.py bench [name ...]    Run knowledge base benchmarks
+    python run_agents.py embed [provider]    Precompute article embeddings (hashing|openai)
+    python run_agents.py serve [options]     Serve both agents over HTTP (--host, --port, --workers, --queue, --cache)
 
 Examples:
     python run_agents.py search
     python run_agents.py analyze data/pdfs/codigo-civil.pdf
     python run_agents.py analyze "ejemplo-contrato.txt"
     python run_agents.py test
+    python run_agents.py bench load
+    python run_agents.py embed openai
+    python run_agents.py serve --port 8000 --workers 64 --queue 256
 """)
 
 
@@ -62,22 +72,908 @@ def run_test():
             print(f"   Content: {art.content[:150]}...")
     else:
         print("   ❌ Not found")
+
+    print(f"\n🔍 Test: Snapshot round-trip...")
+    run_snapshot_test()
+
+    print(f"\n🔍 Test: Lazy vs. eager loading...")
+    run_lazy_loading_test(kb)
+
+    print(f"\n🔍 Test: Range and bulk article lookups...")
+    run_article_lookup_test(kb)
     
     print(f"\n🔍 Test: Keyword search for 'contrato'...")
     results = kb.search_by_keywords("contrato", max_results=3)
+    assert len(results) == 3 and all("contrat" in (art.title + art.content).lower() for art in results)
     for art in results:
         print(f"   ✅ {art.citation()}")
         print(f"      {art.content[:100]}...")
     
     print(f"\n🔍 Test: Topic search for 'despido'...")
     results = kb.search_by_topic("despido", max_results=3)
+    assert len(results) == 3, results
     for art in results:
         print(f"   ✅ {art.citation()}")
         print(f"      {art.content[:100]}...")
     
+    print(f"\n🔍 Test: Indexed search vs. linear scan...")
+    run_index_parity_test(kb)
+
+    print(f"\n🔍 Test: Topic search for 'despido' (BM25 ranking)...")
+    results = kb.search_by_topic("despido", max_results=3, ranking="bm25")
+    for art in results:
+        print(f"   ✅ {art.citation()}")
+        print(f"      {art.content[:100]}...")
+
+    from unittest import mock
+    import agents.legal_knowledge_base as lkb
+    topic_fingerprint = kb._topic_fingerprint()
+    with mock.patch.object(lkb, "SCORING_PARAMS", lkb.SCORING_PARAMS + ("changed",)):
+        assert kb._topic_fingerprint() != topic_fingerprint, "scoring changes must invalidate the topic tables"
+    print(f"   ✅ Topic tables are keyed on the scoring parameters")
+
+    print(f"\n🔍 Test: Hot reload (added, changed and removed sources)...")
+    run_kb_reload_test()
+
+    print(f"\n🔍 Test: Semantic search for 'despido sin justa causa' (offline embeddings)...")
+    results = kb.search_semantic("despido sin justa causa", max_results=3, provider="hashing")
+    for art in results:
+        print(f"   ✅ {art.citation()}")
+        print(f"      {art.content[:100]}...")
+    from agents.embeddings import EmbeddingProvider
+
+    class _IncompleteProvider(EmbeddingProvider):
+        key, dim = "incomplete", 8
+    try:
+        _IncompleteProvider()
+        raise AssertionError("a provider without _embed must not instantiate")
+    except TypeError:
+        print(f"   ✅ Providers without _embed fail when instantiated")
+
+    print(f"\n🔍 Test: IVF-flat ANN index vs. exact search...")
+    run_ann_index_test(kb)
+
+    print(f"\n🔍 Test: Hybrid retrieval (lexical vs. vector fusion, partial timeout)...")
+    run_hybrid_search_test()
+
+    print(f"\n🔍 Test: Query/document detectors (single-pass matcher)...")
+    run_matcher_parity_test(kb)
+
+    print(f"\n🔍 Test: Token-budgeted context (Art. 237 Código de Trabajo, ~64k characters)...")
+    from agents.context_packer import count_tokens, pack_articles, query_terms
+    long_article = kb.find_article("codigo-trabajo", 237)
+    packed = pack_articles(
+        long_article + kb.search_by_topic("despido", max_results=5), 2000,
+        query_terms("incapacidad permanente despido"), max_article_tokens=600,
+    )
+    assert packed.tokens <= 2000 and packed.articles[0].trimmed, packed.summary()
+    print(f"   ✅ {count_tokens(long_article[0].content):,} tokens → {packed.summary()}")
+
+    print(f"\n🔍 Test: 20 concurrent async conversations (local mock OpenAI server)...")
+    run_async_agent_test()
+
+    print(f"\n🔍 Test: HTTP service (sessions, follow-ups, admission control)...")
+    run_server_test()
+
+    print(f"\n🔍 Test: Response cache (hits, history window, KB invalidation, SQLite)...")
+    run_response_cache_test()
+
+    print(f"\n🔍 Test: Batched ingestion embeddings (token-bounded batches, retries, rate limit)...")
+    run_embedding_batches_test()
+
+    print(f"\n🔍 Test: Shared embedding cache (hits, duplicates, size-bounded eviction)...")
+    run_embedding_cache_test()
+
+    print(f"\n🔍 Test: pgvector COPY BINARY payload...")
+    run_pgvector_copy_test()
+
+    print(f"\n🔍 Test: Incremental ingestion (content hashes, upserts, gated deletes)...")
+    run_incremental_sync_test()
+
+    print(f"\n🔍 Test: --manifest ingestion (entries, pipeline error accounting)...")
+    run_manifest_test()
+
     print("\n✨ All tests passed!")
 
 
+def run_index_parity_test(kb):
+    """Indexed keyword and topic search rank exactly like the original linear scan."""
+    import re
+    import unicodedata
+    from agents.legal_knowledge_base import LEGAL_TERM_EXPANSIONS, STOPWORDS
+
+    def fold(text):
+        nfkd = unicodedata.normalize("NFKD", text.lower())
+        return "".join(c for c in nfkd if not unicodedata.category(c).startswith("M"))
+
+    folded = {art.article_id: (fold(art.title), fold(art.content)) for c in kb.codes.values() for art in c.articles}
+
+    def scan(query, code_id=None, max_results=10):
+        # The pre-index search: substring matches over every article, stable sort
+        terms = [t for t in re.sub(r"[^a-z0-9\s]", " ", fold(query)).split() if len(t) >= 3 and t not in STOPWORDS]
+        if not terms:
+            return []
+        articles = kb.codes[code_id].articles if code_id else [a for c in kb.codes.values() for a in c.articles]
+        scored = []
+        for art in articles:
+            title, content = folded[art.article_id]
+            found = [2.0 if t in title else 1.0 for t in terms if t in title or t in content]
+            score = sum(found) + (3.0 if len(found) == len(terms) > 1 else 0.0)
+            if score > 0:
+                scored.append((score, art))
+        scored.sort(key=lambda x: x[0], reverse=True)
+        return [art.article_id for _, art in scored[:max_results]]
+
+    def expand(topic):
+        return next((f"{topic} {exp}" for key, exp in LEGAL_TERM_EXPANSIONS.items() if key in topic.lower()), topic)
+
+    queries = ["contrato", "despido sin justa causa", "plazo de prescripción", "Sociedad anónima: acciones",
+               "pensión alimentaria", "xyzzy"]
+    for query in queries:
+        for code_id in (None, "codigo-trabajo"):
+            got = [a.article_id for a in kb.search_by_keywords(query, code_id=code_id, max_results=15)]
+            assert got == scan(query, code_id, 15), (query, code_id)
+    topics = ["despido", "herencia", "estafa", "vacaciones", "embargo preventivo"]
+    for topic in topics:
+        for code_id in (None, "codigo-civil"):
+            got = [a.article_id for a in kb.search_by_topic(topic, code_id=code_id, max_results=10)]
+            assert got == scan(expand(topic), code_id, 10), (topic, code_id)
+    print(f"   ✅ {len(queries)} keyword queries and {len(topics)} topics rank like the linear scan")
+
+
+def run_article_lookup_test(kb):
+    """Range and bulk lookups agree with find_article; query references parse ranges."""
+    from agents.repository_search_agent import extract_article_references
+
+    for code_id, start, end in (("codigo-civil", 1, 12), ("codigo-trabajo", 28, 35), ("codigo-penal", 110, 118)):
+        expected = [art for n in range(start, end + 1) for art in kb.find_article(code_id, n)]
+        assert kb.find_article_range(code_id, start, end) == expected, (code_id, start, end)
+        assert kb.find_article_range(code_id, start, end, limit=3) == expected[:3]
+        assert kb.find_article_range(code_id, end, start) == []
+    refs = [("codigo-trabajo", 29), (None, 45), ("codigo-civil", 1), ("codigo-penal", 999999)]
+    expected = [kb.find_article(c, n) if c else kb.find_article_any_code(n) for c, n in refs]
+    assert kb.find_articles_bulk(refs) == expected
+
+    hint = "codigo-trabajo"
+    cases = {
+        "artículos 10 al 15 del código de trabajo": [{"number": 10, "end": 15, "code_hint": hint}],
+        "artículos 15 al 10 del código de trabajo": [{"number": 15, "code_hint": hint}],
+        "art. 45 y artículos 3 al 5": [{"number": 45, "code_hint": None}, {"number": 3, "end": 5, "code_hint": None}],
+    }
+    for query, refs in cases.items():
+        assert extract_article_references(query) == refs, (query, extract_article_references(query))
+    print(f"   ✅ Range and bulk lookups match find_article; reversed ranges keep their first article")
+
+
+def _search_results(kb) -> list:
+    """Comparable results of every search mode over a fixed set of queries (searches first: they load lazy codes)."""
+    results = []
+    for query in ("contrato", "despido sin justa causa", "plazo de prescripción"):
+        for ranking in ("legacy", "bm25"):
+            results.append([a.article_id for a in kb.search_by_keywords(query, max_results=10, ranking=ranking)])
+    for topic in ("despido", "herencia", "estafa"):
+        for code_id in (None, "codigo-civil"):
+            results.append([a.article_id for a in kb.search_by_topic(topic, code_id=code_id, max_results=10)])
+    results.append([[a.article_id for a in arts] for arts in kb.find_articles_bulk([("codigo-trabajo", 29), (None, 45)])])
+    results += [kb.fingerprint, kb.get_stats()]
+    for code in kb.codes.values():
+        results.append([(a.article_id, a.article_number, a.title, a.content) for a in code.articles])
+    return results
+
+
+def run_snapshot_test():
+    """A snapshot round-trips the JSON build exactly; a corrupt one is rebuilt."""
+    import tempfile
+    from unittest import mock
+    from agents.legal_knowledge_base import LegalKnowledgeBase
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "kb.snapshot")
+        from_json = LegalKnowledgeBase(snapshot_path=path, verbose=False).load()
+        written = os.stat(path).st_mtime_ns
+        with mock.patch.object(LegalKnowledgeBase, "_load_code_json", side_effect=AssertionError("rebuilt from JSON")):
+            mapped = LegalKnowledgeBase(snapshot_path=path, verbose=False).load()
+        assert os.stat(path).st_mtime_ns == written, "an up-to-date snapshot must not be rewritten"
+        assert _search_results(mapped) == _search_results(from_json)
+        assert mapped._topic_tables == from_json._topic_tables
+
+        with open(path, "r+b") as f:
+            f.truncate(os.path.getsize(path) // 2)
+        rebuilt = LegalKnowledgeBase(snapshot_path=path, verbose=False).load()
+        assert _search_results(rebuilt) == _search_results(from_json)
+    print(f"   ✅ Snapshot load matches the JSON build (articles, searches, topic tables); a corrupt one is rebuilt")
+
+
+def run_lazy_loading_test(eager):
+    """A lazy knowledge base loads only what a search needs and answers exactly like an eager one."""
+    from agents.legal_knowledge_base import LegalKnowledgeBase
+
+    lazy = LegalKnowledgeBase(lazy=True, verbose=False).load()
+    assert not lazy.codes and not lazy.fully_loaded
+    assert lazy.find_article("codigo-trabajo", 29) == eager.find_article("codigo-trabajo", 29)
+    single = lambda kb: [a.article_id for a in kb.search_by_topic("despido", code_id="codigo-trabajo", max_results=10)]
+    assert single(lazy) == single(eager) and list(lazy.codes) == ["codigo-trabajo"], list(lazy.codes)
+    assert not lazy.fully_loaded
+    assert _search_results(lazy) == _search_results(eager) and lazy.fully_loaded
+    assert list(lazy.codes) == list(eager.codes) and lazy._topic_tables == eager._topic_tables
+    print(f"   ✅ One code loaded for a filtered search; every search matches the eager knowledge base")
+
+
+def run_kb_reload_test():
+    """Hot reloads swap in added, changed and removed sources, eager and lazy."""
+    import shutil
+    import tempfile
+    from agents.kb_holder import KnowledgeBaseHolder
+
+    source_dir = os.path.join(PROJECT_ROOT, "data", "processed")
+    for lazy in (False, True):
+        with tempfile.TemporaryDirectory() as tmp:
+            for code_id in ("codigo-penal", "codigo-procesal-penal"):
+                shutil.copy(os.path.join(source_dir, f"{code_id}.json"), tmp)
+            holder = KnowledgeBaseHolder(tmp, lazy=lazy, use_snapshot=False, verbose=False)
+            holder.get().find_article("codigo-penal", 1)  # lazy: materializes one code
+            assert not holder.reload() and holder.generation == 1
+
+            shutil.copy(os.path.join(source_dir, "codigo-comercio.json"), tmp)
+            assert holder.reload(), "added source"
+            kb = holder.get()
+            kb.ensure_loaded()
+            assert set(kb.codes) == {"codigo-penal", "codigo-procesal-penal", "codigo-comercio"}, list(kb.codes)
+
+            path = os.path.join(tmp, "codigo-penal.json")
+            with open(path, "r", encoding="utf-8") as f:
+                raw = json.load(f)
+            raw["articles"][0]["content"] = "Texto reformado del artículo primero."
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(raw, f, ensure_ascii=False)
+            assert holder.reload(), "changed source"
+            assert "reformado" in holder.get().find_article("codigo-penal", 1)[0].content
+
+            os.remove(os.path.join(tmp, "codigo-comercio.json"))
+            assert holder.reload(), "removed source"
+            kb = holder.get()
+            kb.ensure_loaded()
+            assert set(kb.codes) == {"codigo-penal", "codigo-procesal-penal"}, list(kb.codes)
+            assert holder.generation == 4 and not holder.reload()
+    print(f"   ✅ Added, changed and removed sources swapped in (eager and lazy)")
+
+
+def run_matcher_parity_test(kb):
+    """scan_legal_text answers every detector exactly like the per-detector regexes it replaced."""
+    from agents.benchmarks import legacy_detectors
+    from agents.document_analysis_agent import (
+        detect_document_topics, detect_document_type, extract_legal_references_from_doc,
+    )
+    from agents.repository_search_agent import detect_search_topics, extract_article_references
+
+    with open(os.path.join(PROJECT_ROOT, "ejemplo-contrato.txt"), encoding="utf-8") as f:
+        texts = [f.read()]
+    texts += [f"{art.title}\n{art.content}" for code in kb.codes.values() for art in code.articles]
+    texts += ["¿Qué dice el artículo 45 del código civil sobre la herencia?", "arts. 28 al 30 del Código de Trabajo",
+              "despido sin justa causa y preaviso", "Poder general y especial", "artículos 15 al 10 del código penal"]
+    ranged = 0
+    for text in texts:
+        old = legacy_detectors(text)
+        assert old["search_topics"] == detect_search_topics(text), text[:80]
+        assert old["document_type"] == detect_document_type(text), text[:80]
+        assert old["document_topics"] == detect_document_topics(text), text[:80]
+        assert old["query_references"] == extract_article_references(text), text[:80]
+        new_refs = extract_legal_references_from_doc(text)
+        # Intended difference: "artículos 62 a 231 del Código Civil" keeps its code hint
+        extra = [ref for ref in new_refs if ref not in old["document_references"]]
+        relaxed = []
+        for ref in new_refs:
+            ref = {**ref, "code_hint": None} if ref in extra else ref
+            if ref not in relaxed:
+                relaxed.append(ref)
+        assert relaxed == old["document_references"] and all(ref["code_hint"] for ref in extra), text[:80]
+        ranged += bool(extra)
+    print(f"   ✅ {len(texts)} texts: topics, document types and references match the old regexes"
+          f" ({ranged} document ranges now keep their code hint)")
+
+
+def run_ann_index_test(kb):
+    """IVF-flat at ANN_MIN_ROWS rows: recall@10 against exact search, exhaustive probing, persistence."""
+    import tempfile
+    import numpy as np
+    from agents.ann_index import ANN_MIN_ROWS, DEFAULT_NPROBE, IVFFlatIndex
+    from agents.benchmarks import SEMANTIC_QUERIES, _synthetic_corpus
+    from agents.embeddings import article_text, get_embedding_provider, top_k
+
+    provider = get_embedding_provider("hashing")
+    articles = [art for code in kb.codes.values() for art in code.articles]
+    rng = np.random.default_rng(0)
+    # Same queries and corpus as `bench ann`
+    queries = provider.embed(SEMANTIC_QUERIES + [
+        " ".join(articles[i].content.split()[:8]) for i in rng.integers(0, len(articles), 56)
+    ])
+    matrix = _synthetic_corpus(provider.embed([article_text(art) for art in articles]), ANN_MIN_ROWS, rng)
+    index = IVFFlatIndex.build(matrix)
+    exact = top_k(queries @ matrix.T, 10)
+
+    def recall(hits):
+        return np.mean([len(set(ids.tolist()) & set(truth.tolist())) / 10 for (ids, _), truth in zip(hits, exact)])
+
+    hits = index.search(queries, 10, DEFAULT_NPROBE)
+    assert recall(hits) >= 0.75, recall(hits)
+    assert all((ids == truth).all() for (ids, _), truth in zip(index.search(queries, 10, index.nlist), exact))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "matrix.ivf.npz")
+        index.save(path)
+        reloaded = IVFFlatIndex.load(path, matrix)
+        assert all((a == b).all() for (a, _), (b, _) in zip(reloaded.search(queries, 10, DEFAULT_NPROBE), hits))
+        assert IVFFlatIndex.load(path, matrix[:-1]) is None
+    print(f"   ✅ {ANN_MIN_ROWS:,} rows: recall@10 {recall(hits):.2f} at nprobe {DEFAULT_NPROBE};"
+          f" all {index.nlist} cells = exact; persisted index identical")
+
+
+def run_hybrid_search_test():
+    """hybrid_search: topics do not outvote the vector ranking; finished retrievers survive a timeout."""
+    import time
+    from types import SimpleNamespace
+    from agents.retrieval import hybrid_search
+
+    arts = {name: SimpleNamespace(article_id=i) for i, name in enumerate("lvxs")}
+
+    class StubKB:
+        """``l`` tops every lexical ranking; ``v`` is first by vector and second by BM25."""
+
+        slow_topic = None
+
+        def search_by_keywords(self, query, **kwargs):
+            return [arts["l"], arts["v"]]
+
+        def search_by_topic(self, topic, **kwargs):
+            if topic == self.slow_topic:
+                time.sleep(0.5)
+            return [arts["l"], arts["x"]]
+
+        def search_semantic(self, query, **kwargs):
+            return [arts["v"], arts["s"]]
+
+    kb = StubKB()
+    result = hybrid_search(kb, "q", ["despido", "preaviso", "vacaciones"], semantic=True)
+    assert result.articles[0] is arts["v"], [a.article_id for a in result.articles]
+    assert (result.lexical, result.semantic, result.timed_out) == (3, 2, [])
+
+    kb.slow_topic = "preaviso"
+    result = hybrid_search(kb, "q", ["despido", "preaviso"], budget_s=0.2, semantic=True)
+    assert result.timed_out == ["tema 'preaviso'"] and result.lexical == 3, result
+
+    # Default hashing provider: no vector ranking, lexical order kept
+    kb.slow_topic = None
+    result = hybrid_search(kb, "q", ["despido"], semantic=False)
+    assert [a.article_id for a in result.articles] == [0, 1, 2] and result.semantic == 0, result
+    print(f"   ✅ Agreed-on article first with 3 topics; a slow topic search is left out, the rest kept")
+    print(f"   ✅ Lexical rankings only without a semantic embedding provider")
+
+
+def run_async_agent_test(conversations: int = 20):
+    """Run concurrent AsyncRepositorySearchAgent conversations against the mock API."""
+    import asyncio
+    import time
+    from agents.llm import get_async_client
+    from agents.mock_openai import MockOpenAIServer
+    from agents.repository_search_agent import AsyncRepositorySearchAgent
+
+    with MockOpenAIServer(ttft=0.2, tokens=20) as server:
+        async def converse():
+            agents = [AsyncRepositorySearchAgent(api_key="sk-mock") for _ in range(conversations)]
+            for agent in agents:
+                agent.client = get_async_client("sk-mock", server.base_url)
+            start = time.perf_counter()
+            answers = await asyncio.gather(*(
+                agent.search_and_respond("¿Qué dice el artículo 29 del Código de Trabajo?") for agent in agents
+            ))
+            return agents, answers, time.perf_counter() - start
+
+        agents, answers, elapsed = asyncio.run(converse())
+    assert all(answer.startswith("**Respuesta simulada.**") for answer in answers), answers[0]
+    assert all(len(agent.conversation_history) == 3 for agent in agents)
+    print(f"   ✅ {conversations} answers in {elapsed:.2f} s (mock time to first token 0.2 s,"
+          f" {server.max_active} requests in flight at peak)")
+
+
+def run_server_test():
+    """Exercise the HTTP service against the mock API."""
+    import asyncio
+    from agents.http11 import HTTPConnection
+    from agents.mock_openai import MockOpenAIServer
+    from agents.server import AgentServer
+
+    previous_base_url = os.environ.get("OPENAI_BASE_URL")
+    with MockOpenAIServer(ttft=0.2, tokens=10) as mock:
+        os.environ["OPENAI_BASE_URL"] = mock.base_url
+        try:
+            with AgentServer(port=0, workers=1, queue=1, api_key="sk-mock") as server:
+                async def exercise():
+                    conn = HTTPConnection("127.0.0.1", server.port)
+                    status, body = await conn.request("POST", "/search", {"query": "despido sin justa causa"})
+                    assert status == 200, body
+                    session_id = json.loads(body)["session_id"]
+                    status, body = await conn.request(
+                        "POST", "/search", {"query": "¿Y el preaviso?", "session_id": session_id, "stream": True}
+                    )
+                    assert status == 200 and body.rstrip().endswith(b'"done": true, "session_id": "' + session_id.encode() + b'"}'), body
+                    history = server.sessions[session_id].search.conversation_history
+                    # Compact history: raw queries, no article context
+                    assert len(history) == 5 and history[1]["content"] == "despido sin justa causa", history[1]
+
+                    status, _ = await conn.request("POST", "/followup", {"session_id": session_id, "question": "¿Plazo?"})
+                    assert status == 409
+                    status, _ = await conn.request("POST", "/analyze", {"text": "Contrato de arrendamiento...", "session_id": session_id})
+                    assert status == 200
+                    status, _ = await conn.request("POST", "/followup", {"session_id": session_id, "question": "¿Plazo?"})
+                    assert status == 200
+
+                    # Retrieval fails before the stream starts: a JSON 500, and the connection stays usable
+                    agent = server.sessions[session_id].search
+                    def fail(query):
+                        raise RuntimeError("retrieval failed")
+                    agent._build_user_message = fail
+                    status, body = await conn.request(
+                        "POST", "/search", {"query": "herencia", "session_id": session_id, "stream": True}
+                    )
+                    assert status == 500 and json.loads(body) == {"error": "Internal server error"}, body
+                    del agent._build_user_message
+                    status, _ = await conn.request("POST", "/search", {"query": "herencia", "session_id": session_id})
+                    assert status == 200
+
+                    # A malformed Content-Length is a 400, not a dropped connection
+                    for length in (b"-5", b"abc"):
+                        reader, raw = await asyncio.open_connection("127.0.0.1", server.port)
+                        raw.write(b"POST /search HTTP/1.1\r\ncontent-length: " + length + b"\r\n\r\n")
+                        assert (await reader.readline()).startswith(b"HTTP/1.1 400"), length
+                        raw.close()
+
+                    # workers=1, queue=1: of 6 simultaneous requests, at most 2 are admitted
+                    conns = [HTTPConnection("127.0.0.1", server.port) for _ in range(6)]
+                    statuses = [status for status, _ in await asyncio.gather(*(
+                        c.request("POST", "/search", {"query": "herencia"}) for c in conns
+                    ))]
+                    for c in conns + [conn]:
+                        await c.close()
+                    return statuses
+
+                statuses = asyncio.run(exercise())
+                assert statuses.count(429) >= 4 and statuses.count(200) >= 1, statuses
+                metrics = server.metrics.snapshot()
+        finally:
+            if previous_base_url is None:
+                os.environ.pop("OPENAI_BASE_URL", None)
+            else:
+                os.environ["OPENAI_BASE_URL"] = previous_base_url
+    print(f"   ✅ Session reuse, streaming, analyze + follow-up; {statuses.count(429)}/6 shed with 429")
+    print(f"   ✅ /metrics latency: {metrics['latency_ms']}")
+
+
+def run_response_cache_test():
+    """Repeated questions are answered from the cache, never across KB versions."""
+    import tempfile
+    from openai import OpenAI
+    from agents.mock_openai import MockOpenAIServer
+    from agents.repository_search_agent import RepositorySearchAgent
+    from agents.response_cache import ResponseCache
+
+    with MockOpenAIServer(ttft=0.05, tokens=10) as mock, tempfile.TemporaryDirectory() as tmp:
+        def ask(cache, query: str, agent=None):
+            agent = agent or RepositorySearchAgent(api_key="sk-mock", response_cache=cache)
+            agent.client = OpenAI(api_key="sk-mock", base_url=mock.base_url)
+            agent.search_and_respond(query)
+            return agent
+
+        path = os.path.join(tmp, "responses.sqlite3")
+        cache = ResponseCache(path=path)
+        ask(cache, "¿Cuánto es el preaviso?")
+        ask(cache, "cuanto es el PREAVISO")               # same normalized query: hit
+        agent = ask(cache, "¿Cuánto es el preaviso?")     # hit
+        ask(cache, "¿Y si renuncio?", agent)              # new question: miss
+        ask(cache, "¿Cuánto es el preaviso?", agent)      # longer history: miss
+        assert mock.requests == 3 and cache.hits == 2, (mock.requests, cache.stats())
+        assert len(agent.conversation_history) == 7
+
+        # Another knowledge base version: every older entry is dropped
+        key = next(iter(cache._entries))
+        assert cache.get(key, "another-fingerprint") is None and not cache._entries
+        ask(cache, "¿Cuánto es el preaviso?")             # miss (stored again)
+        assert mock.requests == 4
+        cache.close()
+
+        # Persisted: a new process answers from the SQLite file
+        reopened = ResponseCache(path=path)
+        ask(reopened, "¿Cuánto es el preaviso?")
+        assert mock.requests == 4 and reopened.hits == 1, reopened.stats()
+        reopened.close()
+
+        # A hot reload right after retrieval: the turn and the cache entry keep the
+        # fingerprint of the snapshot the articles came from
+        cache = ResponseCache(path=os.path.join(tmp, "reload.sqlite3"))
+        agent = RepositorySearchAgent(api_key="sk-mock", response_cache=cache)
+        agent.client = OpenAI(api_key="sk-mock", base_url=mock.base_url)
+        retrieved_from = agent.kb.fingerprint
+        build = agent._build_user_message
+
+        def build_then_reload(query):
+            built = build(query)
+            agent._kb_holder = type("Reloaded", (), {"get": lambda self: type("KB", (), {"fingerprint": "new"})()})()
+            return built
+
+        agent._build_user_message = build_then_reload
+        agent.search_and_respond("¿Cuánto es el preaviso?")
+        assert agent.conversation.turns[-1].fingerprint == retrieved_from
+        assert [entry[0] for entry in cache._entries.values()] == [retrieved_from], cache._entries
+        cache.close()
+
+    # Async streams read and write the cache in a worker thread: a slow disk
+    # does not stall the other streams of the event loop
+    import asyncio
+    import time
+    from agents.conversation import Conversation
+    from agents.llm import astream_reply
+
+    class SlowSlot:
+        def get(self):
+            time.sleep(0.3)
+            return "respuesta en caché"
+
+    async def stream_while_ticking():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.02)
+                ticks += 1
+
+        ticker = asyncio.create_task(tick())
+        parts = [d async for d in astream_reply(None, Conversation("sistema"), "¿preaviso?", cache=SlowSlot())]
+        ticker.cancel()
+        return parts, ticks
+
+    parts, ticks = asyncio.run(stream_while_ticking())
+    assert parts == ["respuesta en caché"] and ticks >= 5, (parts, ticks)
+    print(f"   ✅ 4 model calls for 7 questions (normalized query + article ids + history window)")
+    print(f"   ✅ Entries dropped on a KB change, persisted across processes in SQLite")
+    print(f"   ✅ Async streams keep the event loop running during cache I/O ({ticks} ticks in 0.3 s)")
+
+
+def run_embedding_batches_test():
+    """ingest.py's batcher: bounded batches, input order kept, 429s retried, RPM/TPM pacing."""
+    import time
+    from openai import OpenAI
+    from agents.mock_openai import MockOpenAIServer
+
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts", "python"))
+    from embedding_batches import BatchEmbedder, RateLimiter, estimate_tokens, iter_batches
+
+    texts = [f"Artículo {i}. " + "plazo de prescripción " * (i % 7 + 1) for i in range(300)]
+    batches = list(iter_batches(texts, batch_size=50, batch_tokens=1000))
+    assert sorted(i for batch in batches for i in batch) == list(range(len(texts)))
+    assert all(len(b) <= 50 and sum(estimate_tokens(texts[i]) for i in b) <= 1000 for b in batches)
+
+    with MockOpenAIServer(ttft=0.01, embedding_dim=8, fail_every=3) as mock:
+        embedder = BatchEmbedder(
+            OpenAI(api_key="sk-mock", base_url=mock.base_url),
+            batch_size=50, batch_tokens=1000, concurrency=4, verbose=False,
+        )
+        done = []
+        vectors = embedder.embed(texts, progress=done.append)
+        # Same text, same mock vector: results are in input order
+        expected = BatchEmbedder(OpenAI(api_key="sk-mock", base_url=mock.base_url), verbose=False)
+        assert expected.embed([texts[123]])[0] == vectors[123]
+    assert all(v is not None for v in vectors) and embedder.retries and not embedder.failed
+    assert sum(done) == len(texts), done
+    print(f"   ✅ {len(texts)} chunks in {len(batches)} batches, {embedder.retries} 429s retried")
+
+    # One input over the context limit: the batch is split down to it, the rest is embedded
+    texts[57] = "1.2.3. " * 3000
+    with MockOpenAIServer(ttft=0.0, embedding_dim=8, max_input_chars=10_000) as mock:
+        embedder = BatchEmbedder(
+            OpenAI(api_key="sk-mock", base_url=mock.base_url), batch_size=50, concurrency=4, verbose=False,
+        )
+        vectors = embedder.embed(texts)
+    lost = [i for i, v in enumerate(vectors) if v is None]
+    assert lost == [57] and embedder.failed == 1 and embedder.splits, (lost, embedder.splits)
+    print(f"   ✅ 400 on one oversized input: {embedder.splits} splits, only that chunk lost")
+
+    # 6,000 tokens/minute = 100/s: once the bucket is spent, 50 tokens wait ~0.5 s
+    limiter = RateLimiter(requests_per_minute=0, tokens_per_minute=6000)
+    limiter.acquire(6000)
+    start = time.perf_counter()
+    limiter.acquire(50)
+    elapsed = time.perf_counter() - start
+    assert 0.4 < elapsed < 1.5 and limiter.waited, elapsed
+    print(f"   ✅ Rate limiter: waited {elapsed:.2f} s for 50 tokens at 6,000 TPM")
+
+
+def run_embedding_cache_test():
+    """Embeddings are requested once per distinct text, across runs and processes."""
+    import tempfile
+    from openai import OpenAI
+    from agents.embedding_cache import EmbeddingCache
+    from agents.mock_openai import MockOpenAIServer
+
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts", "python"))
+    from embedding_batches import BatchEmbedder
+
+    texts = [f"Artículo {i}. Prescripción de la acción." for i in range(40)]
+    with MockOpenAIServer(ttft=0.0, embedding_dim=16) as mock, tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "embeddings.sqlite3")
+
+        def embed(cache, batch):
+            client = OpenAI(api_key="sk-mock", base_url=mock.base_url)
+            return BatchEmbedder(client, batch_size=10, cache=cache, verbose=False).embed(batch)
+
+        cache = EmbeddingCache(path)
+        first = embed(cache, texts + texts[:10])          # duplicates requested once
+        assert mock.requests == 4 and first[40] == first[0], mock.requests
+        cache.close()
+
+        reopened = EmbeddingCache(path)                   # a later run (another process)
+        assert embed(reopened, texts) == first[:40] and mock.requests == 4
+        assert reopened.hits == 40 and reopened.misses == 0, reopened.stats()
+
+        # Long texts are cached under their clipped input: a new clip limit re-embeds them
+        import embedding_batches
+        long_text = "Artículo 1. " + "plazo " * 4000
+        embed(reopened, [long_text])
+        assert mock.requests == 5 and embed(reopened, [long_text]) and mock.requests == 5
+        previous_limit = embedding_batches.MAX_INPUT_CHARS
+        embedding_batches.MAX_INPUT_CHARS = previous_limit // 2
+        try:
+            embed(reopened, [long_text])
+        finally:
+            embedding_batches.MAX_INPUT_CHARS = previous_limit
+        assert mock.requests == 6, mock.requests
+        reopened.close()
+
+        # 16 float32 = 64 bytes per vector: a 2 kB bound evicts from the older run
+        small = EmbeddingCache(os.path.join(tmp, "small.sqlite3"), max_bytes=2048)
+        embed(small, texts[:20])
+        embed(small, texts[20:])
+        stats = small.stats()
+        assert stats["bytes"] <= 2048 and stats["evictions"] == 40 - stats["entries"], stats
+        assert None not in small.get_many("text-embedding-3-small", None, texts[20:])
+        small.close()
+    print(f"   ✅ 50 texts → 4 requests; a second run: 40/40 hits, 0 requests")
+    print(f"   ✅ 2 kB bound: {stats['evictions']} least recently used vectors evicted, {stats['entries']} kept")
+
+
+def run_pgvector_copy_test():
+    """ingest.py's COPY rows: text fields, NULLs and pgvector's binary vectors."""
+    import struct
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts", "python"))
+    from pgvector_writer import COPY_HEADER, clean_text, copy_binary
+
+    vector = [0.5, -1.25, 3.0]
+    payload = copy_binary([("Código Penal", None, clean_text("Artículo 1\x00"), vector)])
+    assert payload.startswith(COPY_HEADER) and payload.endswith(struct.pack("!h", -1))
+    view = memoryview(payload)[len(COPY_HEADER):]
+    assert struct.unpack_from("!h", view)[0] == 4
+    text = "Código Penal".encode("utf-8")
+    assert struct.unpack_from(f"!i{len(text)}s", view, 2) == (len(text), text)
+    offset = 2 + 4 + len(text)
+    assert struct.unpack_from("!i", view, offset)[0] == -1                    # NULL
+    offset += 4
+    assert struct.unpack_from("!i11s", view, offset) == (11, b"Art\xc3\xadculo 1")  # NUL removed
+    offset += 4 + 11
+    assert struct.unpack_from("!ihh3f", view, offset) == (4 + 12, 3, 0, *vector)
+    print(f"   ✅ Text, NULL and vector fields encoded as COPY BINARY expects ({len(payload)} bytes)")
+
+
+
+class _StubConnection:
+    """psycopg2-like connection that records statements; ``stored`` maps archivo -> its hashes."""
+
+    def __init__(self, stored=None, rowcount=0):
+        self.stored = stored or {}
+        self.rowcount = rowcount
+        self.statements = []
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self):
+        return _StubCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+class _StubCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount = conn.rowcount
+        self._params = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, sql, params=None):
+        self.conn.statements.append((sql, params))
+        self._params = params
+
+    def copy_expert(self, sql, payload):
+        self.conn.statements.append((sql, payload.read()))
+
+    def fetchall(self):
+        return [(h,) for h in self.conn.stored.get(self._params[0], ())]
+
+
+def run_incremental_sync_test():
+    """ingest.py's incremental sync: hashes, new/vanished sets, upserts, deletes gated on a complete write."""
+    from openai import OpenAI
+    from agents.mock_openai import MockOpenAIServer
+
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts", "python"))
+    from embedding_batches import BatchEmbedder
+    from pgvector_writer import (
+        CHUNK_KEY, BulkWriter, chunk_hash, chunk_rows, delete_chunks, plan_sync, sync_complete,
+    )
+
+    chunks = [{"articulo": f"Artículo {i}", "contenido": f"Artículo {i}. Texto {i}"} for i in range(3)]
+    h = [chunk_hash(chunk, "penal", "v1", "model") for chunk in chunks]
+    assert h[0] == chunk_hash(dict(chunks[0]), "penal", "v1", "model") and len(set(h)) == 3
+    assert h[0] not in {
+        chunk_hash(chunks[0], "penal", "v2", "model"), chunk_hash(chunks[0], "penal", "v1", "other"),
+        chunk_hash(chunks[0], "civil", "v1", "model"),
+        chunk_hash({**chunks[0], "contenido": "Artículo 0. Texto 0 reformado"}, "penal", "v1", "model"),
+    }
+
+    # Stored: chunk 0 and one that left the source; chunks 1 and 2 are new
+    conn = _StubConnection(stored={"cp.txt": {h[0], "gone"}})
+    nuevos, eliminados = plan_sync(conn, "cp.txt", dict(zip(h, chunks)))
+    assert list(nuevos) == h[1:] and eliminados == {"gone"}
+
+    # A failed vector drops its row, and the sync is incomplete (nothing may be deleted)
+    rows = chunk_rows("Código Penal", "penal", "cp.txt", nuevos, [[0.1, 0.2], None])
+    assert [row[5] for row in rows] == [h[1]] and not sync_complete(nuevos, rows, None)
+    rows = chunk_rows("Código Penal", "penal", "cp.txt", nuevos, [[0.1, 0.2], [0.3, 0.4]])
+    assert sync_complete(nuevos, rows, None)
+
+    # COPY with conflicts: staged, then INSERT ... SELECT ... ON CONFLICT DO NOTHING (1 of 2 new)
+    conn = _StubConnection(rowcount=1)
+    writer = BulkWriter(conn, conflict_columns=CHUNK_KEY, verbose=False)
+    assert writer.write(rows) == 1 and writer.skipped == 1 and conn.commits == 1
+    create, copy, insert = (sql for sql, _ in conn.statements)
+    assert create.startswith("CREATE TEMP TABLE IF NOT EXISTS _staging_documents")
+    assert copy.startswith("COPY _staging_documents (fuente,") and "FORMAT BINARY" in copy
+    assert insert.startswith("INSERT INTO documents (") and "FROM _staging_documents" in insert
+    assert insert.endswith("ON CONFLICT (archivo, hash_contenido) DO NOTHING")
+    writer.failed = 1
+    assert not sync_complete(nuevos, rows, writer)
+
+    # The delete: vanished hashes of this file, plus the fuente's pre-hash rows
+    conn = _StubConnection(rowcount=4)
+    assert delete_chunks(conn, "Código Penal", "cp.txt", eliminados) == 4
+    sql, params = conn.statements[0]
+    assert "(archivo = %s AND hash_contenido = ANY(%s))" in sql and "(fuente = %s AND hash_contenido IS NULL)" in sql
+    assert params == ("cp.txt", ["gone"], "Código Penal")
+
+    # A bad key (401) is not an exception: every vector comes back None and the sync is incomplete
+    with MockOpenAIServer(ttft=0.0, embedding_dim=8, fail_every=1, fail_status=401) as mock:
+        embedder = BatchEmbedder(OpenAI(api_key="sk-bad", base_url=mock.base_url), verbose=False)
+        vectors = embedder.embed([chunk["contenido"] for chunk in nuevos.values()])
+    rows = chunk_rows("Código Penal", "penal", "cp.txt", nuevos, vectors)
+    assert vectors == [None, None] and embedder.failed == 2 and not sync_complete(nuevos, rows, None)
+    print(f"   ✅ Stable hashes, new/vanished sets, staged upsert; no delete after failed embeddings (401)")
+
+
+
+def _prepare_lines(file_path, materia):
+    """run_manifest's ``prepare`` for tests: one chunk per line."""
+    from pgvector_writer import chunk_hash
+
+    with open(file_path, encoding="utf-8") as f:
+        chunks = [{"articulo": line.split(".")[0], "contenido": line.strip()} for line in f if line.strip()]
+    return len(chunks), {chunk_hash(chunk, materia, "test", "model"): chunk for chunk in chunks}
+
+
+class _StubPool:
+    """ThreadedConnectionPool stand-in: the same connection, or an error past ``max_conns``."""
+
+    def __init__(self, conn, max_conns=2):
+        self.conn = conn
+        self.max_conns = max_conns
+        self.handed = 0
+
+    def getconn(self):
+        self.handed += 1
+        if self.handed > self.max_conns:
+            raise ConnectionError("connection refused")
+        return self.conn
+
+    def putconn(self, conn):
+        pass
+
+
+class _FakeWriter:
+    def __init__(self, written):
+        self.written = written
+        self.skipped = 0
+        self.failed = 0
+
+    def write(self, rows):
+        self.written.extend(rows)
+        return len(rows)
+
+
+def run_manifest_test():
+    """--manifest: entries, and the pipeline's ordering and error accounting (mock API, fake writer)."""
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+    from openai import OpenAI
+    from agents.mock_openai import MockOpenAIServer
+
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts", "python"))
+    from embedding_batches import BatchEmbedder
+    from ingest_manifest import ManifestProgress, load_manifest, run_manifest
+
+    with tempfile.TemporaryDirectory() as tmp:
+        def manifest(text):
+            path = os.path.join(tmp, "laws.yaml")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+            return path
+
+        entries = "- {file: docs/a.txt, fuente: Ley A, materia: civil}\n"
+        listed = load_manifest(manifest(entries))
+        assert listed == load_manifest(manifest("documents:\n  " + entries.replace("\n", "\n  ")))
+        assert listed == [{"file": os.path.join(tmp, "docs", "a.txt"), "archivo": "a.txt",
+                           "fuente": "Ley A", "materia": "civil"}]
+        for bad, message in [
+            ("- {file: a.txt, fuente: Ley A}\n", "no tiene: materia"),
+            (entries + "- {file: otros/a.txt, fuente: Ley B, materia: penal}\n", "'a.txt'"),
+            ("- docs/a.txt\n", "no es un objeto"),
+        ]:
+            try:
+                load_manifest(manifest(bad))
+                raise AssertionError(f"accepted: {bad!r}")
+            except ValueError as e:
+                assert message in str(e), e
+
+        # a.txt is complete; b.txt has one input over the context limit; c.txt does not exist
+        os.makedirs(os.path.join(tmp, "docs"))
+        for name, lines in [("a", ["Artículo 1. Plazo.", "Artículo 2. Pena."]),
+                            ("b", ["Artículo 1. Multa.", "Artículo 2. " + "tabla " * 200])]:
+            with open(os.path.join(tmp, "docs", f"{name}.txt"), "w", encoding="utf-8") as f:
+                f.write("\n".join(lines))
+        docs = load_manifest(manifest("".join(
+            f"- {{file: docs/{name}.txt, fuente: Ley {name}, materia: civil}}\n" for name in "abc"
+        )))
+
+        with MockOpenAIServer(ttft=0.0, embedding_dim=8, max_input_chars=500) as mock:
+            embedder = BatchEmbedder(OpenAI(api_key="sk-mock", base_url=mock.base_url), verbose=False)
+            conn = _StubConnection(stored={"a.txt": {"gone-a"}, "b.txt": {"gone-b"}}, rowcount=1)
+            written = []
+            progress = run_manifest(docs, _prepare_lines, _StubPool(conn), embedder,
+                                    lambda c: _FakeWriter(written), extract_executor=ThreadPoolExecutor,
+                                    progress=ManifestProgress(len(docs), verbose=False))
+            c = progress.counts
+            assert (c["extraidos"], c["listos"], c["errores"]) == (3, 3, 2), c
+            assert c["chunks"] == c["embebidos"] == 4 and c["escritos"] == len(written) == 3, c
+            # Only the complete file's stale chunks are deleted
+            deletes = [params for sql, params in conn.statements if sql.startswith("DELETE")]
+            assert deletes == [("a.txt", ["gone-a"], "Ley a")] and c["eliminados"] == 1, deletes
+            events = progress.events
+            planned = events.index("a.txt: 2 chunks, 2 nuevos o modificados, 0 sin cambios")
+            assert planned < events.index("a.txt: 2 escritos, 1 eliminados")
+            assert any(e.startswith("❌ b.txt: 1 de 2 chunks") for e in events)
+            assert any(e.startswith("❌ Error extrayendo c.txt") for e in events)
+
+            # The writer gets no connection: every document fails, nothing hangs
+            progress = run_manifest(docs[:2], _prepare_lines, _StubPool(_StubConnection(), max_conns=1),
+                                    embedder, lambda c: _FakeWriter([]), extract_executor=ThreadPoolExecutor,
+                                    progress=ManifestProgress(2, verbose=False))
+            assert (progress.counts["listos"], progress.counts["errores"]) == (2, 2), progress.counts
+    print(f"   ✅ Manifest forms and errors; 3 files → 1 complete, 1 partial (kept), 1 missing; no hang without DB")
+
+
 def main():
     if len(sys.argv) < 2:
         show_help()
@@ -98,6 +994,28 @@ def main():
     elif command == "test":
         run_test()
     
+    elif command == "bench":
+        from agents.benchmarks import run as run_benchmarks
+        run_benchmarks(sys.argv[2:])
+    
+    elif command == "embed":
+        from agents.legal_knowledge_base import get_knowledge_base
+        provider = sys.argv[2] if len(sys.argv) > 2 else None
+        get_knowledge_base().build_embeddings(provider)
+        print("✅ Embeddings ready")
+    
+    elif command == "serve":
+        import argparse
+        from agents.server import DEFAULT_PORT, DEFAULT_QUEUE, DEFAULT_WORKERS, serve
+        parser = argparse.ArgumentParser(prog="run_agents.py serve")
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+        parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="requests answered at once")
+        parser.add_argument("--queue", type=int, default=DEFAULT_QUEUE, help="requests waiting beyond that (then 429)")
+        parser.add_argument("--cache", default="", help='response cache: "memory" or a SQLite file path')
+        args = parser.parse_args(sys.argv[2:])
+        serve(args.host, args.port, args.workers, args.queue, args.cache)
+    
     elif command in ("help", "--help", "-h"):
         show_help()
     
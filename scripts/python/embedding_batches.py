@@ -0,0 +1,273 @@
+"""
+Embedding Batches - Batched, concurrent embedding requests for ingestion.
+
+ingest.py used to request one embedding per chunk, so a single code meant
+thousands of serial HTTP round-trips. The embeddings API accepts a list of
+inputs, so BatchEmbedder:
+
+- groups chunks into batches bounded by item count (``batch_size``) and by
+  estimated tokens (``batch_tokens``; the API caps a request at 300k tokens),
+- keeps up to ``concurrency`` batches in flight on a thread pool sharing one
+  HTTP connection pool,
+- retries a batch on 429, 5xx, timeouts and connection errors, with
+  exponential backoff and jitter (or the server's Retry-After),
+- splits a batch rejected with 400 (e.g. one input over the model's token
+  limit) in halves, down to the offending input, so only that chunk is lost,
+- optionally paces requests with a RateLimiter (requests and tokens per
+  minute, the API's RPM/TPM limits).
+
+One BatchEmbedder can be shared by several threads (e.g. one per file in
+the --manifest driver): ``concurrency`` and the rate limit then apply to all
+of them together.
+
+A batch that still fails after ``max_retries`` leaves its vectors as None;
+the other batches are unaffected.
+
+With an EmbeddingCache (agents/embedding_cache.py), cached texts are not
+requested again and only the distinct missing texts are batched.
+
+Usage:
+    embedder = BatchEmbedder(client, concurrency=4)
+    vectors = embedder.embed(texts)          # same order as texts
+"""
+
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Iterator, Optional
+
+import openai
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+DEFAULT_BATCH_SIZE = 128
+DEFAULT_BATCH_TOKENS = 100_000
+DEFAULT_CONCURRENCY = 4
+DEFAULT_MAX_RETRIES = 6
+# text-embedding-3-small limits of the lowest paid tier (0 = unlimited)
+DEFAULT_RPM = 3000
+DEFAULT_TPM = 1_000_000
+# The model's input limit is 8191 tokens; longer chunks are truncated for
+# embedding (the stored content stays whole). Legal prose averages ~4 chars
+# per token, but numbering, tables and symbols come close to 1, so the cut
+# assumes 2; an input still over the limit is isolated by splitting on 400.
+MAX_INPUT_TOKENS = 8000
+MAX_INPUT_CHARS = MAX_INPUT_TOKENS * 2
+
+RETRY_STATUS = {408, 409, 429}
+MAX_BACKOFF_S = 60.0
+
+
+def estimate_tokens(text: str) -> int:
+    """Upper-bound token estimate (Spanish legal text averages ~4 chars per token)."""
+    return len(text) // 3 + 1
+
+
+def clip_input(text: str) -> str:
+    """``text`` cut to MAX_INPUT_CHARS; never empty."""
+    return text[:MAX_INPUT_CHARS] or " "
+
+
+def iter_batches(texts: list[str], batch_size: int, batch_tokens: int) -> Iterator[list[int]]:
+    """Indices of ``texts`` grouped into batches of at most ``batch_size`` items and ``batch_tokens`` tokens."""
+    batch, tokens = [], 0
+    for i, text in enumerate(texts):
+        cost = estimate_tokens(clip_input(text))
+        if batch and (len(batch) >= batch_size or tokens + cost > batch_tokens):
+            yield batch
+            batch, tokens = [], 0
+        batch.append(i)
+        tokens += cost
+    if batch:
+        yield batch
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    status = getattr(error, "status_code", None)
+    return status is not None and (status in RETRY_STATUS or status >= 500)
+
+
+def retry_delay(error: Exception, attempt: int, backoff: float) -> float:
+    """Seconds to wait before retry ``attempt`` (Retry-After when the server sent one)."""
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after is not None:
+        try:
+            return min(float(retry_after), MAX_BACKOFF_S)
+        except ValueError:
+            pass
+    return min(backoff * 2 ** attempt, MAX_BACKOFF_S) * random.uniform(0.5, 1.0)
+
+
+class RateLimiter:
+    """Token buckets for requests per minute and tokens per minute (0 disables a limit)."""
+
+    def __init__(self, requests_per_minute: float = DEFAULT_RPM, tokens_per_minute: float = DEFAULT_TPM):
+        self.rpm = requests_per_minute
+        self.tpm = tokens_per_minute
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.waited = 0.0
+
+    def acquire(self, tokens: int):
+        """Block until one request of ``tokens`` tokens fits in both budgets."""
+        if self.tpm:
+            tokens = min(tokens, self.tpm)  # a request larger than the bucket waits for a full one
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                elapsed, self._updated = now - self._updated, now
+                if self.rpm:
+                    self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+                if self.tpm:
+                    self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+                wait = 0.0
+                if self.rpm and self._requests < 1:
+                    wait = (1 - self._requests) * 60 / self.rpm
+                if self.tpm and self._tokens < tokens:
+                    wait = max(wait, (tokens - self._tokens) * 60 / self.tpm)
+                if wait == 0.0:
+                    self._requests -= 1
+                    self._tokens -= tokens
+                    return
+                self.waited += wait
+            time.sleep(wait)
+
+
+class BatchEmbedder:
+    """Embeds lists of texts in concurrent, size-bounded batches with retries."""
+
+    def __init__(
+        self,
+        client,
+        model: str = EMBEDDING_MODEL,
+        dimensions: Optional[int] = None,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        batch_tokens: int = DEFAULT_BATCH_TOKENS,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        backoff: float = 1.0,
+        cache=None,
+        rate_limiter: Optional[RateLimiter] = None,
+        verbose: bool = True,
+    ):
+        # Retries are ours (logged and counted), not the client's
+        self.client = client.with_options(max_retries=0)
+        self.model = model
+        self.dimensions = dimensions
+        self.batch_size = max(1, batch_size)
+        self.batch_tokens = batch_tokens
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        self.verbose = verbose
+        # Requests in flight across every thread using this embedder
+        self._in_flight = threading.Semaphore(self.concurrency)
+        # Counters
+        self.requests = 0
+        self.retries = 0
+        self.splits = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+
+    def embed(
+        self,
+        texts: list[str],
+        progress: Optional[Callable[[int], None]] = None,
+    ) -> list[Optional[list[float]]]:
+        """
+        Vectors of ``texts``, in order (None for the chunks of failed batches).
+        ``progress`` is called with the number of chunks each finished batch
+        covered (cache hits are reported at the end).
+        """
+        if self.cache is None:
+            return self._embed_uncached(texts, progress)
+        # Keyed by the input actually sent: vectors cached under another
+        # clip limit are not served for a differently clipped text
+        inputs = [clip_input(t) for t in texts]
+        requested = []
+
+        def compute(missing: list[str]) -> list[Optional[list[float]]]:
+            requested.append(len(missing))
+            return self._embed_uncached(missing, progress)
+
+        vectors = self.cache.embed(inputs, self.model, self.dimensions, compute)
+        if progress:
+            progress(len(texts) - sum(requested))
+        return vectors
+
+    def _embed_uncached(
+        self,
+        texts: list[str],
+        progress: Optional[Callable[[int], None]] = None,
+    ) -> list[Optional[list[float]]]:
+        vectors: list[Optional[list[float]]] = [None] * len(texts)
+        batches = list(iter_batches(texts, self.batch_size, self.batch_tokens))
+        if not batches:
+            return vectors
+
+        start, done = time.perf_counter(), 0
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="embed") as pool:
+            futures = {pool.submit(self._embed_batch, [texts[i] for i in batch]): batch for batch in batches}
+            for future in as_completed(futures):
+                batch = futures[future]
+                try:
+                    for i, vector in zip(batch, future.result()):
+                        vectors[i] = vector
+                except Exception as e:
+                    with self._lock:
+                        self.failed += len(batch)
+                    print(f"Error generando embeddings de {len(batch)} chunks: {e}")
+                done += len(batch)
+                if progress:
+                    progress(len(batch))
+                if self.verbose:
+                    rate = done / max(time.perf_counter() - start, 1e-9)
+                    print(f"Embeddings: {done}/{len(texts)} chunks ({rate:.0f} chunks/s)")
+        return vectors
+
+    def _embed_batch(self, texts: list[str]) -> list[Optional[list[float]]]:
+        """Vectors of ``texts``; a batch rejected with 400 is split until the bad input is alone (None)."""
+        try:
+            return self._request(texts)
+        except openai.BadRequestError as e:
+            if len(texts) == 1:
+                with self._lock:
+                    self.failed += 1
+                print(f"Error generando el embedding de un chunk ({len(texts[0])} caracteres): {e}")
+                return [None]
+            with self._lock:
+                self.splits += 1
+            if self.verbose:
+                print(f"Lote de {len(texts)} chunks rechazado (400); dividiéndolo en dos")
+            half = len(texts) // 2
+            return self._embed_batch(texts[:half]) + self._embed_batch(texts[half:])
+
+    def _request(self, texts: list[str]) -> list[list[float]]:
+        params = {"dimensions": self.dimensions} if self.dimensions else {}
+        inputs = [clip_input(t) for t in texts]
+        tokens = sum(estimate_tokens(t) for t in inputs)
+        for attempt in range(self.max_retries + 1):
+            with self._lock:
+                self.requests += 1
+            try:
+                with self._in_flight:
+                    if self.rate_limiter is not None:
+                        self.rate_limiter.acquire(tokens)
+                    response = self.client.embeddings.create(model=self.model, input=inputs, **params)
+                return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    raise
+                delay = retry_delay(e, attempt, self.backoff)
+                with self._lock:
+                    self.retries += 1
+                if self.verbose:
+                    print(f"Reintentando lote de {len(texts)} chunks en {delay:.1f} s ({e.__class__.__name__})")
+                time.sleep(delay)
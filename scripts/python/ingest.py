@@ -1,12 +1,29 @@
 import os
 import re
 import argparse
+import sys
 import psycopg2
+import psycopg2.pool
 from openai import OpenAI
 from pypdf import PdfReader
 import striprtf.striprtf
 import docx
 import httpx
+from embedding_batches import (
+    DEFAULT_BATCH_SIZE, DEFAULT_BATCH_TOKENS, DEFAULT_CONCURRENCY, DEFAULT_RPM, DEFAULT_TPM, EMBEDDING_MODEL,
+    BatchEmbedder, RateLimiter,
+)
+from pgvector_writer import (
+    CHUNK_KEY, DEFAULT_COMMIT_EVERY, METHODS, BulkWriter, chunk_hash, chunk_rows, delete_chunks, ensure_schema,
+    plan_sync, sync_complete,
+)
+from ingest_manifest import load_manifest, run_manifest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../..'))
+from agents.embedding_cache import get_embedding_cache
+
+# Cambiar cuando cambie parse_articles: invalida los hashes y re-ingiere todo
+CHUNKER_VERSION = "articulos-v1"
 
 def load_env():
     env_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../.env')
@@ -32,13 +49,6 @@ def get_db_connection():
         raise ValueError("DATABASE_URL no está configurada en las variables de entorno.")
     return psycopg2.connect(DB_URL)
 
-def get_embedding(text):
-    response = client.embeddings.create(
-        model="text-embedding-3-small",
-        input=text
-    )
-    return response.data[0].embedding
-
 def extract_text_from_pdf(pdf_path):
     text = ""
     with open(pdf_path, 'rb') as file:
@@ -80,57 +90,163 @@ def parse_articles(text):
         
     return chunks
 
-def ingest_document(file_path, fuente, materia):
-    print(f"Iniciando ingesta de: {file_path}")
-    print(f"Fuente: {fuente} | Materia: {materia}")
-    
+def extract_text(file_path):
     ext = os.path.splitext(file_path)[1].lower()
     
     if ext == '.pdf':
-        text = extract_text_from_pdf(file_path)
+        return extract_text_from_pdf(file_path)
     elif ext == '.rtf':
         with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-            text = striprtf.striprtf.rtf_to_text(f.read())
+            return striprtf.striprtf.rtf_to_text(f.read())
     elif ext == '.docx':
         doc = docx.Document(file_path)
-        text = "\n".join([paragraph.text for paragraph in doc.paragraphs])
+        return "\n".join([paragraph.text for paragraph in doc.paragraphs])
     else:
         with open(file_path, 'r', encoding='utf-8') as f:
-            text = f.read()
+            return f.read()
 
-    chunks = parse_articles(text)
-    print(f"Se generaron {len(chunks)} chunks mediante partición por artículos.")
-    
+def prepare_chunks(file_path, materia):
+    """
+    Extrae, parte y hashea un archivo: (chunks generados, {hash: chunk} sin duplicados).
+    En el modo --manifest corre en los procesos de extracción.
+    """
+    chunks = parse_articles(extract_text(file_path))
+    generated = len(chunks)
+    unique_chunks = {}
+    for chunk in chunks:
+        if chunk["contenido"] and len(chunk["contenido"].strip()) >= 10:
+            unique_chunks.setdefault(chunk_hash(chunk, materia, CHUNKER_VERSION, EMBEDDING_MODEL), chunk)
+    return generated, unique_chunks
+
+def make_embedder(batch_size=DEFAULT_BATCH_SIZE, batch_tokens=DEFAULT_BATCH_TOKENS,
+                  concurrency=DEFAULT_CONCURRENCY, rpm=DEFAULT_RPM, tpm=DEFAULT_TPM, verbose=True):
+    rate_limiter = RateLimiter(rpm, tpm) if rpm or tpm else None
+    return BatchEmbedder(client, batch_size=batch_size, batch_tokens=batch_tokens, concurrency=concurrency,
+                         cache=get_embedding_cache(), rate_limiter=rate_limiter, verbose=verbose)
+
+def ingest_document(file_path, fuente, materia, batch_size=DEFAULT_BATCH_SIZE,
+                    batch_tokens=DEFAULT_BATCH_TOKENS, concurrency=DEFAULT_CONCURRENCY,
+                    write_method="copy", commit_every=DEFAULT_COMMIT_EVERY,
+                    rpm=DEFAULT_RPM, tpm=DEFAULT_TPM):
+    print(f"Iniciando ingesta de: {file_path}")
+    print(f"Fuente: {fuente} | Materia: {materia}")
+
+    generated, unique_chunks = prepare_chunks(file_path, materia)
+    print(f"Se generaron {generated} chunks mediante partición por artículos.")
+
+    # Ingesta incremental: cada chunk se identifica por archivo + hash de contenido
+    archivo = os.path.basename(file_path)
     conn = get_db_connection()
-    cur = conn.cursor()
-    
-    inserted = 0
-    for i, chunk in enumerate(chunks):
-        contenido = chunk["contenido"]
-        if not contenido or len(contenido.strip()) < 10:
-            continue
-            
-        print(f"Generando vector embedding y procesando artículo {i+1}/{len(chunks)}...")
-        try:
-            embedding = get_embedding(contenido)
-            cur.execute("""
-                INSERT INTO documents (fuente, materia, articulo, contenido, embedding)
-                VALUES (%s, %s, %s, %s, %s)
-            """, (fuente, materia, chunk["articulo"], contenido, embedding))
-            inserted += 1
-        except Exception as e:
-            print(f"Error procesando el chunk {chunk['articulo']}: {e}")
-            
-    conn.commit()
-    cur.close()
-    conn.close()
-    print(f"\n¡Éxito! Se insertaron {inserted} registros/chunks en la base de datos (pgvector).")
+    try:
+        ensure_schema(conn)
+        nuevos, eliminados = plan_sync(conn, archivo, unique_chunks)
+        print(f"{len(unique_chunks) - len(nuevos)} chunks sin cambios, {len(nuevos)} nuevos o modificados, "
+              f"{len(eliminados)} ya no están en la fuente.")
+
+        inserted = 0
+        rows, writer = [], None
+        if nuevos:
+            # Embeddings en lotes concurrentes (una petición por lote, no por artículo)
+            print(f"Generando embeddings en lotes de hasta {batch_size} chunks ({concurrency} en paralelo)...")
+            embedder = make_embedder(batch_size, batch_tokens, concurrency, rpm, tpm)
+            embeddings = embedder.embed([chunk["contenido"] for chunk in nuevos.values()])
+            if embedder.cache is not None:
+                print(embedder.cache.summary())
+
+            # Escritura en bloque (COPY binario o execute_values), con commit por lote
+            rows = chunk_rows(fuente, materia, archivo, nuevos, embeddings)
+            writer = BulkWriter(conn, method=write_method, commit_every=commit_every, conflict_columns=CHUNK_KEY)
+            inserted = writer.write(rows, total=len(rows))
+
+        # Chunks que desaparecieron de la fuente (y filas anteriores a los hashes), solo si
+        # todo lo nuevo quedó escrito: si no, se conserva lo anterior y la próxima ejecución reintenta
+        complete = sync_complete(nuevos, rows, writer)
+        deleted = delete_chunks(conn, fuente, archivo, eliminados) if complete else 0
+    finally:
+        conn.close()
+    speed = f" a {writer.rows_per_second:.0f} registros/s" if writer else ""
+    if not complete:
+        missing = len(nuevos) - inserted - (writer.skipped if writer else 0)
+        print(f"\n❌ Ingesta incompleta: {missing} de {len(nuevos)} chunks quedaron sin embedding o sin escribir "
+              f"(se insertaron {inserted}{speed}). No se eliminó nada; vuelve a ejecutar la ingesta.")
+        return False
+    print(f"\n¡Éxito! Se insertaron {inserted} registros/chunks en la base de datos (pgvector){speed}; "
+          f"se eliminaron {deleted}.")
+    return True
+
+# ---------------------------------------------------------------------------
+# --manifest: varias leyes en paralelo
+# ---------------------------------------------------------------------------
+
+def ingest_manifest(manifest_path, workers=None, batch_size=DEFAULT_BATCH_SIZE,
+                    batch_tokens=DEFAULT_BATCH_TOKENS, concurrency=DEFAULT_CONCURRENCY,
+                    write_method="copy", commit_every=DEFAULT_COMMIT_EVERY,
+                    rpm=DEFAULT_RPM, tpm=DEFAULT_TPM):
+    """
+    Ingesta de todas las leyes del manifiesto como un pipeline (ver ingest_manifest.py):
+    extracción en un pool de procesos, embeddings por un único BatchEmbedder
+    compartido y un único escritor. Devuelve False si algún documento falló.
+    """
+    docs = load_manifest(manifest_path)
+    if not docs:
+        print(f"{manifest_path} no tiene documentos.")
+        return True
+    if not DB_URL:
+        raise ValueError("DATABASE_URL no está configurada en las variables de entorno.")
+    workers = workers or min(len(docs), os.cpu_count() or 1)
+    print(f"Ingesta de {len(docs)} documentos de {manifest_path}: {workers} procesos de extracción, "
+          f"{concurrency} peticiones de embeddings en paralelo, escritura por {write_method}.")
+
+    embedder = make_embedder(batch_size, batch_tokens, concurrency, rpm, tpm, verbose=False)
+    db_pool = psycopg2.pool.ThreadedConnectionPool(1, 2, DB_URL)
+    try:
+        progress = run_manifest(
+            docs, prepare_chunks, db_pool, embedder,
+            lambda conn: BulkWriter(conn, method=write_method, commit_every=commit_every,
+                                    conflict_columns=CHUNK_KEY, verbose=False),
+            workers=workers,
+        )
+    finally:
+        db_pool.closeall()
+
+    c = progress.counts
+    if c["errores"]:
+        print(f"\n❌ {c['errores']} de {len(docs)} documentos con errores (ver arriba); se conservaron sus "
+              f"registros anteriores. Se insertaron {c['escritos']} registros/chunks y se eliminaron "
+              f"{c['eliminados']}; vuelve a ejecutar la ingesta.")
+    else:
+        print(f"\n¡Éxito! {c['listos']} documentos: se insertaron {c['escritos']} registros/chunks "
+              f"y se eliminaron {c['eliminados']}.")
+    print(progress.summary())
+    if embedder.cache is not None:
+        print(embedder.cache.summary())
+    if embedder.rate_limiter is not None and embedder.rate_limiter.waited:
+        print(f"⏳ Límite de RPM/TPM: {embedder.rate_limiter.waited:.0f} s de espera acumulada")
+    return not c["errores"]
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Ingesta de legislación en formato text/PDF y generación de embeddings para RAG")
-    parser.add_argument("--file", required=True, help="Ruta al archivo PDF o TXT")
-    parser.add_argument("--fuente", required=True, help="Nombre de la fuente (Ej: Código Procesal Civil)")
-    parser.add_argument("--materia", required=True, help="Materia (civil, penal, laboral, administrativo, constitucional)")
+    parser.add_argument("--file", help="Ruta al archivo PDF o TXT")
+    parser.add_argument("--fuente", help="Nombre de la fuente (Ej: Código Procesal Civil)")
+    parser.add_argument("--materia", help="Materia (civil, penal, laboral, administrativo, constitucional)")
+    parser.add_argument("--manifest", help="Manifiesto YAML con varias leyes (Ej: laws.yaml), ingeridas en paralelo")
+    parser.add_argument("--workers", type=int, help="Procesos de extracción del --manifest (por defecto: uno por CPU)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Máximo de chunks por petición de embeddings")
+    parser.add_argument("--batch-tokens", type=int, default=DEFAULT_BATCH_TOKENS, help="Máximo de tokens (estimados) por petición de embeddings")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Peticiones de embeddings en paralelo")
+    parser.add_argument("--rpm", type=int, default=DEFAULT_RPM, help="Límite de peticiones de embeddings por minuto (0 = sin límite)")
+    parser.add_argument("--tpm", type=int, default=DEFAULT_TPM, help="Límite de tokens de embeddings por minuto (0 = sin límite)")
+    parser.add_argument("--write-method", choices=METHODS, default="copy", help="copy (COPY binario) o values (execute_values)")
+    parser.add_argument("--commit-every", type=int, default=DEFAULT_COMMIT_EVERY, help="Registros por lote/commit en la base de datos")
     
     args = parser.parse_args()
-    ingest_document(args.file, args.fuente, args.materia)
+    options = dict(batch_size=args.batch_size, batch_tokens=args.batch_tokens, concurrency=args.concurrency,
+                   write_method=args.write_method, commit_every=args.commit_every, rpm=args.rpm, tpm=args.tpm)
+    if args.manifest:
+        if not ingest_manifest(args.manifest, workers=args.workers, **options):
+            sys.exit(1)
+    elif args.file and args.fuente and args.materia:
+        if not ingest_document(args.file, args.fuente, args.materia, **options):
+            sys.exit(1)
+    else:
+        parser.error("usa --manifest, o --file junto con --fuente y --materia")
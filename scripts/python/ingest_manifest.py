@@ -0,0 +1,250 @@
+"""
+Ingest Manifest - Parallel ingestion of every law listed in laws.yaml.
+
+``ingest.py --manifest laws.yaml`` replaces the serial runs of ingest_all.sh
+with one pipeline whose stages overlap:
+
+    extraction   files are extracted, chunked and hashed in a process pool
+                 (one file per worker),
+    embeddings   new chunks of every file go through one shared
+                 BatchEmbedder (same concurrency, rate limit and cache),
+    writing      a single writer thread upserts rows and deletes stale chunks
+                 over a connection of a small pool.
+
+A file is done once its rows are written. A file whose extraction,
+embeddings or writes failed is reported as an error, and its stale rows are
+kept (see pgvector_writer.sync_complete); the other files carry on.
+ManifestProgress keeps the counters of all files, prints one progress line,
+and records each stage's wall time.
+
+Usage:
+    docs = load_manifest("laws.yaml")
+    progress = run_manifest(docs, prepare_chunks, db_pool, embedder, make_writer)
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Callable, Optional
+
+from pgvector_writer import chunk_rows, delete_chunks, ensure_schema, plan_sync, sync_complete
+
+MANIFEST_KEYS = ("file", "fuente", "materia")
+# Documents embedded and waiting for the writer; bounds memory when the database lags
+WRITE_QUEUE_SIZE = 2
+# Seconds between checks that the writer is still alive while the queue is full
+WRITER_CHECK_S = 1.0
+
+
+def load_manifest(manifest_path: str) -> list[dict]:
+    """
+    Entries {file, archivo, fuente, materia} of a YAML manifest: a list, or a
+    mapping with a ``documents`` list. Paths are relative to the manifest, and
+    file names must be unique (they identify a file's chunks).
+    """
+    import yaml
+
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        data = yaml.safe_load(f) or []
+    entries = (data.get("documents") or []) if isinstance(data, dict) else data
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    docs, archivos = [], set()
+    for i, entry in enumerate(entries, 1):
+        if not isinstance(entry, dict):
+            raise ValueError(f"La entrada {i} de {manifest_path} no es un objeto {{file, fuente, materia}}")
+        missing = [key for key in MANIFEST_KEYS if not entry.get(key)]
+        if missing:
+            raise ValueError(f"La entrada {i} de {manifest_path} no tiene: {', '.join(missing)}")
+        file_path = os.path.join(base_dir, entry["file"])
+        archivo = os.path.basename(file_path)
+        if archivo in archivos:
+            raise ValueError(f"Dos entradas de {manifest_path} usan el nombre de archivo {archivo!r}")
+        archivos.add(archivo)
+        docs.append({"file": file_path, "archivo": archivo, "fuente": entry["fuente"], "materia": entry["materia"]})
+    return docs
+
+
+class ManifestProgress:
+    """Counters shared by the stages, the progress line, and each stage's wall time."""
+
+    STAGES = ("extracción", "embeddings", "escritura")
+    COUNTERS = ("extraidos", "chunks", "embebidos", "escritos", "eliminados", "listos", "errores")
+
+    def __init__(self, files: int, verbose: bool = True):
+        self.files = files
+        self.verbose = verbose
+        self.counts = dict.fromkeys(self.COUNTERS, 0)
+        self.events: list[str] = []
+        self.spans: dict[str, tuple[float, float]] = {}
+        self.start = time.perf_counter()
+        self._printed = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, event: Optional[str] = None, **deltas: int):
+        """Add ``deltas`` to the counters; print the progress line (always with an ``event``)."""
+        with self._lock:
+            for key, delta in deltas.items():
+                self.counts[key] += delta
+            if event is not None:
+                self.events.append(event)
+            now = time.perf_counter()
+            if not self.verbose or (event is None and now - self._printed < 1.0):
+                return
+            self._printed = now
+            c = self.counts
+            line = (f"📦 {self._clock(now - self.start)} | extraídos {c['extraidos']}/{self.files}"
+                    f" | embeddings {c['embebidos']}/{c['chunks']} | escritos {c['escritos']}"
+                    f" | eliminados {c['eliminados']} | listos {c['listos']}/{self.files}")
+            print(f"{line} — {event}" if event else line, flush=True)
+
+    def fail(self, event: str, **deltas: int):
+        """A document ends with an error."""
+        self.add(f"❌ {event}", listos=1, errores=1, **deltas)
+
+    def mark(self, stage: str, started: float):
+        """Extend ``stage``'s span [first start, last end]."""
+        now = time.perf_counter()
+        with self._lock:
+            first, _ = self.spans.get(stage, (started, now))
+            self.spans[stage] = (min(first, started), now)
+
+    def summary(self) -> str:
+        total = time.perf_counter() - self.start
+        stages = ", ".join(
+            f"{stage} {self._clock(end - first)}" for stage in self.STAGES
+            for first, end in [self.spans.get(stage, (0.0, 0.0))]
+        )
+        return f"⏱️  Total {self._clock(total)} ({stages}; las etapas se solapan)"
+
+    @staticmethod
+    def _clock(seconds: float) -> str:
+        return f"{int(seconds // 60)}:{int(seconds % 60):02d}"
+
+
+def _rollback(conn):
+    """Roll back after an error; a dropped connection cannot, and must not kill the writer."""
+    try:
+        conn.rollback()
+    except Exception:
+        pass
+
+
+def run_manifest(
+    docs: list[dict],
+    prepare: Callable[[str, str], tuple],
+    db_pool,
+    embedder,
+    make_writer: Callable,
+    workers: int = 1,
+    extract_executor: Callable = ProcessPoolExecutor,
+    progress: Optional[ManifestProgress] = None,
+) -> ManifestProgress:
+    """
+    Ingest ``docs`` (load_manifest entries) and return the progress counters.
+
+    ``prepare(file, materia)`` returns (chunks generated, {hash: chunk}) and
+    runs in ``extract_executor`` (it must be picklable for processes).
+    ``db_pool`` hands out connections (getconn/putconn); ``make_writer(conn)``
+    returns a BulkWriter.
+    """
+    progress = progress or ManifestProgress(len(docs))
+    write_queue: queue.Queue = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+
+    def write_documents():
+        # Drains the queue until the sentinel whatever happens, so embedding threads never block
+        try:
+            conn = db_pool.getconn()
+        except Exception as e:
+            conn = None
+            print(f"❌ El escritor no obtuvo conexión a la base de datos: {e}")
+        while True:
+            job = write_queue.get()
+            if job is None:
+                break
+            doc, nuevos, rows, eliminados = job
+            if conn is None:
+                progress.fail(f"{doc['archivo']}: sin conexión a la base de datos")
+                continue
+            started = time.perf_counter()
+            try:
+                writer = make_writer(conn)
+                inserted = writer.write(rows)
+                if not sync_complete(nuevos, rows, writer):
+                    # Without every replacement row, the old ones stay (the next run retries)
+                    missing = len(nuevos) - inserted - writer.skipped
+                    progress.fail(f"{doc['archivo']}: {missing} de {len(nuevos)} chunks sin embedding o sin "
+                                  f"escribir; no se eliminó nada", escritos=inserted)
+                else:
+                    deleted = delete_chunks(conn, doc["fuente"], doc["archivo"], eliminados)
+                    progress.add(f"{doc['archivo']}: {inserted} escritos, {deleted} eliminados",
+                                 escritos=inserted, eliminados=deleted, listos=1)
+            except Exception as e:
+                _rollback(conn)
+                progress.fail(f"Error escribiendo {doc['archivo']}: {e}")
+            progress.mark("escritura", started)
+        if conn is not None:
+            try:
+                db_pool.putconn(conn)
+            except Exception:
+                pass
+
+    writer_thread = threading.Thread(target=write_documents, name="ingest-writer", daemon=True)
+
+    def enqueue(job):
+        while True:
+            try:
+                write_queue.put(job, timeout=WRITER_CHECK_S)
+                return
+            except queue.Full:
+                if not writer_thread.is_alive():
+                    raise RuntimeError("el escritor terminó antes de tiempo")
+
+    def embed_document(doc, nuevos, eliminados):
+        started = time.perf_counter()
+        try:
+            embeddings = embedder.embed([chunk["contenido"] for chunk in nuevos.values()],
+                                        progress=lambda n: progress.add(embebidos=n))
+        finally:
+            progress.mark("embeddings", started)
+        # Failed vectors come back as None: chunk_rows drops them, and the writer keeps the old rows
+        enqueue((doc, nuevos, chunk_rows(doc["fuente"], doc["materia"], doc["archivo"], nuevos, embeddings),
+                 eliminados))
+
+    lookup_conn = db_pool.getconn()
+    try:
+        ensure_schema(lookup_conn)
+        writer_thread.start()
+        with extract_executor(max_workers=workers) as extract_pool, \
+                ThreadPoolExecutor(max_workers=max(1, embedder.concurrency), thread_name_prefix="ingest-embed") as embed_pool:
+            started = time.perf_counter()
+            extractions = {extract_pool.submit(prepare, doc["file"], doc["materia"]): doc for doc in docs}
+            embeddings = {}
+            for future in as_completed(extractions):
+                doc = extractions[future]
+                progress.mark("extracción", started)
+                try:
+                    generated, unique_chunks = future.result()
+                    nuevos, eliminados = plan_sync(lookup_conn, doc["archivo"], unique_chunks)
+                except Exception as e:
+                    _rollback(lookup_conn)
+                    progress.fail(f"Error extrayendo {doc['archivo']}: {e}", extraidos=1)
+                    continue
+                progress.add(
+                    f"{doc['archivo']}: {generated} chunks, {len(nuevos)} nuevos o modificados, "
+                    f"{len(unique_chunks) - len(nuevos)} sin cambios",
+                    extraidos=1, chunks=len(nuevos),
+                )
+                embeddings[embed_pool.submit(embed_document, doc, nuevos, eliminados)] = doc
+            for future in as_completed(embeddings):
+                try:
+                    future.result()
+                except Exception as e:
+                    progress.fail(f"Error generando embeddings de {embeddings[future]['archivo']}: {e}")
+    finally:
+        if writer_thread.is_alive():
+            write_queue.put(None)
+            writer_thread.join()
+        db_pool.putconn(lookup_conn)
+    return progress
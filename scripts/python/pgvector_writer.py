@@ -0,0 +1,281 @@
+"""
+pgvector Writer - Bulk writes of embedded chunks into the documents table.
+
+ingest.py used to run one INSERT per chunk and commit once at the end: every
+row was a round-trip, and a failure midway lost the whole document.
+BulkWriter sends rows in batches of ``commit_every`` and commits each batch:
+
+    copy     COPY ... FROM STDIN (FORMAT BINARY). Vectors travel in pgvector's
+             binary format (vector_recv), so no float is printed or parsed.
+    values   psycopg2.extras.execute_values pages of multi-row INSERTs, for
+             servers or poolers where COPY is not available.
+
+If a batch fails, it is rolled back and its rows are retried one at a time,
+so only the offending rows are skipped (as with the old per-row INSERTs).
+
+With ``conflict_columns`` the writes are upserts that keep existing rows
+(ON CONFLICT DO NOTHING); COPY then goes through a temporary staging table.
+
+Incremental ingestion: every row records its source file (``archivo``) and
+a content hash (``hash_contenido``, unique per file). plan_sync,
+existing_hashes and delete_chunks let ingest.py write only new chunks and
+remove vanished ones; sync_complete gates the delete, so a run whose
+embeddings or writes failed never removes rows it did not replace.
+
+Usage:
+    writer = BulkWriter(conn, commit_every=500)
+    writer.write(rows)      # tuples in DOCUMENT_COLUMNS order
+"""
+
+import hashlib
+import io
+import struct
+import time
+from typing import Iterable, Iterator, Optional, Sequence, Tuple
+
+DOCUMENT_COLUMNS = ("fuente", "materia", "articulo", "contenido", "archivo", "hash_contenido", "embedding")
+CHUNK_KEY = ("archivo", "hash_contenido")
+DEFAULT_COMMIT_EVERY = 500
+METHODS = ("copy", "values")
+
+# COPY BINARY: signature, flags, header extension length / trailer
+COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+COPY_TRAILER = struct.pack("!h", -1)
+
+# Columns of incremental ingestion (also in scripts/setup_pgvector.sql), for
+# tables created before them
+SCHEMA_SQL = """
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS archivo TEXT;
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS hash_contenido TEXT;
+CREATE UNIQUE INDEX IF NOT EXISTS documents_archivo_hash_idx ON documents (archivo, hash_contenido);
+"""
+
+
+def encode_vector(values: Sequence[float]) -> bytes:
+    """pgvector's binary representation: int16 dim, int16 unused, float4 values (big-endian)."""
+    return struct.pack(f"!hh{len(values)}f", len(values), 0, *values)
+
+
+def vector_literal(values: Sequence[float]) -> str:
+    """pgvector's text representation ("[0.1,0.2,...]")."""
+    return f"[{','.join(map(str, values))}]"
+
+
+def clean_text(value: Optional[str]) -> Optional[str]:
+    """PDF extraction may leave NUL characters, which Postgres text rejects."""
+    return value.replace("\x00", "") if value is not None else None
+
+
+def _encode_field(value) -> bytes:
+    if value is None:
+        return struct.pack("!i", -1)
+    data = value.encode("utf-8") if isinstance(value, str) else encode_vector(value)
+    return struct.pack("!i", len(data)) + data
+
+
+def copy_binary(rows: Iterable[tuple]) -> bytes:
+    """A COPY BINARY payload of ``rows`` (text fields and one vector per row)."""
+    out = io.BytesIO()
+    out.write(COPY_HEADER)
+    for row in rows:
+        out.write(struct.pack("!h", len(row)))
+        for value in row:
+            out.write(_encode_field(value))
+    out.write(COPY_TRAILER)
+    return out.getvalue()
+
+
+def _batches(rows: Iterable[tuple], size: int) -> Iterator[list[tuple]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class BulkWriter:
+    """Writes rows to ``table`` in committed batches via COPY BINARY or execute_values."""
+
+    def __init__(
+        self,
+        conn,
+        table: str = "documents",
+        columns: Sequence[str] = DOCUMENT_COLUMNS,
+        method: str = "copy",
+        commit_every: int = DEFAULT_COMMIT_EVERY,
+        conflict_columns: Sequence[str] = (),
+        verbose: bool = True,
+    ):
+        if method not in METHODS:
+            raise ValueError(f"Método de escritura desconocido: {method!r}. Usa uno de {METHODS}")
+        self.conn = conn
+        self.table = table
+        self.columns = tuple(columns)
+        self.method = method
+        self.commit_every = max(1, commit_every)
+        self.verbose = verbose
+        # The vector is the last column
+        self._column_list = ", ".join(self.columns)
+        self._template = f"({'%s, ' * (len(self.columns) - 1)}%s::vector)"
+        self._on_conflict = (
+            f" ON CONFLICT ({', '.join(conflict_columns)}) DO NOTHING" if conflict_columns else ""
+        )
+        self._staging = f"_staging_{table}"
+        # Column that names a row in error messages
+        self._label_column = self.columns.index("articulo") if "articulo" in self.columns else 0
+        # Counters
+        self.written = 0
+        self.skipped = 0  # already present (conflicts)
+        self.failed = 0
+        self.seconds = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.written / self.seconds if self.seconds else 0.0
+
+    def write(self, rows: Iterable[tuple], total: Optional[int] = None) -> int:
+        """Write ``rows`` (column order of ``columns``); returns how many were written."""
+        written_before = self.written
+        for batch in _batches(rows, self.commit_every):
+            batch = [tuple(clean_text(v) if isinstance(v, str) else v for v in row) for row in batch]
+            start = time.perf_counter()
+            try:
+                with self.conn.cursor() as cur:
+                    if self.method == "copy":
+                        inserted = self._copy(cur, batch)
+                    else:
+                        inserted = self._values(cur, batch)
+                self.conn.commit()
+                self.written += inserted
+                self.skipped += len(batch) - inserted
+            except Exception as e:
+                self.conn.rollback()
+                print(f"Error escribiendo un lote de {len(batch)} registros ({e}); reintentando uno a uno...")
+                self._write_one_by_one(batch)
+            self.seconds += time.perf_counter() - start
+            if self.verbose:
+                done = self.written - written_before
+                print(f"Escritos {done}{f'/{total}' if total else ''} registros "
+                      f"({self.rows_per_second:.0f} registros/s)")
+        return self.written - written_before
+
+    def _copy(self, cur, batch: list[tuple]) -> int:
+        """COPY ``batch``; returns the number of rows inserted."""
+        payload = io.BytesIO(copy_binary(batch))
+        if not self._on_conflict:
+            cur.copy_expert(f"COPY {self.table} ({self._column_list}) FROM STDIN WITH (FORMAT BINARY)", payload)
+            return len(batch)
+        # COPY has no ON CONFLICT: stage the batch, then insert what is new
+        cur.execute(
+            f"CREATE TEMP TABLE IF NOT EXISTS {self._staging}"
+            f" (LIKE {self.table} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+        )
+        cur.copy_expert(f"COPY {self._staging} ({self._column_list}) FROM STDIN WITH (FORMAT BINARY)", payload)
+        cur.execute(
+            f"INSERT INTO {self.table} ({self._column_list})"
+            f" SELECT {self._column_list} FROM {self._staging}{self._on_conflict}"
+        )
+        return cur.rowcount
+
+    def _values(self, cur, batch: list[tuple]) -> int:
+        """execute_values ``batch`` (a single page); returns the number of rows inserted."""
+        from psycopg2.extras import execute_values
+
+        execute_values(
+            cur,
+            f"INSERT INTO {self.table} ({self._column_list}) VALUES %s{self._on_conflict}",
+            [(*row[:-1], vector_literal(row[-1])) for row in batch],
+            template=self._template,
+            page_size=len(batch),
+        )
+        return cur.rowcount
+
+    def _write_one_by_one(self, batch: list[tuple]):
+        for row in batch:
+            try:
+                with self.conn.cursor() as cur:
+                    cur.execute(
+                        f"INSERT INTO {self.table} ({self._column_list}) VALUES {self._template}{self._on_conflict}",
+                        (*row[:-1], vector_literal(row[-1])),
+                    )
+                    inserted = cur.rowcount
+                self.conn.commit()
+                self.written += inserted
+                self.skipped += 1 - inserted
+            except Exception as e:
+                self.conn.rollback()
+                self.failed += 1
+                print(f"Error procesando el chunk {row[self._label_column]}: {e}")
+
+
+# ---------------------------------------------------------------------------
+# Incremental ingestion
+# ---------------------------------------------------------------------------
+
+def chunk_hash(chunk: dict, materia: str, chunker_version: str, model: str) -> str:
+    """Hash of everything that determines a row: chunker version, model, materia, article and content."""
+    key = "\x00".join([chunker_version, model, materia, chunk["articulo"], chunk["contenido"]])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def plan_sync(conn, archivo: str, unique_chunks: dict) -> Tuple[dict, set]:
+    """(chunks of ``unique_chunks`` not stored yet, stored hashes no longer in the source)."""
+    stored = existing_hashes(conn, archivo)
+    nuevos = {h: chunk for h, chunk in unique_chunks.items() if h not in stored}
+    return nuevos, stored - unique_chunks.keys()
+
+
+def chunk_rows(fuente: str, materia: str, archivo: str, nuevos: dict, embeddings: Sequence) -> list[tuple]:
+    """Rows (DOCUMENT_COLUMNS order) of the chunks in ``nuevos`` that got a vector."""
+    return [
+        (fuente, materia, chunk["articulo"], chunk["contenido"], archivo, h, embedding)
+        for (h, chunk), embedding in zip(nuevos.items(), embeddings)
+        if embedding is not None
+    ]
+
+
+def sync_complete(nuevos: dict, rows: Sequence[tuple], writer: Optional[BulkWriter]) -> bool:
+    """
+    Whether every new chunk got a vector and was written. Only then may the
+    replaced and legacy rows be deleted; otherwise the next run retries.
+    """
+    return len(rows) == len(nuevos) and (writer is None or writer.failed == 0)
+
+
+def ensure_schema(conn):
+    """Add the incremental ingestion columns and index if the table predates them."""
+    with conn.cursor() as cur:
+        cur.execute(SCHEMA_SQL)
+    conn.commit()
+
+
+def existing_hashes(conn, archivo: str) -> set[str]:
+    """Content hashes of the chunks already stored for source file ``archivo``."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT hash_contenido FROM documents WHERE archivo = %s AND hash_contenido IS NOT NULL", (archivo,))
+        return {row[0] for row in cur.fetchall()}
+
+
+def delete_chunks(conn, fuente: str, archivo: str, hashes: Iterable[str]) -> int:
+    """
+    Delete the chunks of ``archivo`` with ``hashes`` (gone from the source),
+    plus the rows of ``fuente`` ingested before content hashes existed.
+    Returns the number of rows deleted.
+
+    Legacy rows carry no file name, so they can only be matched by
+    ``fuente``: the first incremental run of one file of a fuente (e.g.
+    codigo-civil.pdf) also clears the legacy rows of its other files
+    (código civil.txt) until those are ingested too, as --manifest does.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            "DELETE FROM documents WHERE (archivo = %s AND hash_contenido = ANY(%s))"
+            " OR (fuente = %s AND hash_contenido IS NULL)",
+            (archivo, list(hashes), fuente),
+        )
+        deleted = cur.rowcount
+    conn.commit()
+    return deleted
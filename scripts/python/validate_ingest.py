@@ -4,6 +4,9 @@ import psycopg2
 from openai import OpenAI
 import httpx
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../..'))
+from agents.embedding_cache import get_embedding_cache
+
 def load_env():
     env_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../.env')
     try:
@@ -26,6 +29,10 @@ if not os.environ.get("OPENAI_API_KEY"):
     sys.exit(1)
 client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"), http_client=httpx.Client(verify=False))
 
+def create_embeddings(texts):
+    response = client.embeddings.create(model="text-embedding-3-small", input=texts)
+    return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+
 def print_separator(title=""):
     print(f"\n{'=' * 20} {title} {'=' * 20}\n" if title else f"\n{'=' * 50}\n")
 
@@ -78,6 +85,8 @@ def check_documents_table(cur):
         'materia': 'text',
         'articulo': 'text',
         'contenido': 'text',
+        'archivo': 'text',
+        'hash_contenido': 'text',
         'embedding': 'USER-DEFINED' # pgvector column shows up as USER-DEFINED in information_schema
     }
     
@@ -130,11 +139,12 @@ def test_semantic_search(cur):
     
     print("Generando embedding (text-embedding-3-small)...")
     try:
-        response = client.embeddings.create(
-            model="text-embedding-3-small",
-            input=query
-        )
-        query_embedding = response.data[0].embedding
+        cache = get_embedding_cache()
+        if cache is not None:
+            query_embedding = cache.embed([query], "text-embedding-3-small", None, create_embeddings)[0]
+            print(cache.summary())
+        else:
+            query_embedding = create_embeddings([query])[0]
     except Exception as e:
         print(f"❌ Error generando el embedding en OpenAI: {e}")
         print("💡 Instrucciones de Fix: Verifica tu OPENAI_API_KEY y que tengas saldo disponible en tu cuenta.")
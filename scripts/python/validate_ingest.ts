@@ -53,7 +53,7 @@ async function checkTable(client: any) {
         foundCols.add(row.column_name);
     });
 
-    const expected = ['id', 'fuente', 'materia', 'articulo', 'contenido', 'embedding'];
+    const expected = ['id', 'fuente', 'materia', 'articulo', 'contenido', 'archivo', 'hash_contenido', 'embedding'];
     const missing = expected.filter(col => !foundCols.has(col));
 
     if (missing.length > 0) {
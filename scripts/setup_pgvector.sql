@@ -6,7 +6,14 @@ CREATE TABLE IF NOT EXISTS documents (
     materia TEXT NOT NULL,
     articulo TEXT,
     contenido TEXT NOT NULL,
+    archivo TEXT,
+    hash_contenido TEXT,
     embedding vector(1536)
 );
 
+-- Ingesta incremental (ingest.py): tablas creadas antes de estas columnas
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS archivo TEXT;
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS hash_contenido TEXT;
+CREATE UNIQUE INDEX IF NOT EXISTS documents_archivo_hash_idx ON documents (archivo, hash_contenido);
+
 CREATE INDEX ON documents USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64);